@@ -3,13 +3,14 @@ import os
 import socket
 
 from core import app, socketio
-from core import timer_attivi
 from auth import accesso_richiesto, ottieni_utente_loggato, richiedi_permesso
 from db import esegui_query, ottieni_db
 from services import (
-    cambia_stato_automatico,
+    ascolta_modifiche_db,
+    completa_scaduti,
     emissione_sicura,
     ottieni_ordini_per_categoria,
+    recupera_completamenti,
     ricalcola_statistiche,
 )
 import routes
@@ -30,4 +31,8 @@ if __name__ == "__main__":
         socket_udp.close()
     modalita_debug = os.getenv("DEBUG", "False").lower() == "true"
     logger.info("Avvio server Byte-Bite - http://%s:8000 (debug=%s)", ip_locale, modalita_debug)
+    # I timer in sospeso prima del riavvio ripartono da quanto salvato su DB.
+    recupera_completamenti()
+    # Scritture esterne (reset_db.py, SQL manuale, altre istanze) arrivano dal feed del DB.
+    socketio.start_background_task(ascolta_modifiche_db)
     socketio.run(app, host="0.0.0.0", port=8000, debug=modalita_debug)
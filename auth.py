@@ -1,12 +1,153 @@
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
+import bcrypt
 from flask import abort, redirect, request, session, url_for
 
+from core import socketio
 from db import esegui_query
 
 logger = logging.getLogger(__name__)
 
+# Cache dei permessi per processo: utente -> (scadenza, pagine permesse).
+# Le route utenti la invalidano; il TTL limita il ritardo verso gli altri worker.
+_PERMESSI_TTL_SEC = float(os.getenv("PERMESSI_CACHE_TTL_SEC", "30"))
+_permessi_cache = {}
+_permessi_lock = threading.Lock()
+# Cresce a ogni invalidazione: un caricamento iniziato prima non viene salvato.
+_generazione_permessi = 0
+_contatori_permessi = {"trovati": 0, "mancati": 0}
+
+
+def _pagine_permesse(id_utente):
+    """Pagine accessibili all'utente, dalla cache o (una query) dal database."""
+    adesso = time.monotonic()
+    with _permessi_lock:
+        voce = _permessi_cache.get(id_utente)
+        if voce is not None and voce[0] > adesso:
+            _contatori_permessi["trovati"] += 1
+            return voce[1]
+        _contatori_permessi["mancati"] += 1
+        generazione = _generazione_permessi
+
+    righe = esegui_query("SELECT pagina FROM permessi_pagine WHERE utente_id = %s", (id_utente,))
+    pagine = frozenset(riga["pagina"] for riga in righe)
+
+    with _permessi_lock:
+        if generazione == _generazione_permessi:
+            _permessi_cache[id_utente] = (adesso + _PERMESSI_TTL_SEC, pagine)
+    return pagine
+
+
+def invalida_permessi(id_utente=None):
+    """Scarta i permessi in cache di un utente (o di tutti, senza argomenti)."""
+    global _generazione_permessi
+    with _permessi_lock:
+        _generazione_permessi += 1
+        if id_utente is None:
+            _permessi_cache.clear()
+        else:
+            _permessi_cache.pop(id_utente, None)
+
+
+def contatori_permessi():
+    """Verifiche servite dalla cache ("trovati") e lette dal database ("mancati")."""
+    with _permessi_lock:
+        return dict(_contatori_permessi)
+
+
+# bcrypt è CPU-bound (~250 ms al costo 12): gira su thread reali, mai sul loop
+# gevent/eventlet che serve richieste e websocket. Il costo resta quello storico
+# (4); le installazioni lo alzano con BCRYPT_COSTO.
+_COSTO_BCRYPT = int(os.getenv("BCRYPT_COSTO", "4"))
+_PASSWORD_WORKER = int(os.getenv("PASSWORD_WORKER", "2"))
+_PASSWORD_CODA_MAX = int(os.getenv("PASSWORD_CODA_MAX", "32"))
+_esecutore_password = None
+_password_lock = threading.Lock()
+_password_in_corso = 0
+_contatori_password = {"richieste": 0, "rifiutate": 0, "attesa_totale_ms": 0.0, "attesa_max_ms": 0.0}
+
+
+class CodaPasswordPiena(RuntimeError):
+    """Troppe verifiche o hash di password in attesa: la richiesta va ritentata."""
+
+
+def _esecutore():
+    """Funzione che esegue un lavoro su un thread reale attendendolo senza bloccare il loop."""
+    global _esecutore_password
+    if socketio.async_mode == "eventlet":
+        from eventlet import tpool
+        return tpool.execute
+    if socketio.async_mode in ("gevent", "gevent_uwsgi"):
+        import gevent
+        return gevent.get_hub().threadpool.apply
+    with _password_lock:
+        if _esecutore_password is None:
+            _esecutore_password = ThreadPoolExecutor(max_workers=_PASSWORD_WORKER, thread_name_prefix="password")
+    return lambda lavoro: _esecutore_password.submit(lavoro).result()
+
+
+def _esegui_fuori_loop(funzione, *argomenti):
+    """Esegue funzione(*argomenti) nel pool password, rifiutando oltre PASSWORD_CODA_MAX in attesa."""
+    global _password_in_corso
+    with _password_lock:
+        if _password_in_corso >= _PASSWORD_CODA_MAX:
+            _contatori_password["rifiutate"] += 1
+            raise CodaPasswordPiena("Coda password piena")
+        _password_in_corso += 1
+        _contatori_password["richieste"] += 1
+    inviata = time.monotonic()
+
+    def lavoro():
+        attesa_ms = (time.monotonic() - inviata) * 1000
+        with _password_lock:
+            _contatori_password["attesa_totale_ms"] += attesa_ms
+            _contatori_password["attesa_max_ms"] = max(_contatori_password["attesa_max_ms"], attesa_ms)
+        return funzione(*argomenti)
+
+    try:
+        return _esecutore()(lavoro)
+    finally:
+        with _password_lock:
+            _password_in_corso -= 1
+
+
+def verifica_password(password, password_hash):
+    """Confronta la password con l'hash bcrypt salvato, fuori dal loop delle richieste."""
+    return _esegui_fuori_loop(bcrypt.checkpw, password.encode(), password_hash.encode())
+
+
+def genera_hash_password(password):
+    """Hash bcrypt della password al costo BCRYPT_COSTO, fuori dal loop delle richieste."""
+    sale = bcrypt.gensalt(rounds=_COSTO_BCRYPT)
+    return _esegui_fuori_loop(bcrypt.hashpw, password.encode(), sale).decode()
+
+
+def contatori_password():
+    """Operazioni eseguite e rifiutate, con attesa media e massima in coda (ms)."""
+    with _password_lock:
+        richieste = _contatori_password["richieste"]
+        return {
+            "richieste": richieste,
+            "rifiutate": _contatori_password["rifiutate"],
+            "attesa_media_ms": _contatori_password["attesa_totale_ms"] / richieste if richieste else 0.0,
+            "attesa_max_ms": _contatori_password["attesa_max_ms"],
+        }
+
+
+def istantanea_utente(riga):
+    """Snapshot compatto dell'utente tenuto in sessione (vedi ottieni_utente_loggato)."""
+    return {
+        "id": riga["id"],
+        "username": riga["username"],
+        "is_admin": riga["is_admin"],
+        "attivo": riga["attivo"],
+    }
+
 
 def ottieni_utente_loggato():
     """Recupera i dati dell'utente attualmente loggato dalla sessione (cache) o dal DB."""
@@ -16,31 +157,24 @@ def ottieni_utente_loggato():
         # Nessuna sessione: nessun utente loggato.
         return None
 
-    # Se la cache in sessione è coerente, evita una query al DB.
-    if session.get("user_cache_id") == id_utente:
-        # Struttura standard usata da permessi e template.
-        return {
-            "id": session["user_cache_id"],
-            "username": session["user_cache_username"],
-            "is_admin": session["user_cache_is_admin"],
-            "attivo": session["user_cache_attivo"],
-        }
+    # Se lo snapshot in sessione è coerente, evita una query al DB.
+    # Con le sessioni lato server le modifiche all'utente lo aggiornano in place (vedi sessioni.py).
+    utente = session.get("utente")
+    if utente and utente["id"] == id_utente:
+        return utente
 
     # Prima richiesta o cache invalida: carica dal database.
-    utente = esegui_query(
+    riga = esegui_query(
         "SELECT id, username, is_admin, attivo FROM utenti WHERE id = %s",
         (id_utente,),
         uno=True,
     )
+    if not riga:
+        return None
 
-    if utente:
-        # Aggiorna la cache per le richieste successive.
-        session["user_cache_id"] = utente["id"]
-        session["user_cache_username"] = utente["username"]
-        session["user_cache_is_admin"] = utente["is_admin"]
-        session["user_cache_attivo"] = utente["attivo"]
-
-    # Ritorna la riga (sq.Row) o None se l'utente non esiste.
+    # Aggiorna lo snapshot per le richieste successive.
+    utente = istantanea_utente(riga)
+    session["utente"] = utente
     return utente
 
 
@@ -95,17 +229,8 @@ def richiedi_permesso(pagina):
             if utente["is_admin"]:
                 return f(*args, **kwargs)
 
-            # Verifica il permesso specifico per la pagina richiesta.
-            permesso = esegui_query(
-                """
-                SELECT 1 FROM permessi_pagine
-                WHERE utente_id = %s AND pagina = %s
-            """,
-                (utente["id"], pagina),
-                uno=True,
-            )
-
-            if permesso:
+            # Verifica il permesso specifico per la pagina richiesta (cache per processo).
+            if pagina in _pagine_permesse(utente["id"]):
                 # Permesso presente: esegue la route.
                 return f(*args, **kwargs)
 
@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+
+import socketio
+
+from db import ascolta_notifiche, esegui_query
+
+logger = logging.getLogger(__name__)
+
+# Backend di distribuzione tra worker: vuoto (un solo processo), "postgres"
+# (LISTEN/NOTIFY sul database dell'app) o un URL gestito da Flask-SocketIO
+# (es. redis://localhost:6379/0 per Redis o un sostituto compatibile).
+_CODA = os.getenv("SOCKETIO_CODA", "").strip()
+_CANALE = os.getenv("SOCKETIO_CANALE", "byte_bite_socketio")
+
+# NOTIFY accetta payload fino a 8000 byte: oltre, il messaggio passa da tabella.
+_PAYLOAD_NOTIFY_MAX = 7900
+
+_QUERY_PUBBLICA_GRANDE = """
+    WITH evento AS (
+        INSERT INTO eventi_socketio (payload) VALUES (%(payload)s) RETURNING id
+    ), pulizia AS (
+        DELETE FROM eventi_socketio WHERE creato < CURRENT_TIMESTAMP - INTERVAL '1 minute'
+    )
+    SELECT pg_notify(%(canale)s, '#' || id) FROM evento
+"""
+
+
+class GestoreCodaPostgres(socketio.PubSubManager):
+    """Client manager Socket.IO che distribuisce gli eventi con PostgreSQL LISTEN/NOTIFY.
+
+    Ogni worker pubblica sul canale e ascolta su una connessione dedicata: le
+    emissioni (comprese quelle replicate ad "amministrazione") raggiungono i
+    client di tutti i processi.
+    """
+
+    name = "postgres"
+
+    def _publish(self, data):
+        payload = json.dumps(data, default=str)
+        if len(payload.encode("utf-8")) <= _PAYLOAD_NOTIFY_MAX:
+            esegui_query("SELECT pg_notify(%s, %s)", (self.channel, payload), commit=True)
+        else:
+            esegui_query(_QUERY_PUBBLICA_GRANDE, {"canale": self.channel, "payload": payload}, commit=True)
+
+    def _leggi_payload(self, payload):
+        """Decodifica una notifica; "#<id>" rimanda a un messaggio salvato in tabella."""
+        if payload.startswith("#"):
+            riga = esegui_query("SELECT payload FROM eventi_socketio WHERE id = %s", (int(payload[1:]),), uno=True)
+            if riga is None:
+                logger.warning("Evento Socket.IO %s non più disponibile", payload)
+                return None
+            payload = riga["payload"]
+        return json.loads(payload)
+
+    def _listen(self):
+        # Gira in un task di background del server: ascolta_notifiche attende con le
+        # primitive del modello asincrono, senza fermare le altre greenlet del worker.
+        for blocco in ascolta_notifiche(self.channel):
+            # None segnala una riconnessione: i messaggi persi non sono recuperabili.
+            for payload in blocco or ():
+                dati = self._leggi_payload(payload)
+                if dati is not None:
+                    yield dati
+
+
+def opzioni_coda_socketio():
+    """Argomenti per SocketIO(...) secondo il backend configurato in SOCKETIO_CODA."""
+    if not _CODA:
+        return {}
+    if _CODA == "postgres":
+        logger.info("Socket.IO multi-worker via PostgreSQL LISTEN/NOTIFY (canale: %s)", _CANALE)
+        return {"client_manager": GestoreCodaPostgres(channel=_CANALE)}
+    logger.info("Socket.IO multi-worker via coda di messaggi %s", _CODA.split("://", 1)[0])
+    return {"message_queue": _CODA, "channel": _CANALE}
@@ -6,7 +6,10 @@ from dotenv import load_dotenv
 from flask import Flask, request
 from flask_socketio import SocketIO
 
+from coda_socketio import opzioni_coda_socketio
+from db import attiva_connessione_richiesta, configura_attese, rilascia_connessione_richiesta
 from logger import configura_logging
+from sessioni import configura_sessioni
 
 load_dotenv()
 
@@ -15,24 +18,35 @@ configura_logging(debug=modalita_debug)
 
 logger = logging.getLogger(__name__)
 
-# Stato condiviso per timer realtime dashboard.
-timer_attivi = {}
-
 app = Flask(__name__)
 
 # Imposta una chiave di sessione stabile (da env) o generata al volo.
 app.secret_key = os.getenv("SECRET_KEY", secrets.token_hex(32))
 
+# Con SESSIONI_BACKEND il cookie porta solo un id: i dati restano sul server.
+configura_sessioni(app)
+
 logger.info("Applicazione Byte-Bite inizializzata (debug=%s)", modalita_debug)
 
 
+# Le query di una richiesta condividono una connessione, restituita al pool a fine richiesta.
+app.before_request(attiva_connessione_richiesta)
+app.teardown_request(rilascia_connessione_richiesta)
+
+
 @app.errorhandler(403)
 def errore_403(error):
     logger.warning("Accesso negato (403) - URL: %s, IP: %s", request.path, request.remote_addr)
     return "403 Forbidden", 403
 
 
+# Con SOCKETIO_CODA configurata le stanze sono condivise tra tutti i worker.
 socketio = SocketIO(
     app,
     cors_allowed_origins="*",
+    **opzioni_coda_socketio(),
 )
+
+# Pool DB e ascolto LISTEN attendono con le primitive del modello asincrono scelto
+# (eventlet, gevent o thread).
+configura_attese(socketio.async_mode, socketio.server.eio.create_event, socketio.sleep)
@@ -1,12 +1,15 @@
 """
 Script per inizializzare il database (SQLite o PostgreSQL a seconda dell'ambiente).
-Crea lo schema leggendo da db.sql, poi inserisce utente admin e prodotti di default.
+Crea lo schema leggendo da db.sql (più db_postgres.sql su PostgreSQL), poi inserisce
+utente admin e prodotti di default.
 """
 import os
 import sqlite3 as sq
 import psycopg2
 import bcrypt
 
+from db import istruzioni_sql
+
 # Variabili di ambiente per PostgreSQL
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
@@ -15,6 +18,8 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
 PERCORSO_SCHEMA = "db.sql"
+# Tabelle UNLOGGED, migrazioni e trigger: solo PostgreSQL, dopo lo schema comune.
+PERCORSO_SCHEMA_POSTGRES = "db_postgres.sql"
 
 PRODOTTI_DEFAULT = [
     # (nome, prezzo, categoria_menu, categoria_dashboard, disponibile, quantita, venduti)
@@ -176,22 +181,13 @@ def crea_schema_postgres():
         )
         cursore = connessione_postgres.cursor()
 
-        with open(PERCORSO_SCHEMA, "r") as file_schema:
-            schema = file_schema.read()
+        schema = ""
+        for percorso in (PERCORSO_SCHEMA, PERCORSO_SCHEMA_POSTGRES):
+            with open(percorso, "r") as file_schema:
+                schema += file_schema.read() + "\n"
 
-        lista_query = []
-        query_corrente = []
-
-        for riga in schema.split('\n'):
-            if '--' in riga:
-                riga = riga[:riga.index('--')]
-            riga = riga.strip()
-            if riga:
-                query_corrente.append(riga)
-            if ';' in riga:
-                query = ' '.join(query_corrente)
-                lista_query.append(query.replace(';', '').strip())
-                query_corrente = []
+        # Divide sul ";" di fine istruzione, lasciando intatti i corpi delle funzioni ($$ ... $$).
+        lista_query = istruzioni_sql(schema)
 
         for i, query in enumerate(lista_query):
             if query:
@@ -1,42 +1,393 @@
+import collections
 import contextlib
+import contextvars
 import logging
 import os
+import select
+import socket
+import threading
+import time
+
 import psycopg2
+from flask import g, has_request_context
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 
 logger = logging.getLogger(__name__)
 
+# Dimensioni e tempi del pool (configurabili da env).
+_POOL_MINIMO = int(os.getenv("DB_POOL_MIN", "1"))
+_POOL_MASSIMO = int(os.getenv("DB_POOL_MAX", "10"))
+_POOL_TIMEOUT_SEC = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+_POOL_VERIFICA_SEC = float(os.getenv("DB_POOL_VERIFICA_SEC", "30"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Connessione della transazione esplicita in corso (vedi transazione()).
+_connessione_transazione = contextvars.ContextVar("connessione_transazione", default=None)
+
+# Primitive di attesa: thread di default, sostituite da core.py con quelle del
+# modello asincrono di Socket.IO (vedi configura_attese). Un'attesa bloccante sotto
+# eventlet o gevent fermerebbe l'intero hub, comprese le greenlet che dovrebbero
+# restituire connessioni al pool o servire richieste e websocket.
+_crea_evento = threading.Event
+_seleziona = select.select
+_dormi = time.sleep
+
+
+def configura_attese(modalita, crea_evento, dormi):
+    """Fa attendere pool e ascolto LISTEN con le primitive del modello asincrono in uso."""
+    global _crea_evento, _seleziona, _dormi
+    _crea_evento = crea_evento
+    _dormi = dormi
+    if modalita == "eventlet":
+        from eventlet.green import select as select_verde
+        _seleziona = select_verde.select
+    elif modalita in ("gevent", "gevent_uwsgi"):
+        from gevent import select as select_verde
+        _seleziona = select_verde.select
+    else:
+        _seleziona = select.select
+
+
+class PoolEsaurito(psycopg2.OperationalError):
+    """Nessuna connessione libera entro il timeout configurato."""
+
+
+def _parametri_connessione():
+    """Legge i parametri di connessione dalle variabili d'ambiente."""
+    return {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+        "database": os.getenv("DB_NAME", "byte_bite"),
+        "user": os.getenv("DB_USER", "byte_bite_user"),
+        "password": os.getenv("DB_PASSWORD", "secure_password_change_me"),
+        "connect_timeout": 30,
+        # Fuso orario e origine viaggiano nello startup packet: nessun round trip in più.
+        "options": f"-c timezone=Europe/Rome -c byte_bite.origine={origine_processo()}",
+    }
+
+
+def origine_processo():
+    """Identifica le scritture di questo processo nel feed delle modifiche (vedi db.sql)."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def istruzioni_sql(testo):
+    """Divide uno script SQL in istruzioni sul ";" di fine riga, rispettando i corpi $$ ... $$."""
+    istruzioni = []
+    correnti = []
+    in_corpo = False
+    for riga in testo.splitlines():
+        riga = riga.split("--", 1)[0].rstrip()
+        if not riga.strip():
+            continue
+        correnti.append(riga)
+        if riga.count("$$") % 2:
+            in_corpo = not in_corpo
+        if not in_corpo and riga.endswith(";"):
+            istruzioni.append("\n".join(correnti)[:-1].strip())
+            correnti = []
+    if correnti:
+        istruzioni.append("\n".join(correnti).strip())
+    return istruzioni
+
+
+class PoolConnessioni:
+    """Pool limitato di connessioni PostgreSQL, condiviso tra thread e greenlet."""
+
+    def __init__(self, minimo, massimo, timeout, intervallo_verifica):
+        self._minimo = max(0, minimo)
+        self._massimo = max(1, massimo, self._minimo)
+        self._timeout = timeout
+        self._intervallo_verifica = intervallo_verifica
+        # Connessioni libere come coppie (connessione, istante ultimo rilascio).
+        self._liberi = collections.deque()
+        self._aperte = 0
+        # Il lock protegge solo lo stato (mai tenuto durante un'attesa); chi aspetta
+        # lo fa sul proprio evento, risvegliato in ordine di arrivo.
+        self._lock = threading.Lock()
+        self._in_attesa = collections.deque()
+
+        # Pre-apre il minimo richiesto per evitare handshake sul primo picco.
+        for _ in range(self._minimo):
+            self._liberi.append((self._apri(), time.monotonic()))
+            self._aperte += 1
+
+    def _risveglia(self):
+        """Segnala al primo in attesa che si è liberato un posto (col lock acquisito)."""
+        if self._in_attesa:
+            self._in_attesa.popleft().set()
+
+    def _apri(self):
+        parametri = _parametri_connessione()
+        try:
+            connessione = psycopg2.connect(**parametri)
+        except psycopg2.Error as e:
+            logger.error(
+                "Impossibile connettersi al database (host: %s:%s, db: %s): %s",
+                parametri["host"], parametri["port"], parametri["database"], e,
+            )
+            raise
+        connessione.cursor_factory = RealDictCursor
+        return connessione
+
+    def _sana(self, connessione, ultimo_uso):
+        """Verifica la connessione prima di prestarla (ping solo se inattiva da tempo)."""
+        if connessione.closed:
+            return False
+        if time.monotonic() - ultimo_uso < self._intervallo_verifica:
+            return True
+        try:
+            with connessione.cursor() as cur:
+                cur.execute("SELECT 1")
+            connessione.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _chiudi(self, connessione):
+        try:
+            connessione.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self._aperte -= 1
+            self._risveglia()
+
+    def acquisisci(self):
+        """Preleva una connessione sana, aprendone una nuova se sotto il massimo."""
+        scadenza = time.monotonic() + self._timeout
+        while True:
+            evento = None
+            connessione = None
+            with self._lock:
+                if self._liberi:
+                    # LIFO: riusa la connessione più "calda".
+                    connessione, ultimo_uso = self._liberi.pop()
+                elif self._aperte < self._massimo:
+                    self._aperte += 1
+                else:
+                    evento = _crea_evento()
+                    self._in_attesa.append(evento)
+
+            if evento is not None:
+                residuo = scadenza - time.monotonic()
+                if residuo > 0 and evento.wait(residuo):
+                    continue
+                with self._lock:
+                    try:
+                        self._in_attesa.remove(evento)
+                    except ValueError:
+                        # Risvegliato proprio alla scadenza: il posto passa al prossimo.
+                        self._risveglia()
+                logger.error("Pool connessioni esaurito (massimo: %s)", self._massimo)
+                raise PoolEsaurito("Nessuna connessione disponibile nel pool")
+
+            if connessione is None:
+                try:
+                    return self._apri()
+                except psycopg2.Error:
+                    with self._lock:
+                        self._aperte -= 1
+                        self._risveglia()
+                    raise
+
+            if self._sana(connessione, ultimo_uso):
+                return connessione
+            logger.warning("Connessione del pool non valida, scartata")
+            self._chiudi(connessione)
+
+    def rilascia(self, connessione):
+        """Restituisce la connessione al pool chiudendo eventuali transazioni aperte."""
+        if not connessione.closed:
+            try:
+                if connessione.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    connessione.rollback()
+            except psycopg2.Error:
+                pass
+        if connessione.closed or connessione.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            self._chiudi(connessione)
+            return
+        with self._lock:
+            self._liberi.append((connessione, time.monotonic()))
+            self._risveglia()
+
+    def chiudi(self):
+        """Chiude tutte le connessioni libere."""
+        with self._lock:
+            liberi = list(self._liberi)
+            self._liberi.clear()
+        for connessione, _ in liberi:
+            self._chiudi(connessione)
+
+
+def _ottieni_pool():
+    """Crea il pool al primo utilizzo (dopo il caricamento delle variabili d'ambiente)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolConnessioni(_POOL_MINIMO, _POOL_MASSIMO, _POOL_TIMEOUT_SEC, _POOL_VERIFICA_SEC)
+                logger.info("Pool connessioni inizializzato (min: %s, max: %s)", _POOL_MINIMO, _POOL_MASSIMO)
+    return _pool
+
+
+def chiudi_pool():
+    """Chiude il pool corrente; il successivo utilizzo ne crea uno nuovo."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.chiudi()
+
+
+def apri_connessione_dedicata():
+    """Connessione fuori dal pool in autocommit, per usi di lunga durata (es. LISTEN)."""
+    connessione = psycopg2.connect(**_parametri_connessione())
+    connessione.set_session(autocommit=True)
+    return connessione
+
+
+def ascolta_notifiche(canale, attesa=1.0, ritardo_riconnessione=2.0, fermo=None):
+    """Generatore dei payload NOTIFY del canale, a blocchi (una lista per risveglio).
+
+    Usa una connessione dedicata e si riconnette da solo se cade; dopo ogni
+    riconnessione produce None, perché le notifiche intermedie sono perse.
+    Attese e pause passano da configura_attese: sotto eventlet o gevent cedono
+    l'hub alle altre greenlet invece di bloccarlo. Con fermo (un evento) il
+    generatore termina entro `attesa` secondi dal set().
+    """
+    def attivo():
+        return fermo is None or not fermo.is_set()
+
+    riconnessione = False
+    while attivo():
+        connessione = None
+        try:
+            connessione = apri_connessione_dedicata()
+            with connessione.cursor() as cursore:
+                cursore.execute(f'LISTEN "{canale}"')
+            logger.info("In ascolto sul canale '%s'", canale)
+            if riconnessione:
+                yield None
+            while attivo():
+                if not _seleziona([connessione], [], [], attesa)[0]:
+                    continue
+                connessione.poll()
+                payload = [notifica.payload for notifica in connessione.notifies]
+                connessione.notifies.clear()
+                if payload:
+                    yield payload
+            return
+        except psycopg2.Error as e:
+            logger.error("Ascolto del canale '%s' interrotto, nuovo tentativo: %s", canale, e)
+        finally:
+            if connessione is not None and not connessione.closed:
+                connessione.close()
+        riconnessione = True
+        _dormi(ritardo_riconnessione)
+
+
+def attiva_connessione_richiesta():
+    """Hook before_request: le query della richiesta condivideranno una connessione."""
+    g._db_condivisa = True
+
+
+def _connessione_richiesta():
+    """Connessione condivisa dalla richiesta corrente, presa dal pool al primo uso."""
+    connessione = g.get("_db_connessione")
+    if connessione is None or connessione.closed:
+        if connessione is not None:
+            _restituisci_connessione_richiesta()
+        pool = _ottieni_pool()
+        connessione = pool.acquisisci()
+        g._db_connessione = connessione
+        g._db_pool = pool
+    return connessione
+
+
+def _restituisci_connessione_richiesta():
+    connessione = g.pop("_db_connessione", None)
+    pool = g.pop("_db_pool", None)
+    if connessione is not None and pool is not None:
+        pool.rilascia(connessione)
+
+
+def restituisci_connessione_richiesta():
+    """Restituisce subito al pool la connessione della richiesta, prima di un'attesa lunga.
+
+    Le query successive della richiesta ne prendono un'altra al primo uso.
+    Le scritture non confermate vanno committate prima: il pool le annulla.
+    """
+    if has_request_context():
+        _restituisci_connessione_richiesta()
+
+
+def rilascia_connessione_richiesta(errore=None):
+    """Hook teardown_request: restituisce al pool la connessione della richiesta."""
+    g.pop("_db_condivisa", None)
+    _restituisci_connessione_richiesta()
+
 
 @contextlib.contextmanager
 def ottieni_db():
-    """Stabilisce una connessione al database PostgreSQL e la chiude automaticamente."""
-    db_host = os.getenv("DB_HOST", "localhost")
-    db_port = os.getenv("DB_PORT", "5432")
-    db_name = os.getenv("DB_NAME", "byte_bite")
-    db_user = os.getenv("DB_USER", "byte_bite_user")
-    db_password = os.getenv("DB_PASSWORD", "secure_password_change_me")
+    """Presta una connessione: quella della richiesta corrente o una dal pool."""
+    connessione = _connessione_transazione.get()
+    if connessione is not None:
+        # Dentro transazione(): stessa connessione, commit gestito dal blocco esterno.
+        yield connessione
+        return
 
-    try:
-        connessione = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            connect_timeout=30
-        )
-    except psycopg2.Error as e:
-        logger.error("Impossibile connettersi al database (host: %s:%s, db: %s): %s", db_host, db_port, db_name, e)
-        raise
+    if has_request_context() and g.get("_db_condivisa"):
+        connessione = _connessione_richiesta()
+        try:
+            yield connessione
+        except Exception:
+            if not connessione.closed:
+                connessione.rollback()
+            raise
+        return
 
-    connessione.cursor_factory = RealDictCursor
+    pool = _ottieni_pool()
+    connessione = pool.acquisisci()
     try:
-        with connessione.cursor() as cur:
-            cur.execute("SET TIME ZONE 'Europe/Rome'")
-        connessione.commit()
         yield connessione
     finally:
-        connessione.close()
+        pool.rilascia(connessione)
+
+
+@contextlib.contextmanager
+def transazione(snapshot=False):
+    """Raggruppa le query del blocco in un'unica transazione (commit finale o rollback).
+
+    Con snapshot=True la transazione è REPEATABLE READ in sola lettura: tutte le
+    query del blocco vedono lo stesso stato del database.
+    """
+    if _connessione_transazione.get() is not None:
+        # Transazioni annidate: confluiscono in quella esterna.
+        yield _connessione_transazione.get()
+        return
+
+    with ottieni_db() as connessione:
+        if snapshot:
+            # SET TRANSACTION deve essere la prima istruzione: chiude l'eventuale
+            # transazione implicita aperta dalle query precedenti della richiesta.
+            if connessione.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                connessione.commit()
+            with connessione.cursor() as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        token = _connessione_transazione.set(connessione)
+        try:
+            yield connessione
+            connessione.commit()
+        except Exception:
+            if not connessione.closed:
+                connessione.rollback()
+            raise
+        finally:
+            _connessione_transazione.reset(token)
 
 
 def esegui_query(query, argomenti=(), uno=False, commit=False):
@@ -47,8 +398,11 @@ def esegui_query(query, argomenti=(), uno=False, commit=False):
             # Parametri bindati: prevengono SQL injection e gestiscono i tipi correttamente.
             cursore.execute(query, argomenti)
             if commit:
-                connessione.commit()
-                righe = None
+                # Le scritture con RETURNING restituiscono le righe prima del commit.
+                righe = cursore.fetchall() if cursore.description else None
+                # In una transazione esplicita il commit avviene a fine blocco.
+                if _connessione_transazione.get() is None:
+                    connessione.commit()
             else:
                 righe = cursore.fetchall()
     except psycopg2.Error as e:
@@ -34,7 +34,8 @@ CREATE TABLE IF NOT EXISTS ordini (
     numero_tavolo INTEGER CHECK (numero_tavolo > 0),
     numero_persone INTEGER CHECK (numero_persone > 0),
     metodo_pagamento TEXT NOT NULL CHECK (metodo_pagamento IN ('Contanti', 'Carta')),
-    completato BOOLEAN NOT NULL DEFAULT FALSE
+    completato BOOLEAN NOT NULL DEFAULT FALSE,
+    totale NUMERIC(10, 2) NOT NULL DEFAULT 0
 );
 
 -- ==================== Ordini / Prodotti ====================
@@ -43,5 +44,18 @@ CREATE TABLE IF NOT EXISTS ordini_prodotti (
     prodotto_id INTEGER NOT NULL REFERENCES prodotti(id),
     quantita INTEGER NOT NULL CHECK (quantita > 0),
     stato TEXT NOT NULL DEFAULT 'In Attesa' CHECK (stato IN ('In Attesa', 'In Preparazione', 'Pronto', 'Completato')),
+    prezzo_unitario NUMERIC(10, 2),
+    pronto_dal TIMESTAMP,
     PRIMARY KEY (ordine_id, prodotto_id)
 );
+
+-- ==================== Indici ====================
+-- Ordinamento cronologico e paginazione keyset su (data_ordine, id).
+CREATE INDEX IF NOT EXISTS idx_ordini_data ON ordini (data_ordine, id);
+
+-- Incassi e volumi dei prodotti riletti dal feed delle modifiche: include la
+-- quantità, niente accessi alla tabella.
+CREATE INDEX IF NOT EXISTS idx_ordini_prodotti_prodotto ON ordini_prodotti (prodotto_id, ordine_id, quantita);
+
+-- Scansione dei completamenti automatici scaduti.
+CREATE INDEX IF NOT EXISTS idx_ordini_prodotti_pronto ON ordini_prodotti (pronto_dal) WHERE stato = 'Pronto';
@@ -0,0 +1,119 @@
+-- Schema specifico di PostgreSQL, applicato dopo db.sql solo su PostgreSQL
+-- (create_db.py, test): tabelle UNLOGGED, migrazioni dei database esistenti,
+-- indici su espressioni e trigger del feed delle modifiche. db.sql resta
+-- eseguibile anche dal fallback SQLite di sviluppo.
+
+-- ==================== Eventi Socket.IO ====================
+-- Messaggi multi-worker troppo grandi per NOTIFY (SOCKETIO_CODA=postgres):
+-- la notifica porta solo l'id. Righe di passaggio, non serve il WAL.
+CREATE UNLOGGED TABLE IF NOT EXISTS eventi_socketio (
+    id BIGSERIAL PRIMARY KEY,
+    payload TEXT NOT NULL,
+    creato TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+-- ==================== Sessioni ====================
+-- Sessioni lato server condivise tra i worker (SESSIONI_BACKEND=postgres): si
+-- ricreano con un nuovo login, quindi non serve il WAL.
+CREATE UNLOGGED TABLE IF NOT EXISTS sessioni (
+    id TEXT PRIMARY KEY,
+    id_utente INTEGER,
+    dati JSONB NOT NULL,
+    scadenza TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_sessioni_utente ON sessioni (id_utente);
+
+-- ==================== Totali denormalizzati ====================
+-- Database creati prima dei totali salvati: aggiunge le colonne e le valorizza
+-- una sola volta con i prezzi correnti (le righe già valorizzate non cambiano).
+ALTER TABLE ordini ADD COLUMN IF NOT EXISTS totale NUMERIC(10, 2);
+ALTER TABLE ordini_prodotti ADD COLUMN IF NOT EXISTS prezzo_unitario NUMERIC(10, 2);
+
+UPDATE ordini_prodotti op
+SET prezzo_unitario = p.prezzo
+FROM prodotti p
+WHERE p.id = op.prodotto_id AND op.prezzo_unitario IS NULL;
+
+UPDATE ordini o
+SET totale = COALESCE((
+    SELECT SUM(op.prezzo_unitario * op.quantita) FROM ordini_prodotti op WHERE op.ordine_id = o.id
+), 0)
+WHERE o.totale IS NULL;
+
+ALTER TABLE ordini ALTER COLUMN totale SET DEFAULT 0;
+ALTER TABLE ordini ALTER COLUMN totale SET NOT NULL;
+
+-- ==================== Completamento automatico ====================
+-- Istante del passaggio a "Pronto": il completamento automatico scatta dopo il
+-- timeout, anche dopo un riavvio. Le righe già in "Pronto" partono da adesso.
+ALTER TABLE ordini_prodotti ADD COLUMN IF NOT EXISTS pronto_dal TIMESTAMP;
+
+UPDATE ordini_prodotti
+SET pronto_dal = CURRENT_TIMESTAMP
+WHERE stato = 'Pronto' AND pronto_dal IS NULL;
+
+-- ==================== Indici ====================
+-- Indici che nessuna query usa (cambia_stato legge per chiave primaria, il
+-- catalogo prodotti è piccolo): via dai database che li hanno già.
+DROP INDEX IF EXISTS idx_ordini_prodotti_aperti;
+DROP INDEX IF EXISTS idx_prodotti_categoria;
+
+-- Filtro per prefisso del nome cliente nell'elenco ordini (LIKE 'prefisso%').
+CREATE INDEX IF NOT EXISTS idx_ordini_cliente ON ordini (lower(nome_cliente) text_pattern_ops);
+
+-- ==================== Feed delle modifiche ====================
+-- Ogni istruzione su ordini, ordini_prodotti e prodotti notifica sul canale
+-- byte_bite_modifiche tabella, operazione, id degli ordini (o dei prodotti) toccati
+-- e origine della connessione, così ogni processo riallinea le dashboard anche
+-- dopo scritture esterne (reset_db.py, SQL manuale, altre istanze). Oltre 200 id
+-- il payload resta compatto: "ids" è null e si ricarica tutto.
+CREATE OR REPLACE FUNCTION notifica_modifica() RETURNS TRIGGER AS $$
+DECLARE
+    righe INTEGER;
+    ids JSON;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        EXECUTE format('SELECT COUNT(DISTINCT %1$I), json_agg(DISTINCT %1$I) FROM vecchie', TG_ARGV[0]) INTO righe, ids;
+    ELSIF TG_OP <> 'TRUNCATE' THEN
+        EXECUTE format('SELECT COUNT(DISTINCT %1$I), json_agg(DISTINCT %1$I) FROM nuove', TG_ARGV[0]) INTO righe, ids;
+    END IF;
+    IF righe = 0 THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_notify('byte_bite_modifiche', json_build_object(
+        'tabella', TG_TABLE_NAME,
+        'op', TG_OP,
+        'ids', CASE WHEN righe <= 200 THEN ids END,
+        'origine', current_setting('byte_bite.origine', TRUE)
+    )::TEXT);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER ordini_modifiche_inserimento AFTER INSERT ON ordini
+    REFERENCING NEW TABLE AS nuove FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('id');
+CREATE OR REPLACE TRIGGER ordini_modifiche_aggiornamento AFTER UPDATE ON ordini
+    REFERENCING NEW TABLE AS nuove FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('id');
+CREATE OR REPLACE TRIGGER ordini_modifiche_eliminazione AFTER DELETE ON ordini
+    REFERENCING OLD TABLE AS vecchie FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('id');
+CREATE OR REPLACE TRIGGER ordini_modifiche_svuotamento AFTER TRUNCATE ON ordini
+    FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('id');
+
+CREATE OR REPLACE TRIGGER ordini_prodotti_modifiche_inserimento AFTER INSERT ON ordini_prodotti
+    REFERENCING NEW TABLE AS nuove FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('ordine_id');
+CREATE OR REPLACE TRIGGER ordini_prodotti_modifiche_aggiornamento AFTER UPDATE ON ordini_prodotti
+    REFERENCING NEW TABLE AS nuove FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('ordine_id');
+CREATE OR REPLACE TRIGGER ordini_prodotti_modifiche_eliminazione AFTER DELETE ON ordini_prodotti
+    REFERENCING OLD TABLE AS vecchie FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('ordine_id');
+CREATE OR REPLACE TRIGGER ordini_prodotti_modifiche_svuotamento AFTER TRUNCATE ON ordini_prodotti
+    FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('ordine_id');
+
+CREATE OR REPLACE TRIGGER prodotti_modifiche_inserimento AFTER INSERT ON prodotti
+    REFERENCING NEW TABLE AS nuove FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('id');
+CREATE OR REPLACE TRIGGER prodotti_modifiche_aggiornamento AFTER UPDATE ON prodotti
+    REFERENCING NEW TABLE AS nuove FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('id');
+CREATE OR REPLACE TRIGGER prodotti_modifiche_eliminazione AFTER DELETE ON prodotti
+    REFERENCING OLD TABLE AS vecchie FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('id');
+CREATE OR REPLACE TRIGGER prodotti_modifiche_svuotamento AFTER TRUNCATE ON prodotti
+    FOR EACH STATEMENT EXECUTE FUNCTION notifica_modifica('id');
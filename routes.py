@@ -1,12 +1,12 @@
 import logging
-import uuid
-from datetime import datetime
+from datetime import date, datetime
+from functools import wraps
 
-import bcrypt
 from flask import (
     Response,
     abort,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
@@ -15,19 +15,71 @@ from flask import (
 )
 from fpdf import FPDF, XPos, YPos
 
-from auth import accesso_richiesto, ottieni_utente_loggato, richiedi_permesso
-from core import app, socketio, timer_attivi
-from db import esegui_query, ottieni_db
+from auth import (
+    CodaPasswordPiena,
+    accesso_richiesto,
+    genera_hash_password,
+    invalida_permessi,
+    istantanea_utente,
+    ottieni_utente_loggato,
+    richiedi_permesso,
+    verifica_password,
+)
+from core import app
+from db import esegui_query, ottieni_db, restituisci_connessione_richiesta, transazione
+from sessioni import aggiorna_sessioni_utente
 from services import (
-    cambia_stato_automatico,
+    annulla_completamento,
+    applica_transizione_stato,
     costruisci_dati_statistiche,
-    emissione_sicura,
+    cursore_completati,
+    emissione_delta_dashboard,
+    etag_risorsa,
+    incrementa_versioni,
+    invalida_menu,
+    invalida_tabellone,
+    menu_aggiorna_scorte,
+    ottieni_completati_precedenti,
     ottieni_ordini_per_categoria,
-    ricalcola_statistiche,
+    pagina_cassa,
+    pianifica_aggiornamento_statistiche,
+    pianifica_completamento,
+    scatto_finestra_completati,
+    serializza_ordine_dashboard,
+    snapshot_statistiche,
+    statistiche_aggiorna_prodotto,
+    statistiche_aggiungi_ordine,
+    statistiche_cambia_completati,
+    statistiche_cambia_pagamento,
+    statistiche_rimuovi_ordine,
+    statistiche_rimuovi_prodotto,
+    tabellone_aggiorna_ordine,
+    tabellone_aggiungi_ordine,
+    tabellone_cambia_stato,
+    tabellone_rimuovi_ordine,
 )
 
 logger = logging.getLogger(__name__)
 
+# Dimensione delle pagine di completati richieste dalle dashboard.
+_PAGINA_COMPLETATI = 20
+_PAGINA_COMPLETATI_MAX = 100
+
+# Dimensione delle pagine dell'elenco ordini in amministrazione.
+_PAGINA_ORDINI = 50
+_PAGINA_ORDINI_MAX = 200
+
+# Condizione SQL di ciascun filtro dell'elenco ordini (vedi _leggi_filtri_ordini).
+_CONDIZIONI_ORDINI = {
+    "dal": "data_ordine >= %(dal)s",
+    "al": "data_ordine < %(al)s + INTERVAL '1 day'",
+    "metodo_pagamento": "metodo_pagamento = %(metodo_pagamento)s",
+    "tavolo": "numero_tavolo = %(tavolo)s",
+    "completato": "completato = %(completato)s",
+    "cliente": "lower(nome_cliente) LIKE %(cliente)s",
+    "data_ordine": "(data_ordine, id) < (%(data_ordine)s, %(id)s)",
+}
+
 
 def _normalizza_permessi(permessi):
     if not isinstance(permessi, list):
@@ -35,6 +87,100 @@ def _normalizza_permessi(permessi):
     return list(dict.fromkeys(p.strip() for p in permessi if isinstance(p, str) and p.strip()))
 
 
+def _elenco_utenti():
+    """Utenti ordinati per username, ciascuno con la lista delle pagine permesse."""
+    righe = esegui_query("""
+        SELECT
+            u.id,
+            u.username,
+            u.is_admin,
+            u.attivo,
+            COALESCE(array_agg(pp.pagina ORDER BY pp.pagina) FILTER (WHERE pp.pagina IS NOT NULL), '{}') AS permessi
+        FROM utenti u
+        LEFT JOIN permessi_pagine pp ON pp.utente_id = u.id
+        GROUP BY u.id
+        ORDER BY u.username
+    """)
+    return [dict(riga) for riga in righe]
+
+
+def _leggi_filtri_ordini(argomenti):
+    """Filtri e cursore dell'elenco ordini dalla query string (ValueError se non validi)."""
+    filtri = {}
+    for chiave in ("dal", "al"):
+        if argomenti.get(chiave):
+            filtri[chiave] = date.fromisoformat(argomenti[chiave])
+    if argomenti.get("metodo_pagamento"):
+        filtri["metodo_pagamento"] = argomenti["metodo_pagamento"]
+    if argomenti.get("tavolo"):
+        filtri["tavolo"] = int(argomenti["tavolo"])
+    if argomenti.get("completato"):
+        if argomenti["completato"] not in ("true", "false"):
+            raise ValueError("completato deve essere true o false")
+        filtri["completato"] = argomenti["completato"] == "true"
+    if argomenti.get("cliente"):
+        # Prefisso senza distinzione di maiuscole; % e _ digitati valgono come testo.
+        prefisso = argomenti["cliente"].strip().lower()
+        filtri["cliente"] = prefisso.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    # Cursore (data_ordine, id) dell'ultimo ordine già ricevuto.
+    if argomenti.get("data_ordine") or argomenti.get("id"):
+        filtri["data_ordine"] = datetime.fromisoformat(argomenti["data_ordine"])
+        filtri["id"] = int(argomenti["id"])
+    return filtri
+
+
+def _pagina_ordini(filtri, limite):
+    """Ordini dal più recente che rispettano i filtri, più il cursore della pagina successiva."""
+    condizioni = [_CONDIZIONI_ORDINI[chiave] for chiave in filtri if chiave in _CONDIZIONI_ORDINI]
+    where = f"WHERE {' AND '.join(condizioni)}" if condizioni else ""
+    # Keyset pagination su idx_ordini_data: una riga in più dice se esiste un seguito.
+    ordini = esegui_query(f"""
+        SELECT id, nome_cliente, numero_tavolo, numero_persone, data_ordine, metodo_pagamento, totale
+        FROM ordini
+        {where}
+        ORDER BY data_ordine DESC, id DESC
+        LIMIT %(limite)s
+    """, {**filtri, "limite": limite + 1})
+    if len(ordini) <= limite:
+        return ordini, None
+    ordini = ordini[:limite]
+    return ordini, {"data_ordine": ordini[-1]["data_ordine"].isoformat(), "id": ordini[-1]["id"]}
+
+
+def _risposta_non_modificata(etag):
+    risposta = app.response_class(status=304)
+    risposta.set_etag(etag)
+    return risposta
+
+
+def _con_etag(risorsa, variante=None):
+    """Decoratore per GET condizionali: 304 se il client ha già la versione corrente.
+
+    variante, se indicata, restituisce un'ulteriore componente dell'ETag (None
+    se non serve) per risposte che cambiano anche senza modifiche alla risorsa.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def gestore(*args, **kwargs):
+            # La versione si legge prima della query: una modifica concorrente produce
+            # al più un ETag già superato, mai dati nuovi con un ETag vecchio.
+            etag = etag_risorsa(risorsa)
+            componente = variante() if variante is not None else None
+            if componente is not None:
+                etag = f"{etag}-{componente}"
+            if etag in request.if_none_match:
+                return _risposta_non_modificata(etag)
+            risposta = make_response(f(*args, **kwargs))
+            if risposta.status_code == 200:
+                risposta.set_etag(etag)
+            return risposta
+
+        return gestore
+
+    return decorator
+
+
 # ==================== Route: autenticazione ====================
 
 @app.route("/login/", methods=["GET", "POST"])
@@ -42,7 +188,7 @@ def accesso():
     if request.method == "POST":
         # Legge credenziali dal form.
         username = request.form.get("username")
-        password = request.form.get("password").encode()
+        password = request.form.get("password")
 
         # Recupera utente e controlla stato account.
         utente = esegui_query("""
@@ -60,14 +206,22 @@ def accesso():
             logger.warning("Login negato - account disattivato: '%s' (IP: %s)", username, request.remote_addr)
             return render_template("login.html", error="Account disattivato")
 
-        # Verifica la password con hash bcrypt.
-        if not bcrypt.checkpw(password, utente["password_hash"].encode()):
+        # Verifica la password con hash bcrypt (su thread dedicato, fuori dal loop).
+        # L'attesa in coda non deve tenere occupata una connessione del pool.
+        restituisci_connessione_richiesta()
+        try:
+            password_valida = verifica_password(password, utente["password_hash"])
+        except CodaPasswordPiena:
+            logger.warning("Login rimandato - coda password piena - utente: '%s' (IP: %s)", username, request.remote_addr)
+            return render_template("login.html", error="Troppi accessi in corso, riprova tra qualche secondo"), 503
+        if not password_valida:
             logger.warning("Login fallito - password errata per utente: '%s' (IP: %s)", username, request.remote_addr)
             return render_template("login.html", error="Username o password errata")
 
         # Salva i dati minimi in sessione.
         session["id_utente"] = utente["id"]
         session["username"] = utente["username"]
+        session["utente"] = istantanea_utente(utente)
 
         logger.info("Login riuscito - utente: '%s' (ID: %s, admin: %s, IP: %s)",
                     utente["username"], utente["id"], bool(utente["is_admin"]), request.remote_addr)
@@ -100,42 +254,23 @@ def logout():
 @accesso_richiesto
 @richiedi_permesso("CASSA")
 def cassa():
-    # Carica tutti i prodotti e li raggruppa per categoria di menu.
-    tutti_prodotti = esegui_query("SELECT * FROM prodotti ORDER BY id")
-
-    # Mantiene una lista categorie per l'ordine di visualizzazione.
-    categorie = []
-    prodotti_per_categoria = {}
-
-    for prodotto in tutti_prodotti:
-        # Ogni prodotto viene associato alla sua categoria menu.
-        categoria = prodotto["categoria_menu"]
-        if categoria not in prodotti_per_categoria:
-            # Prima occorrenza: inizializza categoria e lista prodotti.
-            categorie.append(categoria)
-            prodotti_per_categoria[categoria] = []
-        prodotti_per_categoria[categoria].append(prodotto)
-
-    return render_template(
-        "cassa.html",
-        categorie=categorie,
-        prodotti_per_categoria=prodotti_per_categoria,
-    )
+    # Catalogo raggruppato e pagina renderizzata restano in cache fino alla prossima modifica.
+    return pagina_cassa()
 
 
 @app.route("/api/ordini/", methods=["GET"])
 @accesso_richiesto
 @richiedi_permesso("AMMINISTRAZIONE")
+@_con_etag("ordini")
 def lista_ordini():
-    ordini = esegui_query("""
-        SELECT o.id, o.nome_cliente, o.numero_tavolo, o.numero_persone, o.data_ordine, o.metodo_pagamento,
-               COALESCE(SUM(p.prezzo * op.quantita), 0) as totale
-        FROM ordini o
-        LEFT JOIN ordini_prodotti op ON o.id = op.ordine_id
-        LEFT JOIN prodotti p ON op.prodotto_id = p.id
-        GROUP BY o.id
-        ORDER BY o.data_ordine DESC
-    """)
+    # Una pagina alla volta, filtrata lato server: la risposta ha dimensione limitata.
+    try:
+        filtri = _leggi_filtri_ordini(request.args)
+        limite = min(max(int(request.args.get("limite", _PAGINA_ORDINI)), 1), _PAGINA_ORDINI_MAX)
+    except (KeyError, ValueError):
+        return jsonify({"errore": "Filtri o cursore non validi"}), 400
+
+    ordini, prossimo = _pagina_ordini(filtri, limite)
     return jsonify({
         "ordini": [
             {
@@ -148,7 +283,8 @@ def lista_ordini():
                 "totale": float(o["totale"]),
             }
             for o in ordini
-        ]
+        ],
+        "cursore": prossimo,
     })
 
 
@@ -170,56 +306,90 @@ def aggiungi_ordine():
         return jsonify({"errore": "Nessun prodotto selezionato"}), 400
 
     try:
-        # Inserisce l'ordine e le righe prodotto in un'unica transazione.
+        # Carrello come array paralleli: un prodotto ripetuto conta una sola riga.
+        id_prodotti = [int(prodotto["id"]) for prodotto in prodotti]
+        quantita_prodotti = [int(prodotto["quantita"]) for prodotto in prodotti]
+
+        # Ordine, scalo magazzino e righe in un'unica istruzione e transazione:
+        # "scalati" contiene solo i prodotti con disponibilità sufficiente.
         with ottieni_db() as connessione:
             cursore = connessione.cursor()
-            # Inserisce l'intestazione ordine.
-            cursore.execute("""
-                INSERT INTO ordini (asporto, nome_cliente, numero_tavolo, numero_persone, metodo_pagamento)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id
-            """, (asporto, nome_cliente, numero_tavolo, numero_persone, metodo_pagamento))
-            id_ordine = cursore.fetchone()["id"]
-
-            for prodotto in prodotti:
-                # Scala la quantità solo se c'è disponibilità sufficiente.
-                cursore.execute("""
-                    UPDATE prodotti
-                    SET quantita = quantita - %s, venduti = venduti + %s
-                    WHERE id = %s AND quantita >= %s
-                """, (prodotto["quantita"], prodotto["quantita"], prodotto["id"], prodotto["quantita"]))
-
-                if cursore.rowcount == 0:
-                    # Se non aggiorna righe, lo stock non basta: abort della transazione.
-                    nome_prodotto = prodotto.get("nome", "Sconosciuto")
-                    logger.warning("Stock insufficiente per prodotto '%s' (ID: %s) - ordine annullato",
-                                   nome_prodotto, prodotto.get("id"))
-                    raise Exception(f"Prodotto {nome_prodotto} esaurito o insufficiente.")
-
-                # Registra la riga ordine-prodotti con stato iniziale.
-                cursore.execute("""
-                    INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato)
-                    VALUES (%s, %s, %s, %s)
-                """, (id_ordine, prodotto["id"], prodotto["quantita"], "In Attesa"))
-
-            # Individua le dashboard da aggiornare in tempo reale.
             cursore.execute("""
-                SELECT DISTINCT prodotti.categoria_dashboard
-                FROM ordini_prodotti
-                JOIN prodotti ON prodotti.id = ordini_prodotti.prodotto_id
-                WHERE ordini_prodotti.ordine_id = %s
-            """, (id_ordine,))
-            categorie_dashboard = [riga["categoria_dashboard"] for riga in cursore.fetchall()]
+                WITH carrello AS (
+                    SELECT prodotto_id, SUM(quantita)::INT AS quantita
+                    FROM unnest(%s::INT[], %s::INT[]) AS c(prodotto_id, quantita)
+                    GROUP BY prodotto_id
+                ), scalati AS (
+                    UPDATE prodotti p
+                    SET quantita = p.quantita - c.quantita, venduti = p.venduti + c.quantita
+                    FROM carrello c
+                    WHERE p.id = c.prodotto_id AND p.quantita >= c.quantita
+                    RETURNING p.id, p.nome, p.prezzo, p.categoria_dashboard, c.quantita, p.quantita AS rimanenti
+                ), nuovo AS (
+                    INSERT INTO ordini (asporto, nome_cliente, numero_tavolo, numero_persone, metodo_pagamento, totale)
+                    SELECT %s, %s, %s, %s, %s, COALESCE(SUM(prezzo * quantita), 0) FROM scalati
+                    RETURNING id, data_ordine
+                ), righe AS (
+                    INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato, prezzo_unitario)
+                    SELECT nuovo.id, scalati.id, scalati.quantita, 'In Attesa', scalati.prezzo
+                    FROM nuovo CROSS JOIN scalati
+                )
+                SELECT nuovo.id AS id_ordine, nuovo.data_ordine,
+                       scalati.id, scalati.nome, scalati.prezzo, scalati.categoria_dashboard, scalati.quantita,
+                       scalati.rimanenti
+                FROM nuovo CROSS JOIN scalati
+            """, (id_prodotti, quantita_prodotti,
+                  asporto, nome_cliente, numero_tavolo, numero_persone, metodo_pagamento))
+            righe = cursore.fetchall()
+
+            scalati = {riga["id"] for riga in righe}
+            if len(scalati) < len(set(id_prodotti)):
+                # Almeno un prodotto non aveva stock sufficiente: abort della transazione.
+                prodotto = next(p for p in prodotti if int(p["id"]) not in scalati)
+                nome_prodotto = prodotto.get("nome", "Sconosciuto")
+                logger.warning("Stock insufficiente per prodotto '%s' (ID: %s) - ordine annullato",
+                               nome_prodotto, prodotto.get("id"))
+                raise Exception(f"Prodotto {nome_prodotto} esaurito o insufficiente.")
+
+            # Righe per dashboard: ogni categoria riceve la sua scheda del nuovo ordine.
+            riga_ordine = righe[0]
+            id_ordine = riga_ordine["id_ordine"]
+            prodotti_per_dashboard = {}
+            for riga in righe:
+                prodotti_per_dashboard.setdefault(riga["categoria_dashboard"], []).append(
+                    {"nome": riga["nome"], "quantita": riga["quantita"]}
+                )
             # Conferma atomica: o tutto scritto o nulla.
             connessione.commit()
 
         logger.info("Nuovo ordine #%s creato - cliente: '%s', prodotti: %s, asporto: %s, pagamento: %s, utente: '%s'",
                     id_ordine, nome_cliente, len(prodotti), asporto, metodo_pagamento, session.get("username"))
 
-        # Notifica le dashboard e aggiorna le statistiche in background.
-        for categoria in categorie_dashboard:
-            emissione_sicura("aggiorna_dashboard", {"categoria": categoria}, stanza=categoria)
-        socketio.start_background_task(ricalcola_statistiche)
+        # Scorte rimaste nel menu della cassa, senza rileggere il catalogo.
+        menu_aggiorna_scorte({riga["id"]: riga["rimanenti"] for riga in righe})
+
+        # Applica il nuovo ordine alle statistiche senza rileggere le tabelle.
+        statistiche_aggiungi_ordine(
+            riga_ordine["data_ordine"],
+            metodo_pagamento,
+            [(riga["id"], riga["quantita"], riga["prezzo"]) for riga in righe],
+        )
+
+        # Aggiunge la scheda ai tabelloni, la invia alle dashboard e aggiorna le statistiche.
+        for categoria, prodotti_categoria in prodotti_per_dashboard.items():
+            ordine = {
+                "id": id_ordine,
+                "nome_cliente": nome_cliente,
+                "numero_tavolo": numero_tavolo,
+                "numero_persone": numero_persone,
+                "data_ordine": riga_ordine["data_ordine"],
+                "stato": "In Attesa",
+                "prodotti": prodotti_categoria,
+            }
+            tabellone_aggiungi_ordine(categoria, ordine)
+            emissione_delta_dashboard(categoria, {"tipo": "aggiunto", "ordine": serializza_ordine_dashboard(ordine)})
+        incrementa_versioni("ordini", "prodotti")
+        pianifica_aggiornamento_statistiche()
 
         return jsonify({"messaggio": "Ordine creato con successo"}), 201
 
@@ -240,33 +410,41 @@ def dashboard(category):
         "dashboard.html",
         category=category.capitalize(),
         ordini_non_completati=ordini_non_completati,
-        ordini_completati=ordini_completati
+        ordini_completati=ordini_completati,
+        cursore_completati=cursore_completati(ordini_completati),
     )
 
 
 @app.route("/api/dashboard/<category>")
 @accesso_richiesto
 @richiedi_permesso("DASHBOARD")
+@_con_etag("ordini", variante=scatto_finestra_completati)
 def dashboard_parziale(category):
     ordini_non_completati, ordini_completati = ottieni_ordini_per_categoria(category)
 
-    def serializza(lista):
-        return [
-            {
-                "id": o["id"],
-                "nome_cliente": o["nome_cliente"],
-                "numero_tavolo": o["numero_tavolo"],
-                "numero_persone": o["numero_persone"],
-                "data_ordine": o["data_ordine"].strftime("%H:%M"),
-                "stato": o["stato"],
-                "prodotti": o["prodotti"],
-            }
-            for o in lista
-        ]
+    return jsonify({
+        "non_completati": [serializza_ordine_dashboard(o) for o in ordini_non_completati],
+        "completati": [serializza_ordine_dashboard(o) for o in ordini_completati],
+        "cursore_completati": cursore_completati(ordini_completati),
+    })
+
+
+@app.route("/api/dashboard/<category>/completati")
+@accesso_richiesto
+@richiedi_permesso("DASHBOARD")
+def dashboard_completati_precedenti(category):
+    # Completati più vecchi di quelli mostrati, a pagine, dal cursore (data_ordine, id).
+    try:
+        data_ordine = datetime.fromisoformat(request.args["data_ordine"])
+        id_ordine = int(request.args["id"])
+        limite = min(max(int(request.args.get("limite", _PAGINA_COMPLETATI)), 1), _PAGINA_COMPLETATI_MAX)
+    except (KeyError, ValueError):
+        return jsonify({"errore": "Cursore non valido"}), 400
 
+    ordini, prossimo = ottieni_completati_precedenti(category, data_ordine, id_ordine, limite)
     return jsonify({
-        "non_completati": serializza(ordini_non_completati),
-        "completati": serializza(ordini_completati),
+        "completati": [serializza_ordine_dashboard(o) for o in ordini],
+        "cursore_completati": prossimo,
     })
 
 
@@ -274,82 +452,38 @@ def dashboard_parziale(category):
 @accesso_richiesto
 @richiedi_permesso("DASHBOARD")
 def cambia_stato(id_ordine, categoria):
+    # Lettura e scritture dello stato in un'unica istruzione: un doppio tocco avanza in sequenza.
+    esito = applica_transizione_stato(id_ordine, categoria)
 
-    # Legge lo stato attuale per la categoria.
-    riga_stato = esegui_query("""
-        SELECT stato
-        FROM ordini_prodotti
-        JOIN prodotti ON prodotti.id = ordini_prodotti.prodotto_id
-        WHERE ordine_id = %s AND prodotti.categoria_dashboard = %s
-        LIMIT 1;
-    """, (id_ordine, categoria), uno=True)
-
-    if not riga_stato:
+    if not esito:
         logger.warning("Cambio stato fallito - ordine #%s o categoria '%s' non trovata", id_ordine, categoria)
         return jsonify({"errore": "Ordine o categoria non trovata"}), 404
 
-    stato_attuale = riga_stato["stato"]
-
-    # Lista degli stati in sequenza (usata per avanzare).
-    stati = ["In Attesa", "In Preparazione", "Pronto", "Completato"]
+    stato_attuale = esito["stato_precedente"]
+    nuovo_stato = esito["nuovo_stato"]
 
-    chiave_timer = (id_ordine, categoria)
-
-    if stato_attuale == "Completato":
+    if nuovo_stato is None:
         logger.warning("Cambio stato rifiutato - ordine #%s [%s] già completato", id_ordine, categoria)
         return jsonify({"errore": "Ordine già completato"}), 400
 
     if stato_attuale == "Pronto":
         # Se si torna indietro da "Pronto", annulla eventuale completamento automatico.
-        if chiave_timer in timer_attivi:
-            timer_attivi[chiave_timer]["annulla"] = True
-            del timer_attivi[chiave_timer]
-
-        nuovo_stato = "In Preparazione"
-
-    else:
-        # Avanza di uno stato rispetto a quello corrente.
-        nuovo_stato = stati[stati.index(stato_attuale) + 1]
-
-    # Applica lo stato a tutti i prodotti della categoria per quell'ordine.
-    esegui_query("""
-        UPDATE ordini_prodotti
-        SET stato = %s
-        WHERE ordine_id = %s
-        AND prodotto_id IN (
-            SELECT id FROM prodotti WHERE categoria_dashboard = %s
-        );
-    """, (nuovo_stato, id_ordine, categoria), commit=True)
+        annulla_completamento(id_ordine, categoria)
 
-    logger.info("Stato ordine #%s [%s]: '%s' → '%s'", id_ordine, categoria, stato_attuale, nuovo_stato)
+    if esito["variato"]:
+        statistiche_cambia_completati(1 if esito["completato"] else -1)
+    tabellone_cambia_stato(id_ordine, categoria, nuovo_stato)
 
-    # Aggiorna il flag completato dell'ordine in base ai residui.
-    residui = esegui_query(
-        "SELECT COUNT(*) AS c FROM ordini_prodotti WHERE ordine_id = %s AND stato != 'Completato'",
-        (id_ordine,),
-        uno=True
-    )["c"]
-    # Un ordine è completato solo se tutte le righe sono "Completato".
-    esegui_query(
-        "UPDATE ordini SET completato = %s WHERE id = %s",
-        (residui == 0, id_ordine),
-        commit=True
-    )
+    logger.info("Stato ordine #%s [%s]: '%s' → '%s'", id_ordine, categoria, stato_attuale, nuovo_stato)
 
     # Notifica la dashboard e ricalcola statistiche in background.
-    emissione_sicura("aggiorna_dashboard", {"categoria": categoria}, stanza=categoria)
-    socketio.start_background_task(ricalcola_statistiche)
+    emissione_delta_dashboard(categoria, {"tipo": "stato", "id": id_ordine, "stato": nuovo_stato})
+    incrementa_versioni("ordini")
+    pianifica_aggiornamento_statistiche()
 
     if nuovo_stato == "Pronto":
-        # Avvia un timer che completa automaticamente dopo il timeout.
-        if chiave_timer in timer_attivi:
-            timer_attivi[chiave_timer]["annulla"] = True
-            timer_attivi.pop(chiave_timer, None)
-
-        # Registra il timer così può essere annullato su click successivo.
-        id_timer = str(uuid.uuid4())
-        timer_attivi[chiave_timer] = {"annulla": False, "id": id_timer}
-        socketio.start_background_task(cambia_stato_automatico, id_ordine, categoria, id_timer)
+        # Programma il completamento automatico dopo il timeout (sostituisce un timer precedente).
+        pianifica_completamento(id_ordine, categoria)
 
     return jsonify({
         "nuovo_stato": nuovo_stato
@@ -362,54 +496,37 @@ def cambia_stato(id_ordine, categoria):
 @accesso_richiesto
 @richiedi_permesso("AMMINISTRAZIONE")
 def amministrazione():
-    # Carica dati principali per la pagina amministrazione.
-    # Tabella ordini: include totale per riga calcolato via SUM.
-    ordini = esegui_query("""
-        SELECT o.id, o.nome_cliente, o.numero_tavolo, o.numero_persone, o.data_ordine, o.metodo_pagamento,
-               COALESCE(SUM(p.prezzo * op.quantita), 0) as totale
-        FROM ordini o
-        LEFT JOIN ordini_prodotti op ON o.id = op.ordine_id
-        LEFT JOIN prodotti p ON op.prodotto_id = p.id
-        GROUP BY o.id
-        ORDER BY o.data_ordine DESC
-    """)
-    # Tabella prodotti: usata per gestione catalogo e magazzino.
-    prodotti = esegui_query("""
-        SELECT
-            id,
-            nome,
-            categoria_dashboard,
-            categoria_menu,
-            prezzo,
-            disponibile,
-            quantita,
-            venduti
-        FROM prodotti
-        ORDER BY MIN(id) OVER (PARTITION BY categoria_menu), id;
-    """)
+    # Carica dati principali per la pagina amministrazione da un unico snapshot coerente.
+    with transazione(snapshot=True):
+        # Tabella ordini: prima pagina, le successive arrivano da /api/ordini/ scorrendo.
+        ordini, cursore_ordini = _pagina_ordini({}, _PAGINA_ORDINI)
+        # Tabella prodotti: usata per gestione catalogo e magazzino.
+        prodotti = esegui_query("""
+            SELECT
+                id,
+                nome,
+                categoria_dashboard,
+                categoria_menu,
+                prezzo,
+                disponibile,
+                quantita,
+                venduti
+            FROM prodotti
+            ORDER BY MIN(id) OVER (PARTITION BY categoria_menu), id;
+        """)
 
-    # Liste categorie per filtro/selector lato UI.
-    categorie_db = esegui_query("SELECT categoria_menu FROM prodotti GROUP BY categoria_menu ORDER BY MIN(id)")
-    categorie = [riga["categoria_menu"] for riga in categorie_db]
-    prima_categoria = categorie[0] if categorie else None
+        # Liste categorie per filtro/selector lato UI.
+        categorie_db = esegui_query("SELECT categoria_menu FROM prodotti GROUP BY categoria_menu ORDER BY MIN(id)")
+        categorie = [riga["categoria_menu"] for riga in categorie_db]
+        prima_categoria = categorie[0] if categorie else None
 
-    # Costruisce elenco utenti con i permessi associati.
-    utenti_db = esegui_query("SELECT id, username, is_admin, attivo FROM utenti ORDER BY username")
-    utenti = []
-    for riga in utenti_db:
-        # Converte la riga DB in dict serializzabile/iterabile.
-        utente = dict(riga)
-        righe_permessi = esegui_query(
-            "SELECT pagina FROM permessi_pagine WHERE utente_id = %s",
-            (utente["id"],),
-        )
-        # Espone solo la lista di stringhe pagina.
-        utente["permessi"] = [permesso["pagina"] for permesso in righe_permessi]
-        utenti.append(utente)
+        # Elenco utenti con i permessi associati, in un'unica query aggregata.
+        utenti = _elenco_utenti()
 
     return render_template(
         "amministrazione.html",
         ordini=ordini,
+        cursore_ordini=cursore_ordini,
         prodotti=prodotti,
         utenti=utenti,
         categorie=categorie,
@@ -421,8 +538,14 @@ def amministrazione():
 @accesso_richiesto
 @richiedi_permesso("AMMINISTRAZIONE")
 def api_statistiche():
-    # Endpoint JSON per alimentare grafici e widget.
-    return jsonify(costruisci_dati_statistiche())
+    # Endpoint JSON per alimentare grafici e widget: byte già serializzati nello snapshot.
+    snapshot = snapshot_statistiche()
+    etag = etag_risorsa("statistiche", snapshot.versione)
+    if etag in request.if_none_match:
+        return _risposta_non_modificata(etag)
+    risposta = app.response_class(snapshot.json, mimetype="application/json")
+    risposta.set_etag(etag)
+    return risposta
 
 
 @app.route("/api/statistiche/report")
@@ -513,95 +636,98 @@ def esporta_statistiche():
             [120, 40]
         )
 
-    ordini = esegui_query("""
-        SELECT o.id, o.nome_cliente, o.numero_tavolo, o.numero_persone, o.asporto, o.data_ordine, o.metodo_pagamento, o.completato
-        FROM ordini o
-        ORDER BY o.data_ordine DESC
-    """)
+    # Ordini e righe letti dallo stesso snapshot, con una sola connessione.
+    with transazione(snapshot=True):
+        ordini = esegui_query("""
+            SELECT o.id, o.nome_cliente, o.numero_tavolo, o.numero_persone, o.asporto, o.data_ordine, o.metodo_pagamento,
+                   o.completato, o.totale
+            FROM ordini o
+            ORDER BY o.data_ordine DESC
+        """)
+
+        if ordini:
+            # Sezione dettaglio: una pagina dedicata con i singoli ordini.
+            pdf.add_page()
+            pdf.set_font("Helvetica", "B", 14)
+            pdf.cell(0, 9, "Dettaglio ordini", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            pdf.ln(2)
 
-    if ordini:
-        # Sezione dettaglio: una pagina dedicata con i singoli ordini.
-        pdf.add_page()
-        pdf.set_font("Helvetica", "B", 14)
-        pdf.cell(0, 9, "Dettaglio ordini", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        pdf.ln(2)
-
-        def tronca_testo(testo, max_len):
-            # Evita celle troppo lunghe nel PDF.
-            testo = str(testo)
-            return testo if len(testo) <= max_len else (testo[: max_len - 3] + "...")
-
-        for ordine in ordini:
-            # Per ogni ordine, carica le righe prodotto e stampa un blocco.
-            id_ordine = ordine["id"]
-            righe_prodotti = esegui_query(
-                """
-                SELECT
-                    p.nome,
-                    p.categoria_menu,
-                    op.quantita,
-                    p.prezzo,
-                    (p.prezzo * op.quantita) as subtotale,
-                    op.stato
-                FROM ordini_prodotti op
-                JOIN prodotti p ON p.id = op.prodotto_id
-                WHERE op.ordine_id = %s
-                ORDER BY p.categoria_menu, p.nome
-                """,
-                (id_ordine,)
-            )
+            def tronca_testo(testo, max_len):
+                # Evita celle troppo lunghe nel PDF.
+                testo = str(testo)
+                return testo if len(testo) <= max_len else (testo[: max_len - 3] + "...")
 
-            # Calcola il totale dell'ordine per stampare un riepilogo.
-            totale_ordine = sum((r["subtotale"] or 0) for r in righe_prodotti) if righe_prodotti else 0
-
-            pdf.set_font("Helvetica", "B", 12)
-            pdf.cell(0, 7, f"Ordine #{id_ordine}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-
-            pdf.set_font("Helvetica", "", 10)
-            pdf.cell(0, 6, f"Data: {ordine['data_ordine']}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            pdf.cell(0, 6, f"Cliente: {ordine['nome_cliente']}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-
-            tipo = "Asporto" if ordine["asporto"] else "Tavolo"
-            tavolo = "-" if ordine["numero_tavolo"] is None else ordine["numero_tavolo"]
-            persone = "-" if ordine["numero_persone"] is None else ordine["numero_persone"]
-            completato = "Si" if ordine["completato"] else "No"
-            # Riga compatta con metadati ordine.
-            pdf.cell(
-                0,
-                6,
-                f"Tipo: {tipo} | Tavolo: {tavolo} | Persone: {persone} | Pagamento: {ordine['metodo_pagamento']} | Completato: {completato}",
-                new_x=XPos.LMARGIN,
-                new_y=YPos.NEXT
-            )
-            pdf.cell(0, 6, f"Totale ordine (EUR): {float(totale_ordine):.2f}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            pdf.ln(2)
+            for ordine in ordini:
+                # Per ogni ordine, carica le righe prodotto e stampa un blocco.
+                id_ordine = ordine["id"]
+                righe_prodotti = esegui_query(
+                    """
+                    SELECT
+                        p.nome,
+                        p.categoria_menu,
+                        op.quantita,
+                        COALESCE(op.prezzo_unitario, p.prezzo) AS prezzo,
+                        (COALESCE(op.prezzo_unitario, p.prezzo) * op.quantita) as subtotale,
+                        op.stato
+                    FROM ordini_prodotti op
+                    JOIN prodotti p ON p.id = op.prodotto_id
+                    WHERE op.ordine_id = %s
+                    ORDER BY p.categoria_menu, p.nome
+                    """,
+                    (id_ordine,)
+                )
 
-            if righe_prodotti:
-                # Intestazioni tabella righe ordine.
-                headers = ["Prodotto", "Qta", "Prezzo", "Subtot.", "Stato"]
-                widths = [80, 15, 20, 20, 35]
+                # Totale salvato alla creazione dell'ordine.
+                totale_ordine = ordine["totale"]
 
-                pdf.set_font("Helvetica", "B", 10)
-                for header, w in zip(headers, widths):
-                    pdf.cell(w, 7, header, border=1)
-                pdf.ln()
+                pdf.set_font("Helvetica", "B", 12)
+                pdf.cell(0, 7, f"Ordine #{id_ordine}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
                 pdf.set_font("Helvetica", "", 10)
-                for riga in righe_prodotti:
-                    # Unisce categoria e nome per compattezza.
-                    nome_prodotto = f"{riga['categoria_menu']} - {riga['nome']}"
-                    valori = [
-                        tronca_testo(nome_prodotto, 44),
-                        riga["quantita"],
-                        f"{float(riga['prezzo']):.2f}",
-                        f"{float(riga['subtotale'] or 0):.2f}",
-                        tronca_testo(riga["stato"], 18)
-                    ]
-                    for val, w in zip(valori, widths):
-                        pdf.cell(w, 7, str(val), border=1)
+                pdf.cell(0, 6, f"Data: {ordine['data_ordine']}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+                pdf.cell(0, 6, f"Cliente: {ordine['nome_cliente']}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+                tipo = "Asporto" if ordine["asporto"] else "Tavolo"
+                tavolo = "-" if ordine["numero_tavolo"] is None else ordine["numero_tavolo"]
+                persone = "-" if ordine["numero_persone"] is None else ordine["numero_persone"]
+                completato = "Si" if ordine["completato"] else "No"
+                # Riga compatta con metadati ordine.
+                pdf.cell(
+                    0,
+                    6,
+                    f"Tipo: {tipo} | Tavolo: {tavolo} | Persone: {persone} | Pagamento: {ordine['metodo_pagamento']} | Completato: {completato}",
+                    new_x=XPos.LMARGIN,
+                    new_y=YPos.NEXT
+                )
+                pdf.cell(0, 6, f"Totale ordine (EUR): {float(totale_ordine):.2f}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+                pdf.ln(2)
+
+                if righe_prodotti:
+                    # Intestazioni tabella righe ordine.
+                    headers = ["Prodotto", "Qta", "Prezzo", "Subtot.", "Stato"]
+                    widths = [80, 15, 20, 20, 35]
+
+                    pdf.set_font("Helvetica", "B", 10)
+                    for header, w in zip(headers, widths):
+                        pdf.cell(w, 7, header, border=1)
                     pdf.ln()
 
-            pdf.ln(6)
+                    pdf.set_font("Helvetica", "", 10)
+                    for riga in righe_prodotti:
+                        # Unisce categoria e nome per compattezza.
+                        nome_prodotto = f"{riga['categoria_menu']} - {riga['nome']}"
+                        valori = [
+                            tronca_testo(nome_prodotto, 44),
+                            riga["quantita"],
+                            f"{float(riga['prezzo']):.2f}",
+                            f"{float(riga['subtotale'] or 0):.2f}",
+                            tronca_testo(riga["stato"], 18)
+                        ]
+                        for val, w in zip(valori, widths):
+                            pdf.cell(w, 7, str(val), border=1)
+                        pdf.ln()
+
+                pdf.ln(6)
 
     pdf_bytes = bytes(pdf.output())
     filename = f"statistiche_{generato_il.strftime('%Y%m%d_%H%M%S')}.pdf"
@@ -614,6 +740,7 @@ def esporta_statistiche():
 @app.route("/api/prodotti/", methods=["GET"])
 @accesso_richiesto
 @richiedi_permesso("AMMINISTRAZIONE")
+@_con_etag("prodotti")
 def lista_prodotti():
     prodotti = esegui_query("""
         SELECT
@@ -674,20 +801,25 @@ def aggiungi_prodotto():
             disponibile = True
 
         # Inserisce il prodotto con venduti iniziali a 0.
-        esegui_query(
+        riga = esegui_query(
             """
             INSERT INTO prodotti (nome, categoria_dashboard, categoria_menu, prezzo, quantita, disponibile, venduti)
             VALUES (%s, %s, %s, %s, %s, %s, 0)
+            RETURNING id
             """,
             (nome, categoria_dashboard, categoria_menu, prezzo, quantita, disponibile),
+            uno=True,
             commit=True,
         )
+        statistiche_aggiorna_prodotto(riga["id"], nome, categoria_dashboard)
+        invalida_menu()
 
         logger.info("Prodotto aggiunto: '%s' (€%.2f, categoria: %s/%s, quantita: %s) - utente: '%s'",
                     nome, prezzo, categoria_menu, categoria_dashboard, quantita, session.get("username"))
 
         # Aggiorna statistiche dopo modifica catalogo.
-        socketio.start_background_task(ricalcola_statistiche)
+        incrementa_versioni("prodotti")
+        pianifica_aggiornamento_statistiche()
 
         return jsonify({"messaggio": "Prodotto aggiunto con successo"}), 201
     except Exception as e:
@@ -708,11 +840,12 @@ def modifica_prodotto(id):
         disponibile = quantita > 0
 
         # Aggiorna nome, categoria, prezzo e stock.
-        esegui_query(
+        aggiornato = esegui_query(
             """
             UPDATE prodotti
             SET nome = %s, categoria_dashboard = %s, prezzo = %s, quantita = %s, disponibile = %s
             WHERE id = %s
+            RETURNING id
             """,
             (
                 dati["nome"],
@@ -722,14 +855,22 @@ def modifica_prodotto(id):
                 disponibile,
                 id,
             ),
+            uno=True,
             commit=True,
         )
+        if aggiornato:
+            # Nome e categoria incidono su top 10 e volumi; il prezzo solo sui nuovi ordini.
+            statistiche_aggiorna_prodotto(id, dati["nome"], dati["categoria_dashboard"])
+            # Nome e categoria compaiono nelle schede delle dashboard: si ricaricano al prossimo accesso.
+            invalida_tabellone()
+            invalida_menu()
 
         logger.info("Prodotto #%s modificato: '%s' (€%.2f, quantita: %s) - utente: '%s'",
                     id, dati["nome"], prezzo, quantita, session.get("username"))
 
         # Aggiorna statistiche dopo variazione stock.
-        socketio.start_background_task(ricalcola_statistiche)
+        incrementa_versioni("prodotti", "ordini")
+        pianifica_aggiornamento_statistiche()
 
         return jsonify({"messaggio": "Prodotto modificato con successo"})
     except Exception as e:
@@ -768,9 +909,12 @@ def rifornisci_prodotto(id):
         commit=True,
     )
 
+    invalida_menu()
+
     logger.info("Prodotto #%s rifornito di %s unità - utente: '%s'", id_prodotto, quantita, session.get("username"))
 
-    socketio.start_background_task(ricalcola_statistiche)
+    incrementa_versioni("prodotti")
+    pianifica_aggiornamento_statistiche()
 
     return jsonify({"messaggio": "Prodotto rifornito con successo"})
 
@@ -781,12 +925,16 @@ def rifornisci_prodotto(id):
 def elimina_prodotto(id):
     try:
         # Eliminazione diretta per id.
-        esegui_query("DELETE FROM prodotti WHERE id = %s", (id,), commit=True)
+        eliminato = esegui_query("DELETE FROM prodotti WHERE id = %s RETURNING id", (id,), uno=True, commit=True)
+        if eliminato:
+            statistiche_rimuovi_prodotto(id)
+            invalida_menu()
 
         logger.info("Prodotto #%s eliminato - utente: '%s'", id, session.get("username"))
 
         # Aggiorna statistiche dopo modifica catalogo.
-        socketio.start_background_task(ricalcola_statistiche)
+        incrementa_versioni("prodotti")
+        pianifica_aggiornamento_statistiche()
 
         return jsonify({"messaggio": "Prodotto eliminato con successo"})
     except Exception as e:
@@ -816,22 +964,55 @@ def modifica_ordine(id_ordine):
         if numero_persone == "":
             numero_persone = None
 
-        # Aggiorna intestazione ordine.
-        esegui_query(
+        # Aggiorna intestazione ordine e restituisce il metodo di pagamento precedente
+        # e le dashboard che mostrano l'ordine.
+        riga = esegui_query(
             """
-            UPDATE ordini
+            UPDATE ordini AS o
             SET nome_cliente = %s, numero_tavolo = %s, numero_persone = %s, metodo_pagamento = %s
-            WHERE id = %s
+            FROM (SELECT id, metodo_pagamento FROM ordini WHERE id = %s FOR UPDATE) AS precedente
+            WHERE o.id = precedente.id
+            RETURNING precedente.metodo_pagamento AS metodo_precedente,
+                ARRAY(
+                    SELECT DISTINCT p.categoria_dashboard
+                    FROM ordini_prodotti op JOIN prodotti p ON p.id = op.prodotto_id
+                    WHERE op.ordine_id = o.id
+                ) AS categorie
             """,
             (nome_cliente, numero_tavolo, numero_persone, metodo_pagamento, id_ordine),
+            uno=True,
             commit=True,
         )
 
+        if riga:
+            tabellone_aggiorna_ordine(id_ordine, nome_cliente, numero_tavolo, numero_persone)
+            for categoria in riga["categorie"]:
+                emissione_delta_dashboard(categoria, {
+                    "tipo": "aggiornato",
+                    "id": id_ordine,
+                    "nome_cliente": nome_cliente,
+                    "numero_tavolo": numero_tavolo,
+                    "numero_persone": numero_persone,
+                })
+
+        if riga and riga["metodo_precedente"] != metodo_pagamento:
+            # Cambia solo la ripartizione contanti/carta dell'incasso.
+            righe_ordine = esegui_query(
+                "SELECT prodotto_id, quantita, prezzo_unitario FROM ordini_prodotti WHERE ordine_id = %s",
+                (id_ordine,),
+            )
+            statistiche_cambia_pagamento(
+                riga["metodo_precedente"],
+                metodo_pagamento,
+                [(r["prodotto_id"], r["quantita"], r["prezzo_unitario"]) for r in righe_ordine],
+            )
+
         logger.info("Ordine #%s aggiornato - cliente: '%s', utente: '%s'",
                     id_ordine, nome_cliente, session.get("username"))
 
         # Aggiorna statistiche dopo modifica ordine.
-        socketio.start_background_task(ricalcola_statistiche)
+        incrementa_versioni("ordini")
+        pianifica_aggiornamento_statistiche()
 
         return jsonify({"messaggio": "Ordine aggiornato con successo"})
     except Exception as e:
@@ -852,9 +1033,10 @@ def elimina_ordine(id_ordine):
             # Recupera le righe dell'ordine per ricostruire le quantità.
             cursore.execute(
                 """
-                SELECT prodotto_id, quantita
-                FROM ordini_prodotti
-                WHERE ordine_id = %s
+                SELECT op.prodotto_id, op.quantita, op.prezzo_unitario, p.categoria_dashboard
+                FROM ordini_prodotti op
+                JOIN prodotti p ON p.id = op.prodotto_id
+                WHERE op.ordine_id = %s
                 """,
                 (id_ordine,),
             )
@@ -886,14 +1068,32 @@ def elimina_ordine(id_ordine):
 
             # Rimuove prima le righe e poi l'intestazione ordine.
             cursore.execute("DELETE FROM ordini_prodotti WHERE ordine_id = %s", (id_ordine,))
-            cursore.execute("DELETE FROM ordini WHERE id = %s", (id_ordine,))
+            cursore.execute(
+                "DELETE FROM ordini WHERE id = %s RETURNING data_ordine, metodo_pagamento, completato",
+                (id_ordine,),
+            )
+            ordine_eliminato = cursore.fetchone()
             connessione.commit()
 
+        if ordine_eliminato:
+            tabellone_rimuovi_ordine(id_ordine)
+            for categoria in {p["categoria_dashboard"] for p in prodotti_ordine}:
+                emissione_delta_dashboard(categoria, {"tipo": "rimosso", "id": id_ordine})
+            # Il magazzino ripristinato rende di nuovo ordinabili i prodotti.
+            invalida_menu()
+            statistiche_rimuovi_ordine(
+                ordine_eliminato["data_ordine"],
+                ordine_eliminato["metodo_pagamento"],
+                ordine_eliminato["completato"],
+                [(p["prodotto_id"], p["quantita"], p["prezzo_unitario"]) for p in prodotti_ordine],
+            )
+
         logger.info("Ordine #%s eliminato con ripristino magazzino - utente: '%s'",
                     id_ordine, session.get("username"))
 
         # Aggiorna statistiche dopo eliminazione.
-        socketio.start_background_task(ricalcola_statistiche)
+        incrementa_versioni("ordini", "prodotti")
+        pianifica_aggiornamento_statistiche()
 
         return jsonify({"messaggio": "Ordine eliminato con successo"})
     except Exception as e:
@@ -908,7 +1108,7 @@ def elimina_ordine(id_ordine):
 def api_ordine(id_ordine):
     intestazione = esegui_query(
         """
-        SELECT id, nome_cliente, numero_tavolo, numero_persone, metodo_pagamento, data_ordine
+        SELECT id, nome_cliente, numero_tavolo, numero_persone, metodo_pagamento, data_ordine, totale
         FROM ordini
         WHERE id = %s
         """,
@@ -920,8 +1120,8 @@ def api_ordine(id_ordine):
 
     prodotti = esegui_query(
         """
-        SELECT p.nome, p.categoria_menu, op.quantita, p.prezzo,
-               (p.prezzo * op.quantita) AS subtotale, op.stato
+        SELECT p.nome, p.categoria_menu, op.quantita, COALESCE(op.prezzo_unitario, p.prezzo) AS prezzo,
+               (COALESCE(op.prezzo_unitario, p.prezzo) * op.quantita) AS subtotale, op.stato
         FROM ordini_prodotti op
         JOIN prodotti p ON p.id = op.prodotto_id
         WHERE op.ordine_id = %s
@@ -929,7 +1129,6 @@ def api_ordine(id_ordine):
         """,
         (id_ordine,),
     )
-    totale = sum((r["subtotale"] or 0) for r in prodotti)
     return jsonify(
         {
             "id": intestazione["id"],
@@ -938,7 +1137,7 @@ def api_ordine(id_ordine):
             "numero_persone": intestazione["numero_persone"],
             "metodo_pagamento": intestazione["metodo_pagamento"],
             "data_ordine": intestazione["data_ordine"],
-            "totale": float(totale),
+            "totale": float(intestazione["totale"]),
             "prodotti": [
                 {
                     "nome": r["nome"],
@@ -956,6 +1155,14 @@ def api_ordine(id_ordine):
 
 # ==================== API: utenti ====================
 
+@app.route("/api/utenti/", methods=["GET"])
+@accesso_richiesto
+@richiedi_permesso("AMMINISTRAZIONE")
+def lista_utenti():
+    # Stessa query della pagina amministrazione: il pannello aggiorna la tabella senza ricaricare.
+    return jsonify({"utenti": _elenco_utenti()})
+
+
 @app.route("/api/utenti/", methods=["POST"])
 @accesso_richiesto
 @richiedi_permesso("AMMINISTRAZIONE")
@@ -976,6 +1183,9 @@ def aggiungi_utente():
     permessi = _normalizza_permessi(permessi)
 
     try:
+        # Hash calcolato prima di prendere la connessione: non la tiene occupata durante l'attesa.
+        password_hash = genera_hash_password(password)
+
         with ottieni_db() as connessione:
             cursore = connessione.cursor()
 
@@ -986,9 +1196,6 @@ def aggiungi_utente():
                                username, session.get("username"))
                 return jsonify({"errore": "Username già in uso"}), 400
 
-            # Genera hash password (rounds bassi per ambienti limitati).
-            password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=4)).decode()
-
             # Inserisce utente.
             cursore.execute("""
                 INSERT INTO utenti (username, password_hash, is_admin, attivo)
@@ -1003,11 +1210,14 @@ def aggiungi_utente():
                 cursore.execute("INSERT INTO permessi_pagine (utente_id, pagina) VALUES (%s, %s)", (id_utente, pagina))
 
             connessione.commit()
+        invalida_permessi(id_utente)
 
         logger.info("Nuovo utente creato: '%s' (ID: %s, admin: %s, permessi: %s) - operatore: '%s'",
                     username, id_utente, is_admin, permessi, session.get("username"))
 
         return jsonify({"messaggio": "Utente creato con successo"}), 201
+    except CodaPasswordPiena:
+        return jsonify({"errore": "Servizio occupato, riprova tra qualche secondo"}), 503
     except Exception as e:
         logger.error("Errore durante la creazione dell'utente '%s' - operatore: '%s': %s",
                      username, session.get("username"), e)
@@ -1030,13 +1240,13 @@ def modifica_utente(id_utente):
         permessi = dati.get("permessi", [])
 
         permessi = _normalizza_permessi(permessi)
+        # Se presente, aggiorna anche la password (hash prima di prendere la connessione).
+        password_hash = genera_hash_password(password) if password else None
 
         with ottieni_db() as connessione:
             cursore = connessione.cursor()
 
-            if password:
-                # Se presente, aggiorna anche la password.
-                password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=4)).decode()
+            if password_hash:
                 cursore.execute("""
                     UPDATE utenti
                     SET username = %s, password_hash = %s, is_admin = %s, attivo = %s
@@ -1056,11 +1266,21 @@ def modifica_utente(id_utente):
                 cursore.execute("INSERT INTO permessi_pagine (utente_id, pagina) VALUES (%s, %s)", (id_utente, pagina))
 
             connessione.commit()
+        invalida_permessi(id_utente)
+        # Con le sessioni lato server la disattivazione chiude subito le sessioni aperte.
+        aggiorna_sessioni_utente(id_utente, {
+            "id": id_utente,
+            "username": username,
+            "is_admin": is_admin,
+            "attivo": attivo,
+        })
 
         logger.info("Utente #%s modificato: '%s' (admin: %s, attivo: %s) - operatore: '%s'",
                     id_utente, username, is_admin, attivo, session.get("username"))
 
         return jsonify({"messaggio": "Utente modificato con successo"})
+    except CodaPasswordPiena:
+        return jsonify({"errore": "Servizio occupato, riprova tra qualche secondo"}), 503
     except Exception as e:
         logger.error("Errore durante la modifica dell'utente #%s - operatore: '%s': %s",
                      id_utente, session.get("username"), e)
@@ -1098,6 +1318,8 @@ def elimina_utente(id_utente):
             cursore.execute("DELETE FROM utenti WHERE id = %s", (id_utente,))
 
             connessione.commit()
+        invalida_permessi(id_utente)
+        aggiorna_sessioni_utente(id_utente, None)
 
         logger.info("Utente #%s ('%s') eliminato - operatore: '%s'",
                     id_utente, username_eliminato, session.get("username"))
@@ -1,33 +1,228 @@
-import copy
+import bisect
+import collections
+import itertools
+import json
 import logging
+import math
+import os
 import threading
+import time
+import types
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
 
+from flask import render_template
 from flask_socketio import join_room
 
-from core import app, socketio, timer_attivi
-from db import esegui_query
+from core import app, socketio
+from db import ascolta_notifiche, esegui_query, origine_processo, transazione
 
 logger = logging.getLogger(__name__)
 
-# Cache in-memory per statistiche amministrazione.
+# Cache in-memory per statistiche amministrazione: ultimo snapshot pubblicato.
+# Gli snapshot sono immutabili, quindi i lettori li condividono senza copie né lock.
 _statistiche_cache = None
 _statistiche_lock = threading.RLock()
+_versioni_statistiche = itertools.count(1)
+
+SnapshotStatistiche = collections.namedtuple("SnapshotStatistiche", ["versione", "dati", "json"])
+
+# Contatori interni da cui deriva la cache: aggiornati per delta a ogni evento.
+_statistiche_stato = None
+# Vero se un delta non è applicabile o arriva durante un ricalcolo completo.
+_statistiche_incoerenti = False
+_ricalcoli_in_corso = 0
+_ultima_verifica_statistiche = 0.0
+
+_INTERVALLO_VERIFICA_STATISTICHE_SEC = 60
+_METODI_PAGAMENTO = ("Contanti", "Carta")
+
+# Pianificatore aggiornamenti statistiche: un solo task alla volta, richieste accorpate.
+# Il ritardo è la finestra di accorpamento, cioè l'obsolescenza massima tollerata.
+_RITARDO_STATISTICHE_SEC = float(os.getenv("STATISTICHE_MAX_RITARDO_SEC", "0.5"))
+_pianificatore_lock = threading.Lock()
+_pianificatore_attivo = False
+_aggiornamento_in_attesa = False
+_contatori_pianificatore = {"richieste": 0, "accorpate": 0, "esecuzioni": 0}
 
 _TIMEOUT_AUTO_COMPLETAMENTO_SEC = 10
 
+# Feed delle modifiche del DB (trigger in db.sql) e categorie delle dashboard.
+_CANALE_MODIFICHE = "byte_bite_modifiche"
+_CATEGORIE_DASHBOARD = ("Bar", "Cucina", "Gnoccheria", "Griglia", "Coperto")
+# Operazioni del feed applicabili per delta rileggendo gli id del payload.
+_OPERAZIONI_DELTA = ("INSERT", "UPDATE", "DELETE")
+
+# Ruota dei timer di completamento automatico: un solo task la fa avanzare a scatti
+# di _TICK_TIMER_SEC. Ogni slot mappa (ordine, categoria) -> tick di scadenza;
+# _scadenze_timer indica lo slot di ogni chiave per annullare in O(1). Le scadenze
+# vere stanno su DB (ordini_prodotti.pronto_dal): la ruota dice solo quando guardarle.
+_TICK_TIMER_SEC = 0.5
+_SLOT_RUOTA_TIMER = 64
+_ruota_timer = [{} for _ in range(_SLOT_RUOTA_TIMER)]
+_scadenze_timer = {}
+_ultimo_tick_timer = 0
+_ruota_attiva = False
+_timer_lock = threading.Lock()
+
+# Tabellone dashboard: categoria -> {id ordine: scheda}, con ordini aperti e
+# completati recenti. Le schede non vengono mai modificate sul posto.
+_COMPLETATI_TABELLONE_MAX = int(os.getenv("DASHBOARD_COMPLETATI_MAX", "100"))
+# Finestra opzionale in minuti sui completati mostrati (0 = solo il limite numerico).
+_COMPLETATI_FINESTRA_MINUTI = int(os.getenv("DASHBOARD_COMPLETATI_MINUTI", "0"))
+_tabellone = None
+_tabellone_lock = threading.RLock()
+
+# Menu della cassa: categoria_menu -> prodotti (in ordine di id) e pagina già renderizzata.
+# Le liste e i prodotti non vengono mai modificati sul posto.
+_menu = None
+_menu_html = None
+_menu_lock = threading.RLock()
+
+# Emissioni SocketIO in uscita: (stanza, locale) -> eventi della finestra corrente,
+# indicizzati per (evento, dati serializzati) così i duplicati si accorpano.
+_FINESTRA_EMISSIONI_SEC = float(os.getenv("SOCKETIO_FINESTRA_MS", "30")) / 1000
+_emissioni_lock = threading.Lock()
+_emissioni_in_coda = {}
+_emissioni_attive = False
+_contatori_emissioni = {"eventi": 0, "accorpati": 0, "frame": 0}
+
+# Versioni delle risorse servite via API, incrementate dalle route che le modificano.
+# L'epoca distingue gli ETag tra un avvio e l'altro del processo.
+_EPOCA_VERSIONI = uuid.uuid4().hex[:8]
+_versioni_risorse = {"ordini": 0, "prodotti": 0}
+_versioni_lock = threading.Lock()
 
-def emissione_sicura(evento, dati, stanza=None):
-    """Invia un messaggio SocketIO gestendo eventuali errori."""
+
+def incrementa_versioni(*risorse):
+    """Invalida gli ETag delle risorse indicate (da chiamare dopo il commit)."""
+    with _versioni_lock:
+        for risorsa in risorse:
+            _versioni_risorse[risorsa] += 1
+
+
+def etag_risorsa(risorsa, versione=None):
+    """ETag forte per la versione corrente (o indicata) di una risorsa."""
+    if versione is None:
+        with _versioni_lock:
+            versione = _versioni_risorse[risorsa]
+    return f"{_EPOCA_VERSIONI}-{risorsa}-{versione}"
+
+
+def _emetti(evento, dati, stanza, locale):
+    opzioni = {"ignore_queue": True} if locale else {}
     try:
         # Invia l'evento alla stanza richiesta (o broadcast se stanza è None).
-        socketio.emit(evento, dati, room=stanza)
-        if stanza and stanza != "amministrazione" and evento == "aggiorna_dashboard":
-            # Replica l'aggiornamento anche all'area amministrazione.
-            socketio.emit(evento, dati, room="amministrazione")
+        socketio.emit(evento, dati, room=stanza, **opzioni)
     except Exception as e:
         logger.error("Errore durante l'emissione dell'evento SocketIO '%s' (stanza: %s): %s", evento, stanza, e)
 
 
+def emissione_sicura(evento, dati, stanza=None, locale=False):
+    """Accoda un messaggio SocketIO, gestendo eventuali errori.
+
+    Gli eventi della finestra di accorpamento partono insieme: un frame per
+    stanza, senza duplicati. Con locale=True raggiunge solo i client di questo
+    processo, anche se è configurata una coda multi-worker.
+    """
+    global _emissioni_attive
+    destinazioni = [stanza]
+    if stanza and stanza != "amministrazione" and evento == "aggiorna_dashboard":
+        # Replica l'aggiornamento anche all'area amministrazione.
+        destinazioni.append("amministrazione")
+
+    if _FINESTRA_EMISSIONI_SEC <= 0:
+        for destinazione in destinazioni:
+            with _emissioni_lock:
+                _contatori_emissioni["eventi"] += 1
+                _contatori_emissioni["frame"] += 1
+            _emetti(evento, dati, destinazione, locale)
+        return
+
+    try:
+        chiave = (evento, json.dumps(dati, sort_keys=True, default=str))
+    except (TypeError, ValueError) as e:
+        logger.error("Evento SocketIO '%s' non serializzabile: %s", evento, e)
+        return
+    with _emissioni_lock:
+        for destinazione in destinazioni:
+            _contatori_emissioni["eventi"] += 1
+            eventi = _emissioni_in_coda.setdefault((destinazione, locale), {})
+            # Un duplicato prende il posto dell'ultimo: l'ordine finale resta quello reale.
+            if eventi.pop(chiave, None) is not None:
+                _contatori_emissioni["accorpati"] += 1
+            eventi[chiave] = (evento, dati)
+        if _emissioni_attive:
+            return
+        _emissioni_attive = True
+    try:
+        socketio.start_background_task(_ciclo_emissioni)
+    except Exception as e:
+        with _emissioni_lock:
+            _emissioni_attive = False
+        logger.error("Impossibile avviare l'invio degli eventi SocketIO: %s", e)
+
+
+def _svuota_emissioni():
+    """Invia quanto accodato: un evento singolo così com'è, più eventi come un solo frame "eventi"."""
+    global _emissioni_in_coda
+    with _emissioni_lock:
+        coda, _emissioni_in_coda = _emissioni_in_coda, {}
+        _contatori_emissioni["frame"] += len(coda)
+    for (stanza, locale), eventi in coda.items():
+        lotto = list(eventi.values())
+        if len(lotto) == 1:
+            _emetti(*lotto[0], stanza, locale)
+        else:
+            _emetti("eventi", [[evento, dati] for evento, dati in lotto], stanza, locale)
+
+
+def _ciclo_emissioni():
+    """Task unico dell'invio: attende la finestra, svuota la coda, ripete finché serve."""
+    global _emissioni_attive
+    while True:
+        socketio.sleep(_FINESTRA_EMISSIONI_SEC)
+        _svuota_emissioni()
+        with _emissioni_lock:
+            if not _emissioni_in_coda:
+                _emissioni_attive = False
+                return
+
+
+def contatori_emissioni():
+    """Restituisce eventi richiesti, eventi accorpati e frame effettivamente inviati."""
+    with _emissioni_lock:
+        return dict(_contatori_emissioni)
+
+
+def emissione_delta_dashboard(categoria, delta):
+    """Invia alla dashboard di una categoria la variazione di un singolo ordine.
+
+    Tipi di delta: "aggiunto" (con la scheda completa in "ordine"), "stato"
+    (con "id" e nuovo "stato"; "Completato" sposta la scheda tra i completati),
+    "stati" (stesso "stato" per tutti gli "ids", dai completamenti automatici),
+    "rimosso" (con l'"id" dell'ordine eliminato) e "aggiornato" (con "id",
+    "nome_cliente", "numero_tavolo" e "numero_persone" modificati).
+    """
+    emissione_sicura("delta_dashboard", dict(delta, categoria=categoria), stanza=categoria)
+    # L'amministrazione ricarica comunque tabelle e grafici: basta il solito avviso.
+    emissione_sicura("aggiorna_dashboard", {"categoria": categoria}, stanza="amministrazione")
+
+
+def serializza_ordine_dashboard(ordine):
+    """Scheda ordine in formato JSON, come la disegna dashboard.js."""
+    return {
+        "id": ordine["id"],
+        "nome_cliente": ordine["nome_cliente"],
+        "numero_tavolo": ordine["numero_tavolo"],
+        "numero_persone": ordine["numero_persone"],
+        "data_ordine": ordine["data_ordine"].strftime("%H:%M"),
+        "stato": ordine["stato"],
+        "prodotti": ordine["prodotti"],
+    }
+
+
 @socketio.on("join")
 def gestisci_join(dati):
     """Gestisce l'ingresso di un client in una stanza SocketIO."""
@@ -39,14 +234,328 @@ def gestisci_join(dati):
         logger.debug("Client iscritto alla stanza '%s'", categoria)
 
 
+def _nuova_scheda(riga):
+    """Scheda ordine (senza prodotti) a partire da una riga ordine-prodotto."""
+    return {
+        "id": riga["ordine_id"],
+        "nome_cliente": riga["nome_cliente"],
+        "numero_tavolo": riga["numero_tavolo"],
+        "numero_persone": riga["numero_persone"],
+        "data_ordine": riga["data_ordine"],
+        "stato": riga["stato"],
+        "prodotti": [],
+    }
+
+
+def _carica_tabellone_da_db():
+    """Legge ordini aperti e completati recenti di tutte le categorie in una query."""
+    righe = esegui_query(
+        """
+        SELECT *
+        FROM (
+            SELECT
+                o.id AS ordine_id,
+                o.nome_cliente,
+                o.numero_tavolo,
+                o.numero_persone,
+                o.data_ordine,
+                p.categoria_dashboard,
+                op.stato,
+                p.nome AS prodotto_nome,
+                op.quantita,
+                DENSE_RANK() OVER (
+                    PARTITION BY p.categoria_dashboard, op.stato = 'Completato'
+                    ORDER BY o.data_ordine DESC, o.id DESC
+                ) AS posizione
+            FROM ordini AS o
+            JOIN ordini_prodotti AS op ON o.id = op.ordine_id
+            JOIN prodotti AS p ON p.id = op.prodotto_id
+        ) AS righe
+        WHERE stato <> 'Completato' OR posizione <= %s
+        ORDER BY data_ordine ASC, ordine_id ASC
+        """,
+        (_COMPLETATI_TABELLONE_MAX,),
+    )
+
+    return _raggruppa_tabellone(righe)
+
+
+def _raggruppa_tabellone(righe):
+    """Raggruppa le righe ordine-prodotto per categoria e ordine, come le disegnano i template."""
+    tabellone = {}
+    for riga in righe:
+        tabellone.setdefault(riga["categoria_dashboard"], {}).setdefault(
+            riga["ordine_id"],
+            _nuova_scheda(riga),
+        )["prodotti"].append({"nome": riga["prodotto_nome"], "quantita": riga["quantita"]})
+    return tabellone
+
+
+def _ottieni_tabellone():
+    """Restituisce il tabellone in memoria, caricandolo dal DB al primo utilizzo."""
+    global _tabellone
+    with _tabellone_lock:
+        if _tabellone is None:
+            _tabellone = _carica_tabellone_da_db()
+            logger.debug("Tabellone dashboard caricato (%s categorie)", len(_tabellone))
+        return _tabellone
+
+
+def _modifica_tabellone(applica):
+    # Prima del caricamento non c'è nulla da aggiornare: il DB è già la fonte corretta.
+    with _tabellone_lock:
+        if _tabellone is not None:
+            applica(_tabellone)
+
+
+def _limita_completati(schede):
+    """Tiene in memoria solo i completati più recenti di una categoria."""
+    completati = [s for s in schede.values() if s["stato"] == "Completato"]
+    eccedenza = len(completati) - _COMPLETATI_TABELLONE_MAX
+    if eccedenza > 0:
+        completati.sort(key=lambda s: (s["data_ordine"], s["id"]))
+        for scheda in completati[:eccedenza]:
+            del schede[scheda["id"]]
+
+
+def tabellone_aggiungi_ordine(categoria, ordine):
+    """Aggiunge la scheda di un nuovo ordine alla dashboard di una categoria."""
+    def applica(tabellone):
+        tabellone.setdefault(categoria, {})[ordine["id"]] = ordine
+
+    _modifica_tabellone(applica)
+
+
+def tabellone_cambia_stato(id_ordine, categoria, stato):
+    """Aggiorna lo stato della scheda di un ordine per una categoria."""
+    def applica(tabellone):
+        schede = tabellone.get(categoria, {})
+        scheda = schede.get(id_ordine)
+        if scheda is None:
+            return
+        # Copia su scrittura: i lettori possono ancora usare la scheda precedente.
+        schede[id_ordine] = dict(scheda, stato=stato)
+        if stato == "Completato":
+            _limita_completati(schede)
+
+    _modifica_tabellone(applica)
+
+
+def tabellone_aggiorna_ordine(id_ordine, nome_cliente, numero_tavolo, numero_persone):
+    """Aggiorna l'intestazione di un ordine in tutte le categorie in cui compare."""
+    def applica(tabellone):
+        for schede in tabellone.values():
+            scheda = schede.get(id_ordine)
+            if scheda is not None:
+                schede[id_ordine] = dict(
+                    scheda,
+                    nome_cliente=nome_cliente,
+                    numero_tavolo=numero_tavolo,
+                    numero_persone=numero_persone,
+                )
+
+    _modifica_tabellone(applica)
+
+
+def tabellone_rimuovi_ordine(id_ordine):
+    """Toglie un ordine eliminato da tutte le dashboard."""
+    def applica(tabellone):
+        for schede in tabellone.values():
+            schede.pop(id_ordine, None)
+
+    _modifica_tabellone(applica)
+
+
+def tabellone_sostituisci_ordini(id_ordini, schede_per_categoria):
+    """Rimpiazza le schede degli ordini indicati con quelle rilette dal DB.
+
+    schede_per_categoria ha la forma del tabellone; gli ordini assenti sono
+    stati eliminati. Restituisce le categorie in cui gli ordini comparivano.
+    """
+    precedenti = set()
+
+    def applica(tabellone):
+        for categoria, schede in tabellone.items():
+            for id_ordine in id_ordini:
+                if schede.pop(id_ordine, None) is not None:
+                    precedenti.add(categoria)
+        for categoria, nuove in schede_per_categoria.items():
+            schede = tabellone.setdefault(categoria, {})
+            schede.update(nuove)
+            _limita_completati(schede)
+
+    _modifica_tabellone(applica)
+    return precedenti
+
+
+def invalida_tabellone():
+    """Scarta il tabellone: il prossimo accesso lo ricarica dal DB (es. prodotto rinominato)."""
+    global _tabellone
+    with _tabellone_lock:
+        _tabellone = None
+
+
+def _carica_menu_da_db():
+    """Legge il catalogo e lo raggruppa per categoria di menu, nell'ordine di visualizzazione."""
+    return _raggruppa_menu(esegui_query("SELECT * FROM prodotti ORDER BY id"))
+
+
+def _raggruppa_menu(prodotti):
+    menu = {}
+    for prodotto in prodotti:
+        menu.setdefault(prodotto["categoria_menu"], []).append(prodotto)
+    return menu
+
+
+def pagina_cassa():
+    """HTML della cassa: il DB si legge solo dopo un'invalidazione, il template dopo ogni modifica."""
+    global _menu, _menu_html
+    with _menu_lock:
+        if _menu_html is None:
+            if _menu is None:
+                _menu = _carica_menu_da_db()
+                logger.debug("Menu cassa caricato (%s categorie)", len(_menu))
+            _menu_html = render_template(
+                "cassa.html",
+                categorie=list(_menu),
+                prodotti_per_categoria=_menu,
+            )
+        return _menu_html
+
+
+def menu_aggiorna_scorte(scorte):
+    """Applica al menu le quantità rimaste dopo un ordine ({id prodotto: quantità})."""
+    global _menu_html
+    with _menu_lock:
+        if _menu is None:
+            return
+        for categoria, prodotti in _menu.items():
+            if any(p["id"] in scorte for p in prodotti):
+                _menu[categoria] = [
+                    dict(p, quantita=scorte[p["id"]]) if p["id"] in scorte else p
+                    for p in prodotti
+                ]
+        # Scorte basse ed esaurimenti cambiano la pagina: si renderizza di nuovo, senza DB.
+        _menu_html = None
+
+
+def menu_sostituisci_prodotti(id_prodotti, prodotti):
+    """Rimpiazza nel menu i prodotti indicati con le righe rilette dal DB (assenti = eliminati).
+
+    Si toccano solo le categorie coinvolte, senza riordinare l'intero catalogo.
+    Restituisce i prodotti sostituiti ({id: prodotto}), None se il menu non è in memoria.
+    """
+    global _menu, _menu_html
+    with _menu_lock:
+        if _menu is None:
+            return None
+        precedenti = {}
+        da_inserire = {prodotto["id"]: prodotto for prodotto in prodotti}
+        for categoria, elenco in list(_menu.items()):
+            if not any(p["id"] in id_prodotti for p in elenco):
+                continue
+            rimasti = []
+            for prodotto in elenco:
+                if prodotto["id"] not in id_prodotti:
+                    rimasti.append(prodotto)
+                    continue
+                precedenti[prodotto["id"]] = prodotto
+                nuovo = da_inserire.get(prodotto["id"])
+                if nuovo is not None and nuovo["categoria_menu"] == categoria:
+                    # Stessa categoria: stessa posizione.
+                    rimasti.append(da_inserire.pop(prodotto["id"]))
+            if rimasti:
+                _menu[categoria] = rimasti
+            else:
+                del _menu[categoria]
+        # Prodotti nuovi o spostati di categoria: inseriti in ordine di id.
+        for prodotto in da_inserire.values():
+            elenco = list(_menu.get(prodotto["categoria_menu"], ()))
+            bisect.insort(elenco, prodotto, key=lambda p: p["id"])
+            _menu[prodotto["categoria_menu"]] = elenco
+        # Le categorie seguono il loro primo prodotto, come nel caricamento dal DB.
+        _menu = dict(sorted(_menu.items(), key=lambda voce: voce[1][0]["id"]))
+        _menu_html = None
+        return precedenti
+
+
+def invalida_menu():
+    """Scarta il menu della cassa (catalogo modificato): il prossimo accesso lo rilegge dal DB."""
+    global _menu, _menu_html
+    with _menu_lock:
+        _menu = None
+        _menu_html = None
+
+
 def ottieni_ordini_per_categoria(categoria):
-    """Recupera gli ordini (completati e non) per una specifica categoria."""
+    """Restituisce gli ordini (aperti e completati recenti) di una categoria dal tabellone."""
     # Normalizza il nome categoria così coincide con il valore salvato a DB.
     categoria = categoria.capitalize()
 
-    # Estrae righe ordine-prodotto e le ordina cronologicamente.
-    ordini_db = esegui_query(
+    with _tabellone_lock:
+        schede = list(_ottieni_tabellone().get(categoria, {}).values())
+
+    # Separa gli ordini completati da quelli ancora in lavorazione.
+    ordini_non_completati = [s for s in schede if s["stato"] != "Completato"]
+    ordini_completati = [s for s in schede if s["stato"] == "Completato"]
+
+    # In lavorazione in ordine di arrivo; completati dal più recente.
+    ordini_non_completati.sort(key=lambda o: (o["data_ordine"], o["id"]))
+    ordini_completati.sort(key=lambda o: (o["data_ordine"], o["id"]), reverse=True)
+
+    if _COMPLETATI_FINESTRA_MINUTI > 0:
+        # I completati più vecchi della finestra restano disponibili via paginazione.
+        limite = datetime.now() - timedelta(minutes=_COMPLETATI_FINESTRA_MINUTI)
+        ordini_completati = [o for o in ordini_completati if o["data_ordine"] >= limite]
+
+    return ordini_non_completati, ordini_completati
+
+
+def scatto_finestra_completati():
+    """Minuto corrente se DASHBOARD_COMPLETATI_MINUTI è attiva, altrimenti None.
+
+    Con la finestra i completati escono dalla dashboard anche senza modifiche
+    agli ordini: chi la serve con un ETag deve farlo variare con il tempo.
+    """
+    if _COMPLETATI_FINESTRA_MINUTI <= 0:
+        return None
+    return int(time.time() // 60)
+
+
+def cursore_completati(ordini_completati):
+    """Cursore (data_ordine, id) dell'ultimo completato mostrato, da cui proseguire."""
+    if not ordini_completati:
+        return None
+    ultimo = ordini_completati[-1]
+    return {"data_ordine": ultimo["data_ordine"].isoformat(), "id": ultimo["id"]}
+
+
+def ottieni_completati_precedenti(categoria, data_ordine, id_ordine, limite):
+    """Pagina di completati più vecchi del cursore (data_ordine, id), dal più recente.
+
+    Restituisce (ordini, cursore successivo o None se non ce ne sono altri).
+    """
+    categoria = categoria.capitalize()
+
+    # Keyset pagination: limita gli ordini (non le righe) e legge una riga in più
+    # per sapere se esiste una pagina successiva.
+    righe = esegui_query(
         """
+        WITH pagina AS (
+            SELECT o.id, o.data_ordine
+            FROM ordini AS o
+            WHERE (o.data_ordine, o.id) < (%s, %s)
+            AND EXISTS (
+                SELECT 1
+                FROM ordini_prodotti AS op
+                JOIN prodotti AS p ON p.id = op.prodotto_id
+                WHERE op.ordine_id = o.id
+                AND p.categoria_dashboard = %s
+                AND op.stato = 'Completato'
+            )
+            ORDER BY o.data_ordine DESC, o.id DESC
+            LIMIT %s
+        )
         SELECT
             o.id AS ordine_id,
             o.nome_cliente,
@@ -56,147 +565,343 @@ def ottieni_ordini_per_categoria(categoria):
             op.stato,
             p.nome AS prodotto_nome,
             op.quantita
-        FROM ordini AS o
-        JOIN ordini_prodotti AS op ON o.id = op.ordine_id
+        FROM pagina
+        JOIN ordini AS o ON o.id = pagina.id
+        JOIN ordini_prodotti AS op ON op.ordine_id = o.id
         JOIN prodotti AS p ON p.id = op.prodotto_id
         WHERE p.categoria_dashboard = %s
-        ORDER BY o.data_ordine ASC;
-    """,
-        (categoria,),
+        ORDER BY o.data_ordine DESC, o.id DESC
+        """,
+        (data_ordine, id_ordine, categoria, limite + 1, categoria),
     )
 
-    # Raggruppa le righe per ordine per costruire la struttura attesa dai template.
     ordini = {}
-    for riga in ordini_db:
-        # Chiave di aggregazione: id ordine.
-        id_ordine = riga["ordine_id"]
+    for riga in righe:
         ordini.setdefault(
-            id_ordine,
-            {
-                "id": id_ordine,
-                "nome_cliente": riga["nome_cliente"],
-                "numero_tavolo": riga["numero_tavolo"],
-                "numero_persone": riga["numero_persone"],
-                "data_ordine": riga["data_ordine"],
-                "stato": riga["stato"],
-                "prodotti": [],
-            },
+            riga["ordine_id"],
+            _nuova_scheda(riga),
         )["prodotti"].append({"nome": riga["prodotto_nome"], "quantita": riga["quantita"]})
 
-    # Separa gli ordini completati da quelli ancora in lavorazione.
-    ordini_non_completati = []
-    ordini_completati = []
+    pagina = list(ordini.values())
+    altri = len(pagina) > limite
+    pagina = pagina[:limite]
+    return pagina, (cursore_completati(pagina) if altri else None)
 
-    for ordine in ordini.values():
-        if ordine["stato"] == "Completato":
-            ordini_completati.append(ordine)
-        else:
-            ordini_non_completati.append(ordine)
-
-    # Mostra per primi i completati più recenti.
-    ordini_completati.sort(key=lambda o: o["data_ordine"], reverse=True)
-
-    return ordini_non_completati, ordini_completati
 
+def _nuovo_prodotto_statistiche(nome, categoria_dashboard, venduti=0):
+    return {
+        "nome": nome,
+        "categoria_dashboard": categoria_dashboard,
+        "venduti": int(venduti),
+        # Quantità presenti negli ordini, separate per metodo di pagamento.
+        "per_metodo": {metodo: 0 for metodo in _METODI_PAGAMENTO},
+        # Incassi ai prezzi salvati nelle righe (come ordini.totale), non al listino attuale.
+        "incassi": {metodo: Decimal(0) for metodo in _METODI_PAGAMENTO},
+    }
 
-def _calcola_dati_statistiche_da_db():
-    """Calcola le statistiche direttamente dalle tabelle operative."""
-    # Numero ordini totali e completati.
-    ordini_totali = esegui_query("SELECT COUNT(*) AS c FROM ordini", uno=True)["c"]
-    ordini_completati = esegui_query("SELECT COUNT(*) AS c FROM ordini WHERE completato = TRUE", uno=True)["c"]
 
-    # Totale incasso indipendentemente dal metodo.
-    riga_totale_incasso = esegui_query(
+def _leggi_contatori_ordini():
+    """Contatori degli ordini: una sola scansione, righe per ora più il totale generale."""
+    righe_ordini = esegui_query(
         """
-        SELECT SUM(p.prezzo * op.quantita) AS totale
-        FROM ordini_prodotti op
-        JOIN prodotti p ON p.id = op.prodotto_id
-        """,
-        uno=True,
-    )
-    totale_incasso = float(riga_totale_incasso["totale"] or 0)
-
-    # Totale pagato in contanti.
-    riga_totale_contanti = esegui_query(
+        SELECT
+            EXTRACT(HOUR FROM data_ordine)::INT AS ora,
+            COUNT(*) AS totale,
+            COUNT(*) FILTER (WHERE completato) AS completati,
+            GROUPING(EXTRACT(HOUR FROM data_ordine)) = 1 AS complessivo
+        FROM ordini
+        GROUP BY GROUPING SETS ((EXTRACT(HOUR FROM data_ordine)), ())
         """
-        SELECT SUM(p.prezzo * op.quantita) AS totale
-        FROM ordini_prodotti op
-        JOIN prodotti p ON p.id = op.prodotto_id
-        JOIN ordini o ON o.id = op.ordine_id
-        WHERE o.metodo_pagamento = 'Contanti'
-        """,
-        uno=True,
     )
-    totale_contanti = float(riga_totale_contanti["totale"] or 0)
 
-    # Totale pagato con carta.
-    riga_totale_carta = esegui_query(
-        """
-        SELECT SUM(p.prezzo * op.quantita) AS totale
-        FROM ordini_prodotti op
-        JOIN prodotti p ON p.id = op.prodotto_id
-        JOIN ordini o ON o.id = op.ordine_id
-        WHERE o.metodo_pagamento = 'Carta'
+    # Il grouping set vuoto produce la riga complessiva anche a tabella vuota.
+    riga_totali = next(r for r in righe_ordini if r["complessivo"])
+    return {
+        "ordini_totali": riga_totali["totale"],
+        "ordini_completati": riga_totali["completati"],
+        "ore": {r["ora"]: r["totale"] for r in righe_ordini if not r["complessivo"]},
+    }
+
+
+def _leggi_prodotti_statistiche(id_prodotti=None):
+    """Catalogo, quantità e incassi per metodo di pagamento (tutti i prodotti o solo quelli indicati)."""
+    filtro, argomenti = "", ()
+    if id_prodotti is not None:
+        filtro, argomenti = "WHERE p.id = ANY(%s)", (sorted(id_prodotti),)
+    righe_prodotti = esegui_query(
+        f"""
+        SELECT
+            p.id, p.nome, p.categoria_dashboard, p.venduti,
+            COALESCE(SUM(op.quantita) FILTER (WHERE o.metodo_pagamento = 'Contanti'), 0) AS contanti,
+            COALESCE(SUM(op.quantita) FILTER (WHERE o.metodo_pagamento = 'Carta'), 0) AS carta,
+            COALESCE(SUM(op.quantita * op.prezzo_unitario) FILTER (WHERE o.metodo_pagamento = 'Contanti'), 0)
+                AS incasso_contanti,
+            COALESCE(SUM(op.quantita * op.prezzo_unitario) FILTER (WHERE o.metodo_pagamento = 'Carta'), 0)
+                AS incasso_carta
+        FROM prodotti p
+        LEFT JOIN ordini_prodotti op ON op.prodotto_id = p.id
+        LEFT JOIN ordini o ON o.id = op.ordine_id
+        {filtro}
+        GROUP BY p.id
         """,
-        uno=True,
+        argomenti,
     )
-    totale_carta = float(riga_totale_carta["totale"] or 0)
 
-    # Distribuzione ordini per ora.
-    righe_ore = esegui_query(
-        """
-        SELECT EXTRACT(HOUR FROM data_ordine)::INT AS ora, COUNT(*) AS totale
-        FROM ordini
-        GROUP BY EXTRACT(HOUR FROM data_ordine)
-        ORDER BY ora ASC
-"""
-    )
-    ore = [dict(r) for r in righe_ore] if righe_ore else []
+    prodotti = {}
+    for riga in righe_prodotti:
+        prodotto = _nuovo_prodotto_statistiche(riga["nome"], riga["categoria_dashboard"], riga["venduti"])
+        prodotto["per_metodo"]["Contanti"] = int(riga["contanti"])
+        prodotto["per_metodo"]["Carta"] = int(riga["carta"])
+        prodotto["incassi"]["Contanti"] = riga["incasso_contanti"]
+        prodotto["incassi"]["Carta"] = riga["incasso_carta"]
+        prodotti[riga["id"]] = prodotto
+    return prodotti
 
-    # Volumi per categoria dashboard.
-    righe_cat = esegui_query(
-        """
-        SELECT p.categoria_dashboard, SUM(op.quantita) AS totale
-        FROM ordini_prodotti op
-        JOIN prodotti p ON p.id = op.prodotto_id
-        GROUP BY p.categoria_dashboard
-        """
-    )
-    categorie = [{"categoria_dashboard": r["categoria_dashboard"], "totale": int(r["totale"])} for r in righe_cat] if righe_cat else []
 
-    # Classifica prodotti più venduti.
-    righe_top10 = esegui_query(
-        """
-        SELECT nome, venduti
-        FROM prodotti
-        ORDER BY venduti DESC
-        LIMIT 10
-        """
-    )
-    top10 = [dict(r) for r in righe_top10] if righe_top10 else []
+def _carica_stato_statistiche_da_db():
+    """Legge dal database i contatori su cui lavora l'aggregazione incrementale."""
+    with transazione(snapshot=True):
+        stato = _leggi_contatori_ordini()
+        # Catalogo, quantità e incassi per metodo di pagamento in un solo join.
+        stato["prodotti"] = _leggi_prodotti_statistiche()
+    return stato
+
+
+def _componi_statistiche(stato):
+    """Deriva dai contatori interni il dizionario esposto da /api/statistiche."""
+    incassi = {metodo: Decimal(0) for metodo in _METODI_PAGAMENTO}
+    volumi_categoria = {}
+    for prodotto in stato["prodotti"].values():
+        quantita_prodotto = 0
+        for metodo, quantita in prodotto["per_metodo"].items():
+            incassi[metodo] += prodotto["incassi"][metodo]
+            quantita_prodotto += quantita
+        if quantita_prodotto:
+            categoria = prodotto["categoria_dashboard"]
+            volumi_categoria[categoria] = volumi_categoria.get(categoria, 0) + quantita_prodotto
+
+    # Classifica prodotti più venduti (a parità, vince l'id più basso).
+    classifica = sorted(stato["prodotti"].items(), key=lambda voce: (-voce[1]["venduti"], voce[0]))[:10]
 
     return {
         "totali": {
-            "ordini_totali": ordini_totali,
-            "ordini_completati": ordini_completati,
-            "totale_incasso": totale_incasso,
-            "totale_contanti": totale_contanti,
-            "totale_carta": totale_carta,
+            "ordini_totali": stato["ordini_totali"],
+            "ordini_completati": stato["ordini_completati"],
+            "totale_incasso": float(sum(incassi.values())),
+            "totale_contanti": float(incassi["Contanti"]),
+            "totale_carta": float(incassi["Carta"]),
         },
-        "categorie": categorie,
-        "ore": ore,
-        "top10": top10,
+        "categorie": [
+            {"categoria_dashboard": categoria, "totale": totale}
+            for categoria, totale in sorted(volumi_categoria.items())
+        ],
+        "ore": [{"ora": ora, "totale": totale} for ora, totale in sorted(stato["ore"].items()) if totale],
+        "top10": [{"nome": prodotto["nome"], "venduti": prodotto["venduti"]} for _, prodotto in classifica],
     }
 
 
-def ricalcola_statistiche(notifica=True):
-    """Ricalcola le statistiche e aggiorna la cache in memoria."""
+def _congela(valore):
+    """Converte ricorsivamente dict e liste in strutture di sola lettura."""
+    if isinstance(valore, dict):
+        return types.MappingProxyType({chiave: _congela(v) for chiave, v in valore.items()})
+    if isinstance(valore, list):
+        return tuple(_congela(v) for v in valore)
+    return valore
+
+
+def _pubblica_statistiche(dati):
+    """Sostituisce lo snapshot in cache (da chiamare con _statistiche_lock acquisito)."""
     global _statistiche_cache
+    # JSON serializzato una volta sola: /api/statistiche restituisce direttamente i byte.
+    corpo = json.dumps(dati, separators=(",", ":")).encode()
+    _statistiche_cache = SnapshotStatistiche(next(_versioni_statistiche), _congela(dati), corpo)
+
+
+def _applica_delta_statistiche(applica):
+    """Applica un delta ai contatori interni e rigenera la cache."""
+    global _statistiche_incoerenti
+    with _statistiche_lock:
+        if _statistiche_cache is None or _statistiche_stato is None:
+            # Cache non ancora idratata: il primo accesso leggerà tutto dal DB.
+            return
+        if _ricalcoli_in_corso:
+            # Il ricalcolo in corso potrebbe non includere questo evento.
+            _statistiche_incoerenti = True
+        try:
+            applica(_statistiche_stato)
+        except KeyError as e:
+            logger.warning("Delta statistiche non applicabile (chiave %s): ricalcolo completo pianificato", e)
+            _statistiche_incoerenti = True
+            return
+        _pubblica_statistiche(_componi_statistiche(_statistiche_stato))
+
+
+def _incasso(prezzo_unitario, quantita):
+    # Righe senza prezzo salvato (inserite a mano) non incassano, come nella SUM del ricalcolo.
+    return Decimal(str(prezzo_unitario or 0)) * quantita
+
+
+def _verifica_prodotti(stato, righe):
+    # Valida le righe prima di modificare i contatori (niente delta parziali).
+    for prodotto_id, *_ in righe:
+        if prodotto_id not in stato["prodotti"]:
+            raise KeyError(prodotto_id)
+
+
+def statistiche_aggiungi_ordine(data_ordine, metodo_pagamento, righe):
+    """Delta per un nuovo ordine; righe è una lista di (prodotto_id, quantita, prezzo_unitario)."""
+    def applica(stato):
+        _verifica_prodotti(stato, righe)
+        stato["ordini_totali"] += 1
+        stato["ore"][data_ordine.hour] = stato["ore"].get(data_ordine.hour, 0) + 1
+        for prodotto_id, quantita, prezzo_unitario in righe:
+            prodotto = stato["prodotti"][prodotto_id]
+            prodotto["per_metodo"][metodo_pagamento] += quantita
+            prodotto["incassi"][metodo_pagamento] += _incasso(prezzo_unitario, quantita)
+            prodotto["venduti"] += quantita
+
+    _applica_delta_statistiche(applica)
+
+
+def statistiche_rimuovi_ordine(data_ordine, metodo_pagamento, completato, righe):
+    """Delta per un ordine eliminato (stock e venduti già ripristinati a DB)."""
+    def applica(stato):
+        _verifica_prodotti(stato, righe)
+        stato["ordini_totali"] -= 1
+        if completato:
+            stato["ordini_completati"] -= 1
+        stato["ore"][data_ordine.hour] = stato["ore"].get(data_ordine.hour, 0) - 1
+        for prodotto_id, quantita, prezzo_unitario in righe:
+            prodotto = stato["prodotti"][prodotto_id]
+            prodotto["per_metodo"][metodo_pagamento] -= quantita
+            prodotto["incassi"][metodo_pagamento] -= _incasso(prezzo_unitario, quantita)
+            prodotto["venduti"] -= quantita
+
+    _applica_delta_statistiche(applica)
+
+
+def statistiche_cambia_pagamento(metodo_precedente, metodo_nuovo, righe):
+    """Delta per un ordine il cui metodo di pagamento è stato modificato."""
+    def applica(stato):
+        _verifica_prodotti(stato, righe)
+        for prodotto_id, quantita, prezzo_unitario in righe:
+            prodotto = stato["prodotti"][prodotto_id]
+            prodotto["per_metodo"][metodo_precedente] -= quantita
+            prodotto["per_metodo"][metodo_nuovo] += quantita
+            incasso = _incasso(prezzo_unitario, quantita)
+            prodotto["incassi"][metodo_precedente] -= incasso
+            prodotto["incassi"][metodo_nuovo] += incasso
+
+    _applica_delta_statistiche(applica)
+
+
+def statistiche_cambia_completati(variazione):
+    """Delta sul numero di ordini completati (+1 completato, -1 riaperto)."""
+    def applica(stato):
+        stato["ordini_completati"] += variazione
+
+    _applica_delta_statistiche(applica)
+
+
+def statistiche_aggiorna_prodotto(prodotto_id, nome, categoria_dashboard):
+    """Delta per un prodotto creato o modificato (il prezzo vale solo per i nuovi ordini)."""
+    def applica(stato):
+        prodotto = stato["prodotti"].get(prodotto_id)
+        if prodotto is None:
+            stato["prodotti"][prodotto_id] = _nuovo_prodotto_statistiche(nome, categoria_dashboard)
+            return
+        prodotto["nome"] = nome
+        prodotto["categoria_dashboard"] = categoria_dashboard
+
+    _applica_delta_statistiche(applica)
+
+
+def statistiche_rimuovi_prodotto(prodotto_id):
+    """Delta per un prodotto eliminato dal catalogo."""
+    def applica(stato):
+        del stato["prodotti"][prodotto_id]
+
+    _applica_delta_statistiche(applica)
+
+
+def statistiche_riallinea(id_prodotti):
+    """Rilegge i contatori degli ordini e i prodotti indicati dopo modifiche esterne.
+
+    Serve quando il payload del feed non basta per un delta (ordini modificati o
+    eliminati altrove): si rilegge solo ciò che la modifica può aver toccato.
+    """
+    global _ricalcoli_in_corso
+    with _statistiche_lock:
+        if _statistiche_cache is None or _statistiche_stato is None:
+            return
+        # Come un ricalcolo: i delta locali che arrivano durante la lettura segnano incoerenza.
+        _ricalcoli_in_corso += 1
+
+    def applica(stato):
+        contatori, prodotti = letti
+        stato.update(contatori)
+        for prodotto_id in id_prodotti:
+            if prodotto_id in prodotti:
+                stato["prodotti"][prodotto_id] = prodotti[prodotto_id]
+            else:
+                stato["prodotti"].pop(prodotto_id, None)
+
+    letti = None
+    try:
+        with transazione(snapshot=True):
+            letti = (
+                _leggi_contatori_ordini(),
+                _leggi_prodotti_statistiche(id_prodotti) if id_prodotti else {},
+            )
+    finally:
+        with _statistiche_lock:
+            # Decremento e applicazione insieme: nessun delta può cadere nel mezzo, e
+            # il contatore torna a posto qualunque cosa fallisca.
+            _ricalcoli_in_corso -= 1
+            if letti is not None:
+                _applica_delta_statistiche(applica)
+
+
+def _verifica_coerenza_statistiche():
+    """Confronta i contatori in memoria con il DB; False se divergono."""
+    global _ultima_verifica_statistiche
+    riga = esegui_query(
+        "SELECT COUNT(*) AS totali, COUNT(*) FILTER (WHERE completato) AS completati FROM ordini",
+        uno=True,
+    )
+    with _statistiche_lock:
+        _ultima_verifica_statistiche = time.monotonic()
+        if _statistiche_stato is None:
+            return False
+        coerente = (
+            _statistiche_stato["ordini_totali"] == riga["totali"]
+            and _statistiche_stato["ordini_completati"] == riga["completati"]
+        )
+    if not coerente:
+        logger.warning("Statistiche incoerenti con il database: ricalcolo completo")
+    return coerente
+
+
+def ricalcola_statistiche(notifica=True):
+    """Ricalcola da zero le statistiche e aggiorna la cache in memoria."""
+    global _statistiche_stato, _statistiche_incoerenti, _ricalcoli_in_corso
     logger.debug("Ricalcolo statistiche avviato")
-    nuovi_dati = _calcola_dati_statistiche_da_db()
     with _statistiche_lock:
-        # Salva una copia isolata per evitare mutazioni accidentali dal chiamante.
-        _statistiche_cache = copy.deepcopy(nuovi_dati)
+        _ricalcoli_in_corso += 1
+        _statistiche_incoerenti = False
+    try:
+        stato = _carica_stato_statistiche_da_db()
+    except Exception:
+        with _statistiche_lock:
+            _ricalcoli_in_corso -= 1
+        raise
+    nuovi_dati = _componi_statistiche(stato)
+    with _statistiche_lock:
+        # Decremento e sostituzione insieme: un delta che arriva nel mezzo verrebbe
+        # applicato al vecchio stato e perso senza segnalare incoerenza.
+        _ricalcoli_in_corso -= 1
+        _statistiche_stato = stato
+        _pubblica_statistiche(nuovi_dati)
     logger.debug("Statistiche ricalcolate - ordini totali: %s, incasso: %.2f EUR",
                  nuovi_dati["totali"]["ordini_totali"],
                  nuovi_dati["totali"]["totale_incasso"])
@@ -204,75 +909,443 @@ def ricalcola_statistiche(notifica=True):
         emissione_sicura("aggiorna_dashboard", {})
 
 
-def cambia_stato_automatico(ordine_id, categoria, id_timer):
-    """Gestisce il passaggio automatico allo stato 'Completato' dopo un timeout."""
-    chiave_timer = (ordine_id, categoria)
-
-    # Attende un breve timeout (con possibilità di annullamento).
-    for _ in range(_TIMEOUT_AUTO_COMPLETAMENTO_SEC):
-        # Sleep cooperativo per non bloccare l'event loop SocketIO.
-        socketio.sleep(1)
-        if (
-            chiave_timer not in timer_attivi
-            or timer_attivi[chiave_timer]["id"] != id_timer
-            or timer_attivi[chiave_timer]["annulla"]
-        ):
-            logger.debug("Timer annullato per ordine #%s [%s]", ordine_id, categoria)
+def aggiorna_statistiche(notifica=True):
+    """Dopo una modifica: ricalcolo completo solo se i delta non bastano, poi notifica."""
+    with _statistiche_lock:
+        idratate = _statistiche_cache is not None
+        da_ricalcolare = idratate and _statistiche_incoerenti
+        da_verificare = time.monotonic() - _ultima_verifica_statistiche >= _INTERVALLO_VERIFICA_STATISTICHE_SEC
+
+    if idratate and not da_ricalcolare and da_verificare:
+        da_ricalcolare = not _verifica_coerenza_statistiche()
+
+    if da_ricalcolare:
+        ricalcola_statistiche(notifica=notifica)
+    elif notifica:
+        emissione_sicura("aggiorna_dashboard", {})
+
+
+def pianifica_aggiornamento_statistiche():
+    """Richiede un aggiornamento statistiche; le richieste ravvicinate ne producono uno solo."""
+    global _pianificatore_attivo, _aggiornamento_in_attesa
+    with _pianificatore_lock:
+        _contatori_pianificatore["richieste"] += 1
+        if _aggiornamento_in_attesa:
+            # Un'esecuzione non ancora partita coprirà anche questa richiesta.
+            _contatori_pianificatore["accorpate"] += 1
+            return
+        _aggiornamento_in_attesa = True
+        if _pianificatore_attivo:
+            # Aggiornamento in corso: al termine il task ne esegue un altro.
             return
+        _pianificatore_attivo = True
+    try:
+        socketio.start_background_task(_esegui_aggiornamenti_statistiche)
+    except Exception:
+        with _pianificatore_lock:
+            _pianificatore_attivo = False
+            _aggiornamento_in_attesa = False
+        raise
 
-    # Ricontrolla stato + ID: un nuovo click su "Pronto" sostituisce il timer con uno nuovo.
-    if (
-        chiave_timer not in timer_attivi
-        or timer_attivi[chiave_timer]["annulla"]
-        or timer_attivi[chiave_timer]["id"] != id_timer
-    ):
-        logger.debug("Timer annullato prima del completamento per ordine #%s [%s]", ordine_id, categoria)
-        return
 
-    # Forza lo stato "Completato" per tutti i prodotti della categoria.
-    esegui_query(
-        """
-        UPDATE ordini_prodotti
-        SET stato = 'Completato'
-        WHERE ordine_id = %s
-        AND prodotto_id IN (
-            SELECT id FROM prodotti WHERE categoria_dashboard = %s
-        );
-    """,
-        (ordine_id, categoria),
-        commit=True,
+def _esegui_aggiornamenti_statistiche():
+    """Task unico del pianificatore: attende la finestra, aggiorna, ripete se richiesto."""
+    global _pianificatore_attivo, _aggiornamento_in_attesa
+    while True:
+        # Le richieste che arrivano durante l'attesa confluiscono in questa esecuzione.
+        socketio.sleep(_RITARDO_STATISTICHE_SEC)
+        with _pianificatore_lock:
+            _aggiornamento_in_attesa = False
+        try:
+            aggiorna_statistiche()
+        except Exception as e:
+            logger.error("Errore durante l'aggiornamento pianificato delle statistiche: %s", e)
+        with _pianificatore_lock:
+            _contatori_pianificatore["esecuzioni"] += 1
+            if not _aggiornamento_in_attesa:
+                _pianificatore_attivo = False
+                return
+
+
+def contatori_pianificatore_statistiche():
+    """Restituisce richieste ricevute, richieste accorpate ed esecuzioni effettive."""
+    with _pianificatore_lock:
+        return dict(_contatori_pianificatore)
+
+
+# Righe della categoria bloccate, nuovo stato calcolato dal precedente, righe e
+# flag completato dell'ordine aggiornati: tutto in un'unica istruzione atomica.
+_QUERY_TRANSIZIONE_STATO = """
+    WITH righe AS (
+        SELECT op.prodotto_id, op.stato
+        FROM ordini_prodotti op
+        JOIN prodotti p ON p.id = op.prodotto_id
+        WHERE op.ordine_id = %(ordine_id)s AND p.categoria_dashboard = %(categoria)s
+        FOR UPDATE OF op
+    ), transizione AS (
+        SELECT stato AS stato_precedente,
+               CASE
+                   WHEN stato = 'In Attesa' THEN 'In Preparazione'
+                   WHEN stato = 'In Preparazione' THEN 'Pronto'
+                   WHEN stato = 'Pronto' THEN 'In Preparazione'
+               END AS nuovo_stato
+        FROM righe
+        LIMIT 1
+    ), aggiornate AS (
+        UPDATE ordini_prodotti op
+        SET stato = t.nuovo_stato,
+            pronto_dal = CASE WHEN t.nuovo_stato = 'Pronto' THEN CURRENT_TIMESTAMP END
+        FROM transizione t
+        WHERE t.nuovo_stato IS NOT NULL
+          AND op.ordine_id = %(ordine_id)s
+          AND op.prodotto_id IN (SELECT prodotto_id FROM righe)
+    ), esito AS (
+        SELECT t.stato_precedente, t.nuovo_stato,
+               COALESCE(t.nuovo_stato, t.stato_precedente) = 'Completato' AND NOT EXISTS (
+                   SELECT 1 FROM ordini_prodotti op
+                   WHERE op.ordine_id = %(ordine_id)s
+                     AND op.stato <> 'Completato'
+                     AND op.prodotto_id NOT IN (SELECT prodotto_id FROM righe)
+               ) AS completato
+        FROM transizione t
+    ), ordine AS (
+        UPDATE ordini o
+        SET completato = e.completato
+        FROM esito e
+        WHERE o.id = %(ordine_id)s AND e.nuovo_stato IS NOT NULL AND o.completato <> e.completato
+        RETURNING o.id
     )
+    SELECT e.stato_precedente, e.nuovo_stato, e.completato, EXISTS (SELECT 1 FROM ordine) AS variato
+    FROM esito e
+"""
+
 
-    # Aggiorna il flag completato dell'ordine se non restano prodotti non completati.
-    residui = esegui_query(
-        "SELECT COUNT(*) AS c FROM ordini_prodotti WHERE ordine_id = %s AND stato != 'Completato'",
-        (ordine_id,),
+def applica_transizione_stato(ordine_id, categoria):
+    """Avanza lo stato di una categoria dell'ordine con una sola query.
+
+    Restituisce None se ordine o categoria non esistono, altrimenti stato_precedente,
+    nuovo_stato (None se la categoria era già completata), completato e variato.
+    """
+    return esegui_query(
+        _QUERY_TRANSIZIONE_STATO,
+        {"ordine_id": ordine_id, "categoria": categoria},
         uno=True,
-    )["c"]
-    esegui_query(
-        "UPDATE ordini SET completato = %s WHERE id = %s",
-        (residui == 0, ordine_id),
         commit=True,
     )
 
-    logger.info("Completamento automatico ordine #%s [%s] - residui non completati: %s", ordine_id, categoria, residui)
 
-    # Rimuove il timer e notifica la dashboard interessata.
-    timer_attivi.pop(chiave_timer, None)
+# Completa in blocco le righe rimaste in "Pronto" oltre il timeout (indice parziale su
+# pronto_dal) e chiude gli ordini senza più righe aperte. Le righe bloccate da un altro
+# worker vengono saltate. Restituisce le coppie completate e se l'ordine è chiuso.
+_QUERY_COMPLETAMENTO_SCADUTI = """
+    WITH righe AS (
+        SELECT op.ordine_id, op.prodotto_id, p.categoria_dashboard AS categoria
+        FROM ordini_prodotti op
+        JOIN prodotti p ON p.id = op.prodotto_id
+        WHERE op.stato = 'Pronto'
+          AND op.pronto_dal <= CURRENT_TIMESTAMP - %(timeout)s * INTERVAL '1 second'
+        FOR UPDATE OF op SKIP LOCKED
+    ), completate AS (
+        UPDATE ordini_prodotti op
+        SET stato = 'Completato', pronto_dal = NULL
+        FROM righe r
+        WHERE op.ordine_id = r.ordine_id AND op.prodotto_id = r.prodotto_id
+        RETURNING op.ordine_id, op.prodotto_id
+    ), chiusi AS (
+        UPDATE ordini o
+        SET completato = TRUE
+        WHERE o.id IN (SELECT ordine_id FROM completate)
+          AND NOT o.completato
+          AND NOT EXISTS (
+              SELECT 1 FROM ordini_prodotti op
+              WHERE op.ordine_id = o.id
+                AND op.stato <> 'Completato'
+                AND (op.ordine_id, op.prodotto_id) NOT IN (SELECT ordine_id, prodotto_id FROM completate)
+          )
+        RETURNING o.id
+    )
+    SELECT DISTINCT r.ordine_id, r.categoria, r.ordine_id IN (SELECT id FROM chiusi) AS ordine_chiuso
+    FROM righe r
+"""
+
+# Categorie ancora in "Pronto" con i secondi mancanti alla scadenza (negativi se già scadute).
+_QUERY_COMPLETAMENTI_IN_SOSPESO = """
+    SELECT op.ordine_id, p.categoria_dashboard AS categoria,
+           %(timeout)s - EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(op.pronto_dal))::FLOAT AS residuo
+    FROM ordini_prodotti op
+    JOIN prodotti p ON p.id = op.prodotto_id
+    WHERE op.stato = 'Pronto'
+    GROUP BY op.ordine_id, p.categoria_dashboard
+"""
+
+# Righe ordine-prodotto degli ordini indicati dal feed, con i dati per tabellone e statistiche.
+_QUERY_ORDINI_PER_ID = """
+    SELECT
+        o.id AS ordine_id, o.nome_cliente, o.numero_tavolo, o.numero_persone, o.data_ordine,
+        o.metodo_pagamento, o.completato,
+        p.categoria_dashboard, op.stato, op.prodotto_id, p.nome AS prodotto_nome, op.quantita,
+        op.prezzo_unitario
+    FROM ordini AS o
+    JOIN ordini_prodotti AS op ON o.id = op.ordine_id
+    JOIN prodotti AS p ON p.id = op.prodotto_id
+    WHERE o.id = ANY(%s)
+    ORDER BY o.data_ordine ASC, o.id ASC
+"""
+
+
+def _tick_attuale():
+    return int(time.monotonic() / _TICK_TIMER_SEC)
+
+
+def _rimuovi_timer(chiave):
+    """Toglie la chiave dalla ruota; richiede _timer_lock."""
+    scadenza = _scadenze_timer.pop(chiave, None)
+    if scadenza is not None:
+        _ruota_timer[scadenza % _SLOT_RUOTA_TIMER].pop(chiave, None)
+    return scadenza is not None
+
+
+def pianifica_completamento(ordine_id, categoria, ritardo=None):
+    """(Ri)programma il risveglio per il completamento automatico di una categoria.
+
+    La scadenza vera è pronto_dal sul database: la ruota decide solo quando controllarla.
+    """
+    global _ruota_attiva
+    if ritardo is None:
+        ritardo = _TIMEOUT_AUTO_COMPLETAMENTO_SEC
+    chiave = (ordine_id, categoria)
+    # Un tick in più: il risveglio non arriva mai prima della scadenza su DB.
+    scadenza = _tick_attuale() + math.ceil(max(ritardo, 0) / _TICK_TIMER_SEC) + 1
+    with _timer_lock:
+        _rimuovi_timer(chiave)
+        _scadenze_timer[chiave] = scadenza
+        _ruota_timer[scadenza % _SLOT_RUOTA_TIMER][chiave] = scadenza
+        avvia = not _ruota_attiva
+        _ruota_attiva = True
+    if avvia:
+        socketio.start_background_task(_ciclo_ruota_timer)
+
+
+def annulla_completamento(ordine_id, categoria):
+    """Annulla il risveglio locale (es. ritorno da "Pronto"; su DB pronto_dal è già azzerato)."""
+    with _timer_lock:
+        return _rimuovi_timer((ordine_id, categoria))
+
+
+def _estrai_scaduti(tick):
+    """Estrae le chiavi scadute entro il tick, visitando ogni slot al più una volta."""
+    global _ultimo_tick_timer
+    scaduti = []
+    with _timer_lock:
+        for passo in range(max(_ultimo_tick_timer + 1, tick - _SLOT_RUOTA_TIMER + 1), tick + 1):
+            slot = _ruota_timer[passo % _SLOT_RUOTA_TIMER]
+            # Nello stesso slot convivono scadenze di giri successivi.
+            for chiave in [c for c, scadenza in slot.items() if scadenza <= tick]:
+                _rimuovi_timer(chiave)
+                scaduti.append(chiave)
+        _ultimo_tick_timer = tick
+    return scaduti
+
+
+def _ciclo_ruota_timer():
+    """Task unico che fa avanzare la ruota e, se qualcosa è scaduto, completa in blocco da DB."""
+    global _ruota_attiva
+    while True:
+        socketio.sleep(_TICK_TIMER_SEC)
+        scaduti = _estrai_scaduti(_tick_attuale())
+        if scaduti:
+            try:
+                completa_scaduti()
+            except Exception:
+                logger.exception("Errore nel completamento automatico di %s timer", len(scaduti))
+        with _timer_lock:
+            if not _scadenze_timer:
+                _ruota_attiva = False
+                return
+
 
-    emissione_sicura("aggiorna_dashboard", {"categoria": categoria}, stanza=categoria)
+def completa_scaduti():
+    """Porta a "Completato" tutte le righe scadute su DB: una query, un emit per categoria.
+
+    Completa anche timer programmati da altri worker o prima di un riavvio.
+    """
+    righe = esegui_query(
+        _QUERY_COMPLETAMENTO_SCADUTI,
+        {"timeout": _TIMEOUT_AUTO_COMPLETAMENTO_SEC},
+        commit=True,
+    )
+    if not righe:
+        return []
+
+    completati_per_categoria = {}
+    for riga in righe:
+        tabellone_cambia_stato(riga["ordine_id"], riga["categoria"], "Completato")
+        completati_per_categoria.setdefault(riga["categoria"], []).append(riga["ordine_id"])
+    ordini_chiusi = len({riga["ordine_id"] for riga in righe if riga["ordine_chiuso"]})
+    if ordini_chiusi:
+        statistiche_cambia_completati(ordini_chiusi)
+    incrementa_versioni("ordini")
+
+    logger.info("Completamento automatico di %s categorie - ordini chiusi: %s", len(righe), ordini_chiusi)
+
+    for categoria, id_ordini in completati_per_categoria.items():
+        emissione_delta_dashboard(categoria, {"tipo": "stati", "ids": id_ordini, "stato": "Completato"})
     # Aggiorna statistiche in background per non rallentare gli update realtime.
-    socketio.start_background_task(ricalcola_statistiche)
+    pianifica_aggiornamento_statistiche()
+    return righe
 
 
-def costruisci_dati_statistiche():
-    """Restituisce le statistiche dalla cache RAM (lazy init al primo uso)."""
-    global _statistiche_cache
-    with _statistiche_lock:
-        if _statistiche_cache is not None:
-            return copy.deepcopy(_statistiche_cache)
+def recupera_completamenti():
+    """All'avvio completa i timer scaduti e riprogramma sulla ruota quelli in sospeso."""
+    completa_scaduti()
+    in_sospeso = esegui_query(_QUERY_COMPLETAMENTI_IN_SOSPESO, {"timeout": _TIMEOUT_AUTO_COMPLETAMENTO_SEC})
+    for riga in in_sospeso:
+        pianifica_completamento(riga["ordine_id"], riga["categoria"], riga["residuo"])
+    logger.info("Completamenti automatici recuperati: %s in sospeso", len(in_sospeso))
+    return len(in_sospeso)
 
-    # Primo accesso dopo riavvio: calcolo una volta e riuso poi la cache.
-    ricalcola_statistiche(notifica=False)
+
+def _riallinea_tutto(tabelle):
+    """Ricarica tabellone, menu e statistiche: modifiche di cui non si conoscono le righe."""
+    global _statistiche_incoerenti
+    invalida_tabellone()
+    if "prodotti" in tabelle:
+        invalida_menu()
     with _statistiche_lock:
-        return copy.deepcopy(_statistiche_cache or {})
+        _statistiche_incoerenti = True
+    incrementa_versioni("ordini", "prodotti")
+    # Non si sa chi mostra gli ordini toccati: avvisa tutte le dashboard.
+    return set(_CATEGORIE_DASHBOARD)
+
+
+def _applica_ordini_esterni(id_ordini, id_prodotti, solo_inserimenti):
+    """Rilegge gli ordini indicati e li applica per delta a tabellone e statistiche.
+
+    Restituisce le categorie in cui gli ordini comparivano o compaiono ora.
+    """
+    righe = esegui_query(_QUERY_ORDINI_PER_ID, (sorted(id_ordini),))
+    schede = _raggruppa_tabellone(righe)
+    categorie = tabellone_sostituisci_ordini(id_ordini, schede) | set(schede)
+
+    if solo_inserimenti:
+        # Ordini nuovi: il payload basta per lo stesso delta che applicano le route.
+        nuovi = {}
+        for riga in righe:
+            nuovi.setdefault(riga["ordine_id"], (riga, []))[1].append(
+                (riga["prodotto_id"], riga["quantita"], riga["prezzo_unitario"])
+            )
+        for riga, righe_ordine in nuovi.values():
+            statistiche_aggiungi_ordine(riga["data_ordine"], riga["metodo_pagamento"], righe_ordine)
+            if riga["completato"]:
+                statistiche_cambia_completati(1)
+    else:
+        # Ordini modificati o eliminati: il delta dipende dai valori precedenti, che il
+        # payload non porta. Si rileggono contatori e prodotti coinvolti; le route che
+        # eliminano o modificano ordini aggiornano anche le scorte, quindi i prodotti
+        # delle righe sparite arrivano nel feed come modifiche a "prodotti".
+        statistiche_riallinea(id_prodotti | {riga["prodotto_id"] for riga in righe})
+    return categorie
+
+
+def _applica_prodotti_esterni(id_prodotti):
+    """Rilegge i prodotti indicati e li applica a menu e statistiche.
+
+    Restituisce True se nome o categoria di un prodotto esistente sono cambiati
+    (o non si può stabilire), cioè se il tabellone va ricaricato.
+    """
+    prodotti = esegui_query("SELECT * FROM prodotti WHERE id = ANY(%s) ORDER BY id", (sorted(id_prodotti),))
+    precedenti = menu_sostituisci_prodotti(id_prodotti, prodotti)
+
+    letti = set()
+    for prodotto in prodotti:
+        letti.add(prodotto["id"])
+        statistiche_aggiorna_prodotto(prodotto["id"], prodotto["nome"], prodotto["categoria_dashboard"])
+    for prodotto_id in id_prodotti - letti:
+        statistiche_rimuovi_prodotto(prodotto_id)
+
+    if precedenti is None:
+        return True
+    return any(
+        prodotto["id"] in precedenti
+        and (precedenti[prodotto["id"]]["nome"], precedenti[prodotto["id"]]["categoria_dashboard"])
+        != (prodotto["nome"], prodotto["categoria_dashboard"])
+        for prodotto in prodotti
+    )
+
+
+def applica_modifiche_esterne(modifiche):
+    """Riallinea cache e dashboard alle scritture fatte fuori da questo processo.
+
+    modifiche sono i payload del feed (tabella, op, ids, origine); quelle con
+    l'origine del processo sono già state applicate dalle route e vengono
+    ignorate. Le righe indicate negli "ids" si rileggono dal DB e si applicano
+    per delta; svuotamenti, riconnessioni e payload senza id ricaricano tutto.
+    Restituisce le categorie notificate.
+    """
+    esterne = [m for m in modifiche if m.get("origine") != origine_processo()]
+    if not esterne:
+        return set()
+
+    tabelle = {m["tabella"] for m in esterne}
+    if any(m["op"] not in _OPERAZIONI_DELTA or m["ids"] is None for m in esterne):
+        categorie = _riallinea_tutto(tabelle)
+    else:
+        id_ordini, id_prodotti, inseriti = set(), set(), set()
+        for modifica in esterne:
+            if modifica["tabella"] == "prodotti":
+                id_prodotti.update(modifica["ids"])
+            else:
+                id_ordini.update(modifica["ids"])
+                if modifica["tabella"] == "ordini" and modifica["op"] == "INSERT":
+                    inseriti.update(modifica["ids"])
+        solo_inserimenti = all(
+            m["op"] == "INSERT" and set(m["ids"]) <= inseriti
+            for m in esterne if m["tabella"] != "prodotti"
+        )
+
+        categorie = set()
+        # Prima i prodotti: gli ordini nuovi possono riferirsi a prodotti appena creati.
+        if id_prodotti:
+            if _applica_prodotti_esterni(id_prodotti):
+                invalida_tabellone()
+                categorie = set(_CATEGORIE_DASHBOARD)
+            incrementa_versioni("prodotti")
+        if id_ordini:
+            # Ordini eliminati prima che il tabellone fosse caricato: nessuna categoria nota.
+            categorie |= _applica_ordini_esterni(id_ordini, id_prodotti, solo_inserimenti) or set(_CATEGORIE_DASHBOARD)
+            incrementa_versioni("ordini")
+
+    logger.info("Modifiche esterne su %s: aggiornamento dashboard %s", sorted(tabelle), sorted(categorie))
+    for categoria in sorted(categorie):
+        emissione_sicura("aggiorna_dashboard", {"categoria": categoria}, stanza=categoria, locale=True)
+    pianifica_aggiornamento_statistiche()
+    return categorie
+
+
+def ascolta_modifiche_db(fermo=None):
+    """Task unico che traduce il feed delle modifiche del DB in eventi realtime."""
+    for blocco in ascolta_notifiche(_CANALE_MODIFICHE, fermo=fermo):
+        if blocco is None:
+            # Riconnessione: le notifiche perse potrebbero riguardare qualunque cosa.
+            modifiche = [{"tabella": "prodotti", "op": "RICONNESSIONE", "ids": None, "origine": None}]
+        else:
+            modifiche = [json.loads(payload) for payload in blocco]
+        try:
+            applica_modifiche_esterne(modifiche)
+        except Exception:
+            logger.exception("Errore nell'applicazione di %s modifiche esterne", len(modifiche))
+
+
+def snapshot_statistiche():
+    """Restituisce lo snapshot corrente delle statistiche (lazy init al primo uso)."""
+    snapshot = _statistiche_cache
+    if snapshot is None:
+        # Primo accesso dopo riavvio: calcolo una volta e riuso poi la cache.
+        ricalcola_statistiche(notifica=False)
+        snapshot = _statistiche_cache
+    return snapshot
+
+
+def costruisci_dati_statistiche():
+    """Restituisce le statistiche dalla cache RAM come struttura di sola lettura."""
+    return snapshot_statistiche().dati
@@ -0,0 +1,266 @@
+import collections
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from db import esegui_query
+
+logger = logging.getLogger(__name__)
+
+# Backend delle sessioni: vuoto (cookie firmato di Flask), "memoria" (nel processo,
+# un solo worker) o "postgres" (tabella condivisa tra i worker al posto di uno store esterno).
+# Con i backend server il cookie porta solo un id opaco.
+_BACKEND = os.getenv("SESSIONI_BACKEND", "").strip()
+
+_INTERVALLO_PULIZIA_SEC = 60
+
+# Letture del backend postgres tenute in memoria per processo: le scritture del
+# processo le invalidano subito, quelle degli altri worker entro questo tempo.
+_CACHE_LETTURE_SEC = float(os.getenv("SESSIONI_CACHE_SEC", "2"))
+
+# File statici ed eventi Socket.IO non usano la sessione: niente lettura dall'archivio.
+_PERCORSI_SENZA_SESSIONE = ("/socket.io/",)
+
+_archivio = None
+
+
+def _nuovo_id():
+    return secrets.token_urlsafe(32)
+
+
+class SessioneServer(CallbackDict, SessionMixin):
+    """Sessione con i dati sul server: il client conosce solo l'id."""
+
+    def __init__(self, dati=None, sid=None, nuova=False):
+        def su_modifica(sessione):
+            sessione.modified = True
+
+        super().__init__(dati, su_modifica)
+        self.sid = sid
+        self.new = nuova
+        self.modified = False
+        # Un cambio di utente (login) rinnova l'id: evita la session fixation.
+        self.id_utente_iniziale = self.get("id_utente")
+
+
+class ArchivioMemoria:
+    """Sessioni nel dizionario del processo: nessun I/O né firma per richiesta."""
+
+    def __init__(self):
+        # id -> (scadenza monotonic, dati) e id_utente -> id delle sue sessioni.
+        self._sessioni = {}
+        self._per_utente = collections.defaultdict(set)
+        self._lock = threading.Lock()
+        self._ultima_pulizia = time.monotonic()
+
+    def _rimuovi(self, sid):
+        voce = self._sessioni.pop(sid, None)
+        if voce is None:
+            return
+        id_utente = voce[1].get("id_utente")
+        sessioni_utente = self._per_utente.get(id_utente)
+        if sessioni_utente is not None:
+            sessioni_utente.discard(sid)
+            if not sessioni_utente:
+                del self._per_utente[id_utente]
+
+    def _pulisci_scadute(self, adesso):
+        if adesso - self._ultima_pulizia < _INTERVALLO_PULIZIA_SEC:
+            return
+        self._ultima_pulizia = adesso
+        for sid in [sid for sid, (scadenza, _) in self._sessioni.items() if scadenza <= adesso]:
+            self._rimuovi(sid)
+
+    def leggi(self, sid):
+        with self._lock:
+            voce = self._sessioni.get(sid)
+            if voce is None:
+                return None
+            if voce[0] <= time.monotonic():
+                self._rimuovi(sid)
+                return None
+            return dict(voce[1])
+
+    def scrivi(self, sid, dati, durata):
+        adesso = time.monotonic()
+        with self._lock:
+            self._pulisci_scadute(adesso)
+            self._rimuovi(sid)
+            self._sessioni[sid] = (adesso + durata, dict(dati))
+            if dati.get("id_utente") is not None:
+                self._per_utente[dati["id_utente"]].add(sid)
+
+    def elimina(self, sid):
+        with self._lock:
+            self._rimuovi(sid)
+
+    def aggiorna_utente(self, id_utente, utente):
+        with self._lock:
+            for sid in list(self._per_utente.get(id_utente, ())):
+                if utente is None or not utente["attivo"]:
+                    self._rimuovi(sid)
+                else:
+                    self._sessioni[sid][1]["utente"] = dict(utente)
+
+
+class ArchivioPostgres:
+    """Sessioni nella tabella UNLOGGED "sessioni": condivise da tutti i worker."""
+
+    def __init__(self, durata_cache=_CACHE_LETTURE_SEC):
+        # id -> (scadenza monotonic in cache, dati): evita una SELECT per ogni richiesta.
+        self._durata_cache = durata_cache
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._ultima_pulizia = time.monotonic()
+
+    def _dimentica(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def leggi(self, sid):
+        adesso = time.monotonic()
+        with self._lock:
+            voce = self._cache.get(sid)
+            if voce is not None and voce[0] > adesso:
+                return dict(voce[1])
+
+        riga = esegui_query(
+            """
+            SELECT dati, EXTRACT(EPOCH FROM scadenza - CURRENT_TIMESTAMP)::FLOAT AS residuo
+            FROM sessioni WHERE id = %s AND scadenza > CURRENT_TIMESTAMP
+            """,
+            (sid,),
+            uno=True,
+        )
+        if not riga:
+            self._dimentica(sid)
+            return None
+        if self._durata_cache > 0:
+            with self._lock:
+                if adesso - self._ultima_pulizia >= _INTERVALLO_PULIZIA_SEC:
+                    self._ultima_pulizia = adesso
+                    self._cache = {chiave: voce for chiave, voce in self._cache.items() if voce[0] > adesso}
+                # Mai oltre la scadenza della sessione sul DB.
+                self._cache[sid] = (adesso + min(self._durata_cache, riga["residuo"]), riga["dati"])
+        return dict(riga["dati"])
+
+    def scrivi(self, sid, dati, durata):
+        # Le scritture arrivano solo da login, logout e modifiche: la pulizia viaggia con loro.
+        esegui_query("""
+            WITH pulizia AS (
+                DELETE FROM sessioni WHERE scadenza <= CURRENT_TIMESTAMP
+            )
+            INSERT INTO sessioni (id, id_utente, dati, scadenza)
+            VALUES (%(id)s, %(id_utente)s, %(dati)s, CURRENT_TIMESTAMP + %(durata)s * INTERVAL '1 second')
+            ON CONFLICT (id) DO UPDATE
+            SET id_utente = EXCLUDED.id_utente, dati = EXCLUDED.dati, scadenza = EXCLUDED.scadenza
+        """, {
+            "id": sid,
+            "id_utente": dati.get("id_utente"),
+            "dati": json.dumps(dati, default=str),
+            "durata": durata,
+        }, commit=True)
+        self._dimentica(sid)
+
+    def elimina(self, sid):
+        esegui_query("DELETE FROM sessioni WHERE id = %s", (sid,), commit=True)
+        self._dimentica(sid)
+
+    def aggiorna_utente(self, id_utente, utente):
+        if utente is None or not utente["attivo"]:
+            esegui_query("DELETE FROM sessioni WHERE id_utente = %s", (id_utente,), commit=True)
+        else:
+            esegui_query(
+                "UPDATE sessioni SET dati = jsonb_set(dati, '{utente}', %s::jsonb) WHERE id_utente = %s",
+                (json.dumps(utente), id_utente),
+                commit=True,
+            )
+        with self._lock:
+            self._cache = {sid: voce for sid, voce in self._cache.items() if voce[1].get("id_utente") != id_utente}
+
+
+class InterfacciaSessioniServer(SessionInterface):
+    """SessionInterface di Flask appoggiata a un archivio lato server."""
+
+    def __init__(self, archivio):
+        self.archivio = archivio
+
+    def open_session(self, app, request):
+        if request.path.startswith((f"{app.static_url_path}/", *_PERCORSI_SENZA_SESSIONE)):
+            # Sessione nulla: Flask non la salva e l'archivio non viene interrogato.
+            return self.make_null_session(app)
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            dati = self.archivio.leggi(sid)
+            if dati is not None:
+                return SessioneServer(dati, sid)
+        # Id sconosciuto o scaduto: mai riusato, la sessione riparte con un id nuovo.
+        return SessioneServer(sid=_nuovo_id(), nuova=True)
+
+    def save_session(self, app, sessione, risposta):
+        nome = self.get_cookie_name(app)
+        dominio = self.get_cookie_domain(app)
+        percorso = self.get_cookie_path(app)
+
+        if sessione.accessed:
+            risposta.vary.add("Cookie")
+
+        if not sessione:
+            # Sessione svuotata (logout o account disattivato): via dal server e dal browser.
+            if sessione.modified and not sessione.new:
+                self.archivio.elimina(sessione.sid)
+                risposta.delete_cookie(nome, domain=dominio, path=percorso)
+            return
+
+        if not sessione.new and sessione.get("id_utente") != sessione.id_utente_iniziale:
+            self.archivio.elimina(sessione.sid)
+            sessione.sid = _nuovo_id()
+            sessione.new = True
+
+        if sessione.modified or sessione.new:
+            self.archivio.scrivi(sessione.sid, dict(sessione), app.permanent_session_lifetime.total_seconds())
+
+        if sessione.new:
+            risposta.set_cookie(
+                nome,
+                sessione.sid,
+                expires=self.get_expiration_time(app, sessione),
+                httponly=self.get_cookie_httponly(app),
+                domain=dominio,
+                path=percorso,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def configura_sessioni(app, backend=_BACKEND):
+    """Installa sull'app il backend di sessione scelto (nessuno: cookie firmato di Flask)."""
+    global _archivio
+    if not backend:
+        _archivio = None
+        return
+    if backend == "memoria":
+        _archivio = ArchivioMemoria()
+    elif backend == "postgres":
+        _archivio = ArchivioPostgres()
+    else:
+        raise ValueError(f"SESSIONI_BACKEND non valido: '{backend}' (ammessi: memoria, postgres)")
+    app.session_interface = InterfacciaSessioniServer(_archivio)
+    logger.info("Sessioni lato server (backend: %s)", backend)
+
+
+def aggiorna_sessioni_utente(id_utente, utente):
+    """Propaga alle sessioni aperte dell'utente il nuovo snapshot (None se eliminato).
+
+    Un utente disattivato o eliminato perde subito tutte le sessioni. Con le
+    sessioni nel cookie non c'è nulla da raggiungere: lo snapshot del cookie
+    resta valido finché il browser non ne presenta uno nuovo.
+    """
+    if _archivio is not None:
+        _archivio.aggiorna_utente(id_utente, utente)
@@ -7,6 +7,24 @@ function escapaHtml(str) {
         .replace(/>/g, "&gt;");
 }
 
+// GET condizionale: rimanda l'ETag ricevuto e riusa i dati in memoria se il server risponde 304.
+const risposteCondizionali = new Map();
+
+async function fetchCondizionale(url) {
+    const precedente = risposteCondizionali.get(url);
+    const intestazioni = precedente ? { "If-None-Match": precedente.etag } : {};
+    const risposta = await fetch(url, { headers: intestazioni, cache: "no-store" });
+    if (risposta.status === 304 && precedente) {
+        return { dati: precedente.dati, modificato: false };
+    }
+    const dati = await risposta.json();
+    const etag = risposta.headers.get("ETag");
+    if (etag) {
+        risposteCondizionali.set(url, { etag, dati });
+    }
+    return { dati, modificato: true };
+}
+
 // ==================== Stato pagina ====================
 let grafici = {
     categorie: null,
@@ -22,8 +40,7 @@ let aggiornamentoPianificato = false;
 // ==================== Statistiche e grafici ====================
 async function caricaStatistiche() {
     // Carica i dati aggregati necessari per grafici e riepiloghi.
-    const risposta = await fetch("/api/statistiche");
-    return await risposta.json();
+    return await fetchCondizionale("/api/statistiche");
 }
 
 function aggiornaRecap(totali) {
@@ -122,12 +139,20 @@ function iscrivitiStanze(_categorie) {
 }
 
 // ==================== Tabelle e filtri ====================
-async function aggiornaTabellaOrdini() {
-    const risposta = await fetch("/api/ordini/");
-    const dati = await risposta.json();
+// Elenco ordini a pagine (keyset su data e id): il server restituisce anche il cursore della pagina successiva.
+const PAGINA_ORDINI = 50;
+const PAGINA_ORDINI_MAX = 200;
+const statoOrdini = { filtri: {}, cursore: null, caricati: 0, caricamento: false };
+
+function urlOrdini(parametri) {
+    const query = new URLSearchParams({ ...statoOrdini.filtri, ...parametri });
+    return `/api/ordini/?${query}`;
+}
+
+function rigaOrdine(o) {
     const svgModifica = `<svg viewBox="0 0 24 24"><path d="M12 20h9"/><path d="M16.5 3.5a2.121 2.121 0 0 1 3 3L7 19l-4 1 1-4Z"/></svg>`;
     const svgElimina = `<svg viewBox="0 0 24 24"><polyline points="3 6 5 6 21 6"/><path d="M19 6l-1 14a2 2 0 0 1-2 2H8a2 2 0 0 1-2-2L5 6"/><path d="M10 11v6M14 11v6"/></svg>`;
-    const righe = dati.ordini.map((o) => `
+    return `
       <tr class="riga-ordine" data-id="${o.id}">
         <td>${o.id}</td>
         <td>${escapaHtml(o.nome_cliente)}</td>
@@ -145,8 +170,56 @@ async function aggiornaTabellaOrdini() {
             <span class="espandi"></span>
           </button>
         </td>
-      </tr>`).join("");
-    document.querySelector(".tabella-dati tbody").innerHTML = righe;
+      </tr>`;
+}
+
+function mostraOrdini(dati, accoda) {
+    const tbody = document.querySelector(".tabella-dati--ordini tbody");
+    const righe = dati.ordini.map(rigaOrdine).join("");
+    if (accoda) {
+        tbody.insertAdjacentHTML("beforeend", righe);
+        statoOrdini.caricati += dati.ordini.length;
+    } else {
+        tbody.innerHTML = righe;
+        statoOrdini.caricati = dati.ordini.length;
+    }
+    statoOrdini.cursore = dati.cursore;
+    document.getElementById("caricaAltriOrdini").hidden = !dati.cursore;
+}
+
+async function aggiornaTabellaOrdini() {
+    // Rilegge in una richiesta le righe già mostrate (fino al massimo di una pagina):
+    // 304 se nulla è cambiato, altrimenti sostituisce la tabella e riparte da lì.
+    const limite = Math.min(Math.max(statoOrdini.caricati, PAGINA_ORDINI), PAGINA_ORDINI_MAX);
+    const { dati, modificato } = await fetchCondizionale(urlOrdini({ limite }));
+    // Nessuna modifica dall'ultimo caricamento: la tabella è già aggiornata.
+    if (!modificato) return;
+    mostraOrdini(dati, false);
+}
+
+async function caricaAltriOrdini() {
+    // Pagina successiva dal cursore dell'ultima riga mostrata.
+    const cursore = statoOrdini.cursore;
+    if (!cursore || statoOrdini.caricamento) return;
+    statoOrdini.caricamento = true;
+    try {
+        const risposta = await fetch(urlOrdini({ ...cursore, limite: PAGINA_ORDINI }), { cache: "no-store" });
+        // Se nel frattempo la tabella è stata ricaricata, la pagina non è più in sequenza.
+        if (risposta.ok && statoOrdini.cursore === cursore) {
+            mostraOrdini(await risposta.json(), true);
+        }
+    } finally {
+        statoOrdini.caricamento = false;
+    }
+}
+
+function applicaFiltriOrdini(form) {
+    // Solo i campi valorizzati diventano parametri: il server filtra e pagina.
+    statoOrdini.filtri = Object.fromEntries(
+        [...new FormData(form)].filter(([, valore]) => String(valore).trim() !== ""),
+    );
+    statoOrdini.caricati = 0;
+    aggiornaTabellaOrdini();
 }
 
 function filtraProdotti(categoria) {
@@ -163,8 +236,8 @@ function filtraProdotti(categoria) {
 }
 
 async function aggiornaTabellaProdotti() {
-    const risposta = await fetch("/api/prodotti/");
-    const dati = await risposta.json();
+    const { dati, modificato } = await fetchCondizionale("/api/prodotti/");
+    if (!modificato) return;
     const svgRifornimento = `<svg viewBox="0 0 24 24"><line x1="12" y1="5" x2="12" y2="19"/><line x1="5" y1="12" x2="19" y2="12"/></svg>`;
     const svgModifica = `<svg viewBox="0 0 24 24"><path d="M12 20h9"/><path d="M16.5 3.5a2.121 2.121 0 0 1 3 3L7 19l-4 1 1-4Z"/></svg>`;
     const svgElimina = `<svg viewBox="0 0 24 24"><polyline points="3 6 5 6 21 6"/><path d="M19 6l-1 14a2 2 0 0 1-2 2H8a2 2 0 0 1-2-2L5 6"/><path d="M10 11v6M14 11v6"/></svg>`;
@@ -268,12 +341,42 @@ async function toggleDettagli(bottone) {
     }
 }
 
+async function aggiornaTabellaUtenti() {
+    // Ricostruisce la tabella utenti dopo creazione, modifica o eliminazione.
+    const risposta = await fetch("/api/utenti/", { cache: "no-store" });
+    if (!risposta.ok) return;
+    const dati = await risposta.json();
+    const svgModifica = `<svg viewBox="0 0 24 24"><path d="M12 20h9"/><path d="M16.5 3.5a2.121 2.121 0 0 1 3 3L7 19l-4 1 1-4Z"/></svg>`;
+    const svgElimina = `<svg viewBox="0 0 24 24"><polyline points="3 6 5 6 21 6"/><path d="M19 6l-1 14a2 2 0 0 1-2 2H8a2 2 0 0 1-2-2L5 6"/><path d="M10 11v6M14 11v6"/></svg>`;
+    const cellaPermesso = (u, pagina) => u.permessi.includes(pagina)
+        ? `<span class="permesso-si">Sì</span>`
+        : `<span class="permesso-no">No</span>`;
+    const righe = dati.utenti.map((u) => `
+      <tr>
+        <td>${u.id}</td>
+        <td>${escapaHtml(u.username)}</td>
+        <td>${u.is_admin ? `<span class="badge-ruolo admin">Admin</span>` : `<span class="badge-ruolo user">Utente</span>`}</td>
+        <td>${u.attivo ? `<span class="stato-attivo">Attivo</span>` : `<span class="stato-inattivo">Disattivo</span>`}</td>
+        <td class="text-center">${cellaPermesso(u, "AMMINISTRAZIONE")}</td>
+        <td class="text-center">${cellaPermesso(u, "CASSA")}</td>
+        <td class="text-center">${cellaPermesso(u, "DASHBOARD")}</td>
+        <td>
+          <button class="bottone-modifica" data-id="${u.id}" data-username="${escapaHtml(u.username)}" data-is-admin="${u.is_admin ? 1 : 0}" data-attivo="${u.attivo ? 1 : 0}" data-permessi="${escapaHtml(u.permessi.join(","))}" onclick="apriModaleModificaUtente(this)" aria-label="Modifica">${svgModifica}</button>
+          <button class="bottone-cancella" data-id="${u.id}" data-username="${escapaHtml(u.username)}" onclick="apriModaleEliminaUtente(this)" aria-label="Elimina">${svgElimina}</button>
+        </td>
+      </tr>`).join("");
+    const tbody = document.querySelector(".tabella-dati--utenti tbody");
+    if (tbody) tbody.innerHTML = righe;
+}
+
 // ==================== Aggiornamento pagina ====================
 async function aggiornaTutto() {
     // Carica statistiche e aggiorna UI (grafici + tabelle).
-    const statistiche = await caricaStatistiche();
-    aggiornaRecap(statistiche.totali);
-    aggiornaGrafici(statistiche);
+    const { dati: statistiche, modificato } = await caricaStatistiche();
+    if (modificato) {
+        aggiornaRecap(statistiche.totali);
+        aggiornaGrafici(statistiche);
+    }
     iscrivitiStanze(statistiche.categorie);
 
     // Tabelle: partono in parallelo (non atteso) per ridurre latenza percepita.
@@ -293,6 +396,31 @@ function pianificaAggiornamento() {
 }
 
 document.addEventListener("DOMContentLoaded", () => {
+    // ==================== Elenco ordini: filtri e caricamento progressivo ====================
+    const tabellaOrdini = document.querySelector(".tabella-dati--ordini");
+    if (tabellaOrdini) {
+        // Prima pagina già nel template: parte dal suo cursore.
+        statoOrdini.cursore = JSON.parse(tabellaOrdini.dataset.cursore || "null");
+        statoOrdini.caricati = tabellaOrdini.querySelectorAll("tbody tr.riga-ordine").length;
+
+        const filtriOrdini = document.getElementById("filtriOrdini");
+        let attesaFiltri = null;
+        filtriOrdini.addEventListener("input", () => {
+            clearTimeout(attesaFiltri);
+            attesaFiltri = setTimeout(() => applicaFiltriOrdini(filtriOrdini), 300);
+        });
+        filtriOrdini.addEventListener("submit", (evento) => evento.preventDefault());
+
+        // Scorrimento infinito: la pagina successiva parte quando il bottone entra in vista.
+        const bottoneAltri = document.getElementById("caricaAltriOrdini");
+        bottoneAltri.addEventListener("click", caricaAltriOrdini);
+        if ("IntersectionObserver" in window) {
+            new IntersectionObserver((voci) => {
+                if (voci.some((voce) => voce.isIntersecting)) caricaAltriOrdini();
+            }, { rootMargin: "200px" }).observe(bottoneAltri);
+        }
+    }
+
     // ==================== Filtri prodotti (linguette categorie) ====================
     const linguetteCategorie = document.querySelectorAll(".contenitore-menu .linguetta");
     if (linguetteCategorie.length > 0) {
@@ -850,8 +978,7 @@ document.addEventListener("DOMContentLoaded", () => {
                 });
 
                 if (risposta.ok) {
-                    // Ricarica pagina per aggiornare la tabella utenti.
-                    window.location.reload();
+                    await aggiornaTabellaUtenti();
                 } else {
                     const erroreRisposta = await risposta.json();
                     alert("Errore: " + (erroreRisposta.errore || "Impossibile modificare utente"));
@@ -933,7 +1060,7 @@ document.addEventListener("DOMContentLoaded", () => {
                 });
 
                 if (risposta.ok) {
-                    window.location.reload();
+                    await aggiornaTabellaUtenti();
                 } else {
                     const erroreRisposta = await risposta.json();
                     alert("Errore: " + (erroreRisposta.errore || "Impossibile aggiungere utente"));
@@ -992,7 +1119,7 @@ document.addEventListener("DOMContentLoaded", () => {
                 });
 
                 if (risposta.ok) {
-                    window.location.reload();
+                    await aggiornaTabellaUtenti();
                 } else {
                     const erroreRisposta = await risposta.json();
                     alert("Errore: " + (erroreRisposta.errore || "Impossibile eliminare utente"));
@@ -1011,7 +1138,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
 async function avviaDati() {
     // Primo render: statistiche + grafici iniziali.
-    const statistiche = await caricaStatistiche();
+    const { dati: statistiche } = await caricaStatistiche();
     aggiornaRecap(statistiche.totali);
     inizializzaGrafici(statistiche);
     iscrivitiStanze(statistiche.categorie);
@@ -1025,5 +1152,11 @@ async function avviaDati() {
         socket.on("aggiorna_dashboard", () => {
             pianificaAggiornamento();
         });
+        // Eventi accorpati dal server: basta un refresh se il lotto ne contiene uno.
+        socket.on("eventi", (lotto) => {
+            if (lotto.some(([evento]) => evento === "aggiorna_dashboard")) {
+                pianificaAggiornamento();
+            }
+        });
     }
 }
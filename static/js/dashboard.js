@@ -9,6 +9,12 @@ function escapaHtml(str) {
         .replace(/>/g, "&gt;");
 }
 
+// ETag dell'ultimo aggiornamento ricevuto: il server risponde 304 se nulla è cambiato.
+let etagDashboard = null;
+
+// Schede note per id ordine: servono a spostare una scheda quando arriva un delta di stato.
+const ordiniDashboard = new Map();
+
 function costruisciSchedeOrdini(ordini, completati) {
     return ordini.map((o) => {
         const tavolo = o.numero_tavolo !== null ? o.numero_tavolo : "ASPORTO";
@@ -69,12 +75,106 @@ const categoriaCorrente = document
 // Si iscrive alla stanza della categoria.
 socket.emit("join", { categoria: categoriaCorrente });
 
-// Aggiornamento realtime: quando arriva un evento, ricarica solo la categoria corrente.
-socket.on("aggiorna_dashboard", (dati) => {
-    if (dati.categoria === categoriaCorrente) {
+const gestoriEventi = {
+    // Aggiornamento realtime: quando arriva un evento, ricarica solo la categoria corrente.
+    aggiorna_dashboard: (dati) => {
+        if (dati.categoria === categoriaCorrente) {
+            aggiornaDashboard();
+        }
+    },
+    // Delta per singolo ordine: la scheda si aggiorna senza interrogare il server.
+    delta_dashboard: (delta) => {
+        if (delta.categoria === categoriaCorrente) {
+            applicaDelta(delta);
+        }
+    },
+};
+
+Object.entries(gestoriEventi).forEach(([evento, gestore]) => socket.on(evento, gestore));
+
+// Eventi accorpati dal server in un solo frame: si applicano nell'ordine di invio.
+socket.on("eventi", (lotto) => {
+    lotto.forEach(([evento, dati]) => {
+        if (gestoriEventi[evento]) gestoriEventi[evento](dati);
+    });
+});
+
+// Alla (ri)connessione i delta persi vanno recuperati: ricarica una volta la categoria.
+socket.on("connect", () => {
+    aggiornaDashboard();
+});
+
+function inserisciScheda(ordine) {
+    const completato = ordine.stato === "Completato";
+    const griglie = document.querySelectorAll(".griglia-ordini");
+    if (griglie.length < 2) return;
+    const griglia = completato ? griglie[1] : griglie[0];
+    const html = costruisciSchedeOrdini([ordine], completato);
+    // In lavorazione in ordine di arrivo, completati dal più recente.
+    griglia.insertAdjacentHTML(completato ? "afterbegin" : "beforeend", html);
+}
+
+function applicaDelta(delta) {
+    if (delta.tipo === "aggiunto") {
+        if (ordiniDashboard.has(delta.ordine.id)) return;
+        ordiniDashboard.set(delta.ordine.id, delta.ordine);
+        inserisciScheda(delta.ordine);
+        return;
+    }
+
+    if (delta.tipo === "stato") {
+        applicaStato(delta.id, delta.stato);
+        return;
+    }
+
+    if (delta.tipo === "stati") {
+        // Completamenti automatici scattati insieme: un solo messaggio per più ordini.
+        if (!delta.ids.every((id) => ordiniDashboard.has(id))) {
+            aggiornaDashboard();
+            return;
+        }
+        delta.ids.forEach((id) => applicaStato(id, delta.stato));
+        return;
+    }
+
+    if (delta.tipo === "rimosso") {
+        // Ordine eliminato dall'amministrazione: la scheda sparisce da entrambe le griglie.
+        ordiniDashboard.delete(delta.id);
+        const scheda = document.querySelector(`.scheda-ordine[data-id="${delta.id}"]`);
+        if (scheda) scheda.remove();
+        return;
+    }
+
+    if (delta.tipo === "aggiornato") {
+        // Intestazione modificata: cliente, tavolo e persone, scheda nella stessa posizione.
+        const ordine = ordiniDashboard.get(delta.id);
+        if (!ordine) return;
+        ordine.nome_cliente = delta.nome_cliente;
+        ordine.numero_tavolo = delta.numero_tavolo;
+        ordine.numero_persone = delta.numero_persone;
+        const scheda = document.querySelector(`.scheda-ordine[data-id="${delta.id}"]`);
+        if (scheda) scheda.outerHTML = costruisciSchedeOrdini([ordine], ordine.stato === "Completato");
+    }
+}
+
+function applicaStato(id, stato) {
+    const ordine = ordiniDashboard.get(id);
+    if (!ordine) {
+        // Scheda sconosciuta (es. delta arrivato prima del caricamento iniziale).
         aggiornaDashboard();
+        return;
     }
-});
+    const scheda = document.querySelector(`.scheda-ordine[data-id="${id}"]`);
+    const eraCompletato = ordine.stato === "Completato";
+    ordine.stato = stato;
+    if (scheda && eraCompletato === (stato === "Completato")) {
+        // Stessa griglia: sostituisce la scheda mantenendone la posizione.
+        scheda.outerHTML = costruisciSchedeOrdini([ordine], eraCompletato);
+        return;
+    }
+    if (scheda) scheda.remove();
+    inserisciScheda(ordine);
+}
 
 function cambiaStato(bottone) {
     // Legge parametri necessari dal DOM.
@@ -153,13 +253,55 @@ function cambiaStato(bottone) {
 }
 
 function aggiornaDashboard() {
-    fetch(`/api/dashboard/${categoriaCorrente}`)
-        .then((res) => res.json())
+    const intestazioni = etagDashboard ? { "If-None-Match": etagDashboard } : {};
+    fetch(`/api/dashboard/${categoriaCorrente}`, { headers: intestazioni, cache: "no-store" })
+        .then((res) => {
+            if (res.status === 304) return null;
+            etagDashboard = res.headers.get("ETag");
+            return res.json();
+        })
         .then((dati) => {
+            if (!dati) return;
+            ordiniDashboard.clear();
+            dati.non_completati.concat(dati.completati).forEach((o) => ordiniDashboard.set(o.id, o));
             const griglie = document.querySelectorAll(".griglia-ordini");
             if (griglie.length < 2) return;
             griglie[0].innerHTML = costruisciSchedeOrdini(dati.non_completati, false);
             griglie[1].innerHTML = costruisciSchedeOrdini(dati.completati, true);
+            impostaCursoreCompletati(dati.cursore_completati);
         })
         .catch((errore) => console.error("Errore aggiornamento:", errore));
 }
+
+// ==================== Completati precedenti ====================
+// La pagina mostra solo i completati recenti; i più vecchi si caricano a richiesta.
+
+function impostaCursoreCompletati(cursore) {
+    const bottone = document.querySelector(".tasto-carica-completati");
+    if (!bottone) return;
+    if (!cursore) {
+        bottone.hidden = true;
+        return;
+    }
+    bottone.dataset.dataOrdine = cursore.data_ordine;
+    bottone.dataset.id = cursore.id;
+    bottone.hidden = false;
+}
+
+function caricaCompletatiPrecedenti(bottone) {
+    const parametri = new URLSearchParams({ data_ordine: bottone.dataset.dataOrdine, id: bottone.dataset.id });
+    bottone.disabled = true;
+    fetch(`/api/dashboard/${categoriaCorrente}/completati?${parametri}`)
+        .then((res) => res.json())
+        .then((dati) => {
+            const griglie = document.querySelectorAll(".griglia-ordini");
+            if (griglie.length < 2) return;
+            dati.completati.forEach((o) => ordiniDashboard.set(o.id, o));
+            griglie[1].insertAdjacentHTML("beforeend", costruisciSchedeOrdini(dati.completati, true));
+            impostaCursoreCompletati(dati.cursore_completati);
+        })
+        .catch((errore) => console.error("Errore caricamento completati:", errore))
+        .finally(() => {
+            bottone.disabled = false;
+        });
+}
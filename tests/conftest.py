@@ -20,6 +20,7 @@ os.environ["DB_NAME"] = DB_TEST_NAME
 
 import app as modulo_app
 from app import app, socketio
+from db import istruzioni_sql
 
 # ==================== E2E ====================
 
@@ -75,14 +76,9 @@ def inizializza_schema(crea_db_test):
     """Crea lo schema nel DB di test se non esiste ancora (idempotente)."""
     connessione = _connessione_test()
     try:
-        schema = (radice_progetto / "db.sql").read_text()
         with connessione.cursor() as cursore:
-            for stmt in schema.split(";"):
-                stmt = "\n".join(
-                    riga for riga in stmt.splitlines()
-                    if not riga.strip().startswith("--")
-                ).strip()
-                if stmt:
+            for file_schema in ("db.sql", "db_postgres.sql"):
+                for stmt in istruzioni_sql((radice_progetto / file_schema).read_text()):
                     cursore.execute(stmt)
         connessione.commit()
     finally:
@@ -182,8 +178,26 @@ def cliente(monkeypatch):
     # Azzera la cache statistiche in memoria per evitare dati residui.
     import services
     services._statistiche_cache = None
+    services._tabellone = None
+    services._menu = None
+    services._menu_html = None
+    import auth
+    auth.invalida_permessi()
+    # Con start_background_task disattivato il pianificatore non si chiuderebbe da solo.
+    services._pianificatore_attivo = False
+    services._aggiornamento_in_attesa = False
+    # Idem per la ruota dei timer di completamento automatico.
+    services._ruota_attiva = False
+    services._scadenze_timer.clear()
+    services._ultimo_tick_timer = 0
+    for slot in services._ruota_timer:
+        slot.clear()
 
     monkeypatch.setattr("app.socketio.start_background_task", lambda *args, **kwargs: None)
+    # Emissioni immediate: i test leggono gli eventi subito dopo la richiesta.
+    monkeypatch.setattr(services, "_FINESTRA_EMISSIONI_SEC", 0)
+    services._emissioni_attive = False
+    services._emissioni_in_coda = {}
 
     with app.test_client() as cliente_flask:
         yield cliente_flask
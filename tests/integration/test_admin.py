@@ -213,3 +213,39 @@ def test_admin_statistiche_restituisce_json(cliente):
     risposta = cliente.get("/api/statistiche")
     assert risposta.status_code == 200
     assert risposta.json is not None
+
+
+def test_admin_elenco_utenti_con_permessi(cliente):
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("admin_elenco", "hash", True, True),
+        )
+        id_admin = cursore.fetchone()["id"]
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("cassiere", "hash", False, False),
+        )
+        id_cassiere = cursore.fetchone()["id"]
+        cursore.executemany(
+            "INSERT INTO permessi_pagine (utente_id, pagina) VALUES (%s, %s)",
+            [(id_cassiere, "DASHBOARD"), (id_cassiere, "CASSA")],
+        )
+        connessione.commit()
+
+    with cliente.session_transaction() as sessione:
+        sessione["id_utente"] = id_admin
+        sessione["username"] = "admin_elenco"
+        sessione["is_admin"] = True
+
+    risposta = cliente.get("/api/utenti/")
+    assert risposta.status_code == 200
+    assert risposta.json["utenti"] == [
+        {"id": id_admin, "username": "admin_elenco", "is_admin": True, "attivo": True, "permessi": []},
+        {"id": id_cassiere, "username": "cassiere", "is_admin": False, "attivo": False,
+         "permessi": ["CASSA", "DASHBOARD"]},
+    ]
+    assert "cassiere" in cliente.get("/amministrazione/").get_data(as_text=True)
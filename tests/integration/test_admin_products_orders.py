@@ -244,12 +244,12 @@ def test_ricalcola_statistiche_diretto(cliente):
         )
         cursore.execute(
             "INSERT INTO ordini"
-            " (id, nome_cliente, numero_tavolo, data_ordine, completato, asporto, metodo_pagamento)"
-            " VALUES (500, 'Stat Client', 1, '2025-01-01 12:00:00', TRUE, FALSE, 'Contanti')"
+            " (id, nome_cliente, numero_tavolo, data_ordine, completato, asporto, metodo_pagamento, totale)"
+            " VALUES (500, 'Stat Client', 1, '2025-01-01 12:00:00', TRUE, FALSE, 'Contanti', 20)"
         )
         cursore.execute(
-            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato)"
-            " VALUES (500, 500, 2, 'Completato')"
+            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato, prezzo_unitario)"
+            " VALUES (500, 500, 2, 'Completato', 10)"
         )
         connessione.commit()
 
@@ -267,3 +267,80 @@ def test_ricalcola_statistiche_diretto(cliente):
     cucina = next((r for r in stats["categorie"] if r["categoria_dashboard"] == "Cucina"), None)
     assert cucina is not None
     assert cucina["totale"] >= 2
+
+
+def test_totale_ordine_non_cambia_con_il_prezzo(cliente):
+    imposta_admin(cliente)
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute("INSERT INTO permessi_pagine (utente_id, pagina) SELECT id, 'CASSA' FROM utenti")
+        cursore.execute(
+            "INSERT INTO prodotti"
+            " (id, nome, prezzo, quantita, venduti, categoria_menu, categoria_dashboard, disponibile)"
+            " VALUES (600, 'Panino', 6.5, 100, 0, 'Panini', 'Griglia', TRUE)"
+        )
+        connessione.commit()
+
+    risposta = cliente.post("/api/ordini/", json={
+        "asporto": True,
+        "nome_cliente": "Prezzo",
+        "metodo_pagamento": "Contanti",
+        "prodotti": [{"id": 600, "quantita": 3}],
+    })
+    assert risposta.status_code == 201
+
+    risposta = cliente.put("/api/prodotti/600", json={
+        "nome": "Panino", "categoria_dashboard": "Griglia", "prezzo": 9, "quantita": 97, "disponibile": True,
+    })
+    assert risposta.status_code == 200
+
+    ordine = cliente.get("/api/ordini/").get_json()["ordini"][0]
+    assert ordine["totale"] == 19.5
+    dettaglio = cliente.get(f"/api/ordini/{ordine['id']}").get_json()
+    assert dettaglio["totale"] == 19.5
+    assert dettaglio["prodotti"][0]["prezzo"] == 6.5
+
+
+def test_lista_ordini_paginata_e_filtrata(cliente):
+    imposta_admin(cliente)
+
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            """
+            INSERT INTO ordini (asporto, data_ordine, nome_cliente, numero_tavolo, metodo_pagamento, completato)
+            SELECT FALSE, TIMESTAMP '2026-06-01 18:00' + g * INTERVAL '1 hour',
+                   CASE WHEN g % 2 = 0 THEN 'Rossi ' ELSE 'Bianchi_' END || g,
+                   1 + g % 3, CASE WHEN g % 2 = 0 THEN 'Carta' ELSE 'Contanti' END, g <= 5
+            FROM generate_series(1, 7) AS g
+            """
+        )
+        connessione.commit()
+
+    # Pagine consecutive dal cursore, dal più recente, senza buchi né ripetizioni.
+    pagina = cliente.get("/api/ordini/", query_string={"limite": 3}).get_json()
+    ids = [o["id"] for o in pagina["ordini"]]
+    while pagina["cursore"]:
+        pagina = cliente.get("/api/ordini/", query_string={**pagina["cursore"], "limite": 3}).get_json()
+        ids += [o["id"] for o in pagina["ordini"]]
+    assert ids == [7, 6, 5, 4, 3, 2, 1]
+
+    def filtrati(**filtri):
+        risposta = cliente.get("/api/ordini/", query_string=filtri)
+        assert risposta.status_code == 200
+        return [o["id"] for o in risposta.get_json()["ordini"]]
+
+    assert filtrati(metodo_pagamento="Carta") == [6, 4, 2]
+    assert filtrati(completato="false") == [7, 6]
+    assert filtrati(tavolo=1) == [6, 3]
+    assert filtrati(cliente="rOSSi") == [6, 4, 2]
+    # "_" è testo, non un carattere jolly.
+    assert filtrati(cliente="bianchi_") == [7, 5, 3, 1]
+    assert filtrati(cliente="rossi_") == []
+    assert filtrati(cliente="bianchi_", completato="true", tavolo=2) == [1]
+    # Date incluse: il giorno "al" conta per intero.
+    assert filtrati(dal="2026-06-02", al="2026-06-02") == [7, 6]
+    assert filtrati(dal="2026-06-01", al="2026-06-01") == [5, 4, 3, 2, 1]
+
+    assert cliente.get("/api/ordini/?completato=forse").status_code == 400
+    assert cliente.get("/api/ordini/?data_ordine=2026-06-01").status_code == 400
@@ -23,12 +23,12 @@ def test_ricalcola_statistiche_calcola_totale_carta(cliente):
         )
         cursore.execute(
             "INSERT INTO ordini"
-            " (id, nome_cliente, numero_tavolo, data_ordine, completato, asporto, metodo_pagamento)"
-            " VALUES (700, 'Card Client', 1, '2025-01-01 12:00:00', TRUE, FALSE, 'Carta')"
+            " (id, nome_cliente, numero_tavolo, data_ordine, completato, asporto, metodo_pagamento, totale)"
+            " VALUES (700, 'Card Client', 1, '2025-01-01 12:00:00', TRUE, FALSE, 'Carta', 20)"
         )
         cursore.execute(
-            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato)"
-            " VALUES (700, 700, 1, 'Completato')"
+            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato, prezzo_unitario)"
+            " VALUES (700, 700, 1, 'Completato', 20)"
         )
         connessione.commit()
 
@@ -0,0 +1,97 @@
+import time
+
+import services
+from app import ottieni_db
+
+# ==================== GET condizionali ====================
+
+
+def _accedi_come_admin(cliente):
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("admin_etag", "hash", True, True),
+        )
+        id_admin = cursore.fetchone()["id"]
+        cursore.execute(
+            "INSERT INTO prodotti"
+            " (id, nome, prezzo, categoria_menu, categoria_dashboard, quantita, venduti)"
+            " VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (1, "Birra", 4.5, "Bevande", "Bar", 100, 0),
+        )
+        connessione.commit()
+
+    with cliente.session_transaction() as sessione:
+        sessione["id_utente"] = id_admin
+        sessione["username"] = "admin_etag"
+        sessione["is_admin"] = True
+
+
+def test_etag_restituisce_304_finche_la_risorsa_non_cambia(cliente, monkeypatch):
+    monkeypatch.setattr(services, "emissione_sicura", lambda *args, **kwargs: None)
+    _accedi_come_admin(cliente)
+
+    for url in ("/api/ordini/", "/api/prodotti/", "/api/statistiche", "/api/dashboard/bar"):
+        risposta = cliente.get(url)
+        assert risposta.status_code == 200
+        etag = risposta.headers["ETag"]
+        assert not etag.startswith("W/")
+
+        risposta = cliente.get(url, headers={"If-None-Match": etag})
+        assert risposta.status_code == 304
+        assert risposta.data == b""
+
+
+def test_modifiche_invalidano_etag(cliente, monkeypatch):
+    monkeypatch.setattr(services, "emissione_sicura", lambda *args, **kwargs: None)
+    _accedi_come_admin(cliente)
+
+    etag_ordini = cliente.get("/api/ordini/").headers["ETag"]
+    etag_prodotti = cliente.get("/api/prodotti/").headers["ETag"]
+    etag_statistiche = cliente.get("/api/statistiche").headers["ETag"]
+
+    risposta = cliente.post("/api/ordini/", json={
+        "asporto": True,
+        "nome_cliente": "Etag",
+        "metodo_pagamento": "Carta",
+        "prodotti": [{"id": 1, "quantita": 2}],
+    })
+    assert risposta.status_code == 201
+
+    for url, etag in (
+        ("/api/ordini/", etag_ordini),
+        ("/api/prodotti/", etag_prodotti),
+        ("/api/statistiche", etag_statistiche),
+    ):
+        risposta = cliente.get(url, headers={"If-None-Match": etag})
+        assert risposta.status_code == 200
+        assert risposta.headers["ETag"] != etag
+
+    # Il rifornimento tocca solo i prodotti: gli ordini restano validi.
+    etag_ordini = cliente.get("/api/ordini/").headers["ETag"]
+    assert cliente.patch("/api/prodotti/1", json={"quantita": 5}).status_code == 200
+    assert cliente.get("/api/ordini/", headers={"If-None-Match": etag_ordini}).status_code == 304
+
+
+def test_etag_dashboard_segue_la_finestra_dei_completati(cliente, monkeypatch):
+    _accedi_come_admin(cliente)
+    # Si parte dall'ora vera: il cookie di sessione firmato ha una durata limitata.
+    adesso = [time.time()]
+    monkeypatch.setattr(services.time, "time", lambda: adesso[0])
+
+    # Senza finestra la dashboard dipende solo dalla versione degli ordini.
+    monkeypatch.setattr(services, "_COMPLETATI_FINESTRA_MINUTI", 0)
+    etag = cliente.get("/api/dashboard/bar").headers["ETag"]
+    adesso[0] += 3600
+    assert cliente.get("/api/dashboard/bar", headers={"If-None-Match": etag}).status_code == 304
+
+    # Con la finestra i completati scadono col passare del tempo: l'ETag cambia ogni minuto.
+    monkeypatch.setattr(services, "_COMPLETATI_FINESTRA_MINUTI", 30)
+    etag = cliente.get("/api/dashboard/bar").headers["ETag"]
+    assert cliente.get("/api/dashboard/bar", headers={"If-None-Match": etag}).status_code == 304
+    adesso[0] += 60
+    risposta = cliente.get("/api/dashboard/bar", headers={"If-None-Match": etag})
+    assert risposta.status_code == 200
+    assert risposta.headers["ETag"] != etag
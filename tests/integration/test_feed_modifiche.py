@@ -0,0 +1,201 @@
+import json
+import select
+import threading
+import time
+
+import psycopg2
+
+import db
+import services
+from app import app, socketio
+from db import apri_connessione_dedicata, ottieni_db, origine_processo
+
+# ==================== Feed modifiche ====================
+
+
+def _prepara_ordine():
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO prodotti"
+            " (id, nome, prezzo, quantita, venduti, categoria_menu, categoria_dashboard)"
+            " VALUES (300, 'Feed', 5, 100, 0, 'Test', 'Griglia')"
+        )
+        cursore.execute(
+            "INSERT INTO ordini (id, nome_cliente, data_ordine, asporto, metodo_pagamento)"
+            " VALUES (300, 'Feed', CURRENT_TIMESTAMP, TRUE, 'Carta')"
+        )
+        cursore.execute(
+            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, prezzo_unitario) VALUES (300, 300, 1, 5)"
+        )
+        connessione.commit()
+
+
+def _ricevi_modifiche(connessione):
+    modifiche = []
+    while select.select([connessione], [], [], 2)[0]:
+        connessione.poll()
+        modifiche.extend(json.loads(n.payload) for n in connessione.notifies)
+        connessione.notifies.clear()
+    return modifiche
+
+
+def test_trigger_notificano_tabella_ids_e_origine(cliente):
+    _prepara_ordine()
+    ascolto = apri_connessione_dedicata()
+    try:
+        with ascolto.cursor() as cursore:
+            cursore.execute('LISTEN "byte_bite_modifiche"')
+
+        # Scrittura dell'app: porta l'origine del processo.
+        with ottieni_db() as connessione:
+            connessione.cursor().execute("UPDATE ordini_prodotti SET stato = 'Pronto' WHERE ordine_id = 300")
+            connessione.commit()
+        # Scrittura esterna (come reset_db.py o SQL manuale): nessuna origine.
+        parametri = {k: v for k, v in db._parametri_connessione().items() if k != "options"}
+        esterna = psycopg2.connect(**parametri)
+        esterna.cursor().execute("UPDATE ordini SET nome_cliente = 'Esterno' WHERE id = 300")
+        esterna.cursor().execute("UPDATE ordini SET nome_cliente = 'Nessuno' WHERE id = -1")
+        esterna.commit()
+        esterna.close()
+
+        modifiche = _ricevi_modifiche(ascolto)
+    finally:
+        ascolto.close()
+
+    assert modifiche == [
+        {"tabella": "ordini_prodotti", "op": "UPDATE", "ids": [300], "origine": origine_processo()},
+        {"tabella": "ordini", "op": "UPDATE", "ids": [300], "origine": None},
+    ]
+
+
+def test_modifiche_esterne_aggiornano_solo_le_dashboard_coinvolte(cliente, monkeypatch):
+    _prepara_ordine()
+    emessi = []
+    monkeypatch.setattr(services, "emissione_sicura", lambda *args, **kwargs: emessi.append((args, kwargs)))
+    services.ottieni_ordini_per_categoria("Griglia")
+
+    # Le modifiche del processo stesso sono già state applicate dalle route.
+    propria = {"tabella": "ordini", "op": "UPDATE", "ids": [300], "origine": origine_processo()}
+    assert services.applica_modifiche_esterne([propria]) == set()
+    assert services._tabellone is not None
+
+    # Gli ordini del payload si rileggono e si applicano per delta, senza ricaricare tutto.
+    def lettura_vietata():
+        raise AssertionError("tabellone riletto per intero")
+
+    monkeypatch.setattr(services, "_carica_tabellone_da_db", lettura_vietata)
+    with ottieni_db() as connessione:
+        connessione.cursor().execute("UPDATE ordini_prodotti SET stato = 'Pronto' WHERE ordine_id = 300")
+        connessione.commit()
+    esterna = {"tabella": "ordini_prodotti", "op": "UPDATE", "ids": [300], "origine": None}
+    assert services.applica_modifiche_esterne([propria, esterna]) == {"Griglia"}
+    assert services._tabellone["Griglia"][300]["stato"] == "Pronto"
+    assert emessi == [(("aggiorna_dashboard", {"categoria": "Griglia"}), {"stanza": "Griglia", "locale": True})]
+
+    # Ordini eliminati o svuotamenti: avvisate tutte le dashboard.
+    emessi.clear()
+    svuotamento = {"tabella": "ordini", "op": "TRUNCATE", "ids": None, "origine": None}
+    assert services.applica_modifiche_esterne([svuotamento]) == set(services._CATEGORIE_DASHBOARD)
+    assert len(emessi) == len(services._CATEGORIE_DASHBOARD)
+
+
+def test_ordini_esterni_applicati_per_delta_alle_statistiche(cliente, monkeypatch):
+    _prepara_ordine()
+    services.snapshot_statistiche()
+    with app.test_request_context():
+        services.pagina_cassa()
+
+    def ricalcolo_vietato():
+        raise AssertionError("statistiche ricalcolate per intero")
+
+    monkeypatch.setattr(services, "_carica_stato_statistiche_da_db", ricalcolo_vietato)
+    monkeypatch.setattr(services, "_carica_menu_da_db", ricalcolo_vietato)
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO ordini (id, nome_cliente, data_ordine, asporto, metodo_pagamento)"
+            " VALUES (301, 'Altro worker', CURRENT_TIMESTAMP, TRUE, 'Contanti')"
+        )
+        cursore.execute(
+            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, prezzo_unitario) VALUES (301, 300, 2, 4.5)"
+        )
+        cursore.execute("UPDATE prodotti SET quantita = quantita - 2, venduti = venduti + 2 WHERE id = 300")
+        connessione.commit()
+
+    assert services.applica_modifiche_esterne([
+        {"tabella": "ordini", "op": "INSERT", "ids": [301], "origine": None},
+        {"tabella": "ordini_prodotti", "op": "INSERT", "ids": [301], "origine": None},
+        {"tabella": "prodotti", "op": "UPDATE", "ids": [300], "origine": None},
+    ]) == {"Griglia"}
+
+    stato = services._statistiche_stato
+    assert stato["ordini_totali"] == 2
+    assert stato["prodotti"][300]["venduti"] == 2
+    assert stato["prodotti"][300]["per_metodo"] == {"Contanti": 2, "Carta": 1}
+    assert stato["prodotti"][300]["incassi"] == {"Contanti": 9, "Carta": 5}
+    assert services._menu["Test"][0]["quantita"] == 98
+    assert not services._statistiche_incoerenti
+
+
+def test_ascolto_in_background_non_blocca_il_loop(cliente):
+    # Task veri (il fixture li disattiva): ascolto del feed e un battito ogni 10 ms.
+    avvia = type(socketio).start_background_task
+    fermo = threading.Event()
+    finiti = []
+    battiti = []
+
+    def ascolto():
+        services.ascolta_modifiche_db(fermo)
+        finiti.append(1)
+
+    def battito():
+        while not fermo.is_set():
+            battiti.append(time.monotonic())
+            socketio.sleep(0.01)
+
+    avvia(socketio, ascolto)
+    avvia(socketio, battito)
+    try:
+        # Più di un'attesa completa del select sul canale (1 s).
+        socketio.sleep(1.5)
+        inizio = time.monotonic()
+        assert cliente.get("/login/").status_code == 200
+        assert time.monotonic() - inizio < 0.5
+    finally:
+        fermo.set()
+    scadenza = time.monotonic() + 5
+    while not finiti and time.monotonic() < scadenza:
+        socketio.sleep(0.05)
+
+    assert finiti
+    pause = [dopo - prima for prima, dopo in zip(battiti, battiti[1:])]
+    assert len(battiti) > 20
+    assert max(pause) < 0.5
+
+
+def test_menu_sostituisce_solo_le_categorie_coinvolte(cliente):
+    def prodotto(id_prodotto, categoria, nome="P"):
+        return {"id": id_prodotto, "nome": nome, "categoria_menu": categoria}
+
+    services._menu = services._raggruppa_menu([
+        prodotto(1, "Bevande"), prodotto(2, "Primi"), prodotto(3, "Bevande"), prodotto(4, "Dolci"), prodotto(6, "Contorni"),
+    ])
+    contorni = services._menu["Contorni"]
+
+    # Rinomina sul posto, spostamento di categoria ed eliminazione dell'unico dolce.
+    precedenti = services.menu_sostituisci_prodotti(
+        {1, 3, 4, 5}, [prodotto(1, "Bevande", "Birra"), prodotto(3, "Primi"), prodotto(5, "Antipasti")]
+    )
+
+    assert set(precedenti) == {1, 3, 4}
+    # Le categorie non coinvolte restano le stesse liste.
+    assert services._menu["Contorni"] is contorni
+    assert services._menu == {
+        "Bevande": [prodotto(1, "Bevande", "Birra")],
+        "Primi": [prodotto(2, "Primi"), prodotto(3, "Primi")],
+        "Antipasti": [prodotto(5, "Antipasti")],
+        "Contorni": [prodotto(6, "Contorni")],
+    }
+    assert list(services._menu) == ["Bevande", "Primi", "Antipasti", "Contorni"]
+    assert services._menu_html is None
@@ -1,4 +1,6 @@
 from app import ottieni_db
+from auth import invalida_permessi
+from services import invalida_tabellone
 
 # ==================== Flusso Ordine ====================
 
@@ -58,6 +60,8 @@ def test_flusso_completo_ordine(cliente, monkeypatch):
             (id_staff, "DASHBOARD"),
         )
         connessione.commit()
+    # Permesso scritto a mano: la route utenti invaliderebbe la cache da sola.
+    invalida_permessi(id_staff)
 
     risposta = cliente.get("/api/dashboard/cucina")
     assert risposta.status_code == 200
@@ -96,6 +100,8 @@ def test_flusso_completo_ordine(cliente, monkeypatch):
             (id_ordine,),
         )
         connessione.commit()
+    # Scrittura fuori dalle route: il tabellone in memoria va ricaricato dal DB.
+    invalida_tabellone()
 
     risposta = cliente.get("/api/dashboard/cucina")
     dati = risposta.get_json()
@@ -0,0 +1,137 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import routes
+import services
+from app import ottieni_db
+
+# ==================== Indici ====================
+
+# Serata lunga di una sagra: molti ordini, catalogo di dimensioni reali.
+NUMERO_ORDINI = 20000
+NUMERO_PRODOTTI = 80
+
+
+@pytest.fixture
+def dataset_grande(cliente):
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            """
+            INSERT INTO prodotti (nome, prezzo, categoria_menu, categoria_dashboard, disponibile, quantita, venduti)
+            SELECT 'Prodotto ' || g, 1 + g %% 15, 'Menu',
+                   (ARRAY['Bar', 'Cucina', 'Gnoccheria', 'Griglia', 'Coperto'])[1 + g %% 5],
+                   TRUE, 1000, 0
+            FROM generate_series(1, %s) AS g
+            """,
+            (NUMERO_PRODOTTI,),
+        )
+        cursore.execute(
+            """
+            INSERT INTO ordini (asporto, data_ordine, nome_cliente, metodo_pagamento, completato)
+            SELECT TRUE, TIMESTAMP '2026-06-01 18:00' + g * INTERVAL '1 second', 'Cliente ' || g,
+                   'Contanti', g <= %s
+            FROM generate_series(1, %s) AS g
+            """,
+            (NUMERO_ORDINI - 50, NUMERO_ORDINI),
+        )
+        # Serata avanzata: solo gli ultimi ordini hanno ancora righe aperte, alcune pronte.
+        cursore.execute(
+            """
+            INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato, pronto_dal)
+            SELECT o.id, 1 + (o.id * 7 + r * 13) %% %s, 1 + r,
+                   CASE WHEN o.completato THEN 'Completato' WHEN r = 0 THEN 'Pronto' ELSE 'In Attesa' END,
+                   CASE WHEN NOT o.completato AND r = 0 THEN CURRENT_TIMESTAMP END
+            FROM ordini o CROSS JOIN generate_series(0, 2) AS r
+            """,
+            (NUMERO_PRODOTTI,),
+        )
+        connessione.commit()
+        cursore.execute("ANALYZE ordini")
+        cursore.execute("ANALYZE ordini_prodotti")
+        cursore.execute("ANALYZE prodotti")
+        connessione.commit()
+
+
+def _query_eseguite(modulo, chiamata):
+    """Query e parametri che la chiamata passa a esegui_query (senza eseguirle)."""
+    eseguite = []
+
+    def registra(query, argomenti=(), **_):
+        eseguite.append((query, argomenti))
+        return []
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(modulo, "esegui_query", registra)
+        chiamata()
+    return eseguite
+
+
+def _indici_usati(query, argomenti=()):
+    """Nomi degli indici presenti nel piano di esecuzione della query."""
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute("EXPLAIN (FORMAT JSON) " + query, argomenti)
+        piano = cursore.fetchone()["QUERY PLAN"]
+        connessione.rollback()
+    if isinstance(piano, str):
+        piano = json.loads(piano)
+
+    indici = set()
+    nodi = [piano[0]["Plan"]]
+    while nodi:
+        nodo = nodi.pop()
+        if "Index Name" in nodo:
+            indici.add(nodo["Index Name"])
+        nodi.extend(nodo.get("Plans", []))
+    return indici
+
+
+# (modulo, chiamata, indice atteso) per ciascun percorso di accesso caldo: si
+# spiegano le query che il codice esegue davvero, con i parametri che passa.
+PERCORSI_CALDI = [
+    # Avanzamento di stato di una categoria (cambia_stato): basta la chiave primaria.
+    (services, lambda: services.applica_transizione_stato(NUMERO_ORDINI, "Bar"), "ordini_prodotti_pkey"),
+    # Pagina successiva dei completati di una dashboard.
+    (
+        services,
+        lambda: services.ottieni_completati_precedenti("Bar", datetime(2026, 6, 1, 20), NUMERO_ORDINI, 20),
+        "idx_ordini_data",
+    ),
+    # Elenco ordini dell'amministrazione: prima pagina e filtro per prefisso del cliente.
+    (routes, lambda: routes._pagina_ordini({}, routes._PAGINA_ORDINI), "idx_ordini_data"),
+    (
+        routes,
+        lambda: routes._pagina_ordini(routes._leggi_filtri_ordini({"cliente": "Cliente 1999"}), routes._PAGINA_ORDINI),
+        "idx_ordini_cliente",
+    ),
+    # Statistiche di un prodotto riletto dal feed delle modifiche.
+    (services, lambda: services._leggi_prodotti_statistiche({42}), "idx_ordini_prodotti_prodotto"),
+    # Completamenti automatici: scaduti (ruota dei timer) e in sospeso all'avvio.
+    (services, services.completa_scaduti, "idx_ordini_prodotti_pronto"),
+    (services, services.recupera_completamenti, "idx_ordini_prodotti_pronto"),
+]
+
+
+def test_query_calde_usano_gli_indici(dataset_grande):
+    for modulo, chiamata, indice in PERCORSI_CALDI:
+        eseguite = _query_eseguite(modulo, chiamata)
+        assert eseguite
+        for query, argomenti in eseguite:
+            assert indice in _indici_usati(query, argomenti), query
+
+
+def test_nessun_indice_inutilizzato(cliente):
+    # Ogni indice secondario deve servire almeno un percorso caldo: gli altri
+    # costano solo scritture in più a ogni ordine.
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "SELECT indexname FROM pg_indexes"
+            " WHERE tablename IN ('ordini', 'ordini_prodotti', 'prodotti')"
+            " AND indexname NOT IN (SELECT conname FROM pg_constraint)"
+        )
+        indici = {riga["indexname"] for riga in cursore.fetchall()}
+    assert indici == {indice for _, _, indice in PERCORSI_CALDI} - {"ordini_prodotti_pkey"}
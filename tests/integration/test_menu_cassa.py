@@ -0,0 +1,61 @@
+import services
+from app import ottieni_db
+
+# ==================== Menu cassa ====================
+
+
+def _prepara_admin_e_prodotti(cliente):
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("admin_menu", "hash", True, True),
+        )
+        id_admin = cursore.fetchone()["id"]
+        cursore.executemany(
+            "INSERT INTO prodotti"
+            " (id, nome, prezzo, categoria_menu, categoria_dashboard, disponibile, quantita, venduti)"
+            " VALUES (%s, %s, %s, %s, %s, TRUE, %s, 0)",
+            [
+                (1, "Birra", 4.5, "Bevande", "Bar", 3),
+                (2, "Carbonara", 12.0, "Primi", "Cucina", 50),
+            ],
+        )
+        connessione.commit()
+
+    with cliente.session_transaction() as sessione:
+        sessione["id_utente"] = id_admin
+        sessione["username"] = "admin_menu"
+        sessione["is_admin"] = True
+
+
+def test_menu_cassa_in_cache_e_aggiornato_dagli_ordini(cliente, monkeypatch):
+    _prepara_admin_e_prodotti(cliente)
+    carica_da_db = services._carica_menu_da_db
+    caricamenti = []
+    monkeypatch.setattr(services, "_carica_menu_da_db", lambda: caricamenti.append(1) or carica_da_db())
+
+    pagina = cliente.get("/cassa/").get_data(as_text=True)
+    assert cliente.get("/cassa/").get_data(as_text=True) == pagina
+    assert 'data-categoria="Bevande"' in pagina
+    assert len(caricamenti) == 1
+
+    # L'ordine esaurisce la birra: la pagina cambia senza rileggere il catalogo.
+    risposta = cliente.post("/api/ordini/", json={
+        "asporto": True,
+        "nome_cliente": "Menu",
+        "metodo_pagamento": "Contanti",
+        "prodotti": [{"id": 1, "quantita": 3}, {"id": 2, "quantita": 1}],
+    })
+    assert risposta.status_code == 201
+    pagina = cliente.get("/cassa/").get_data(as_text=True)
+    assert "Birra" not in pagina
+    assert 'data-quantita="49"' in pagina
+    assert len(caricamenti) == 1
+
+    # Il rifornimento modifica il catalogo: il menu si rilegge dal DB.
+    assert cliente.patch("/api/prodotti/1", json={"quantita": 10}).status_code == 200
+    pagina = cliente.get("/cassa/").get_data(as_text=True)
+    assert "Birra" in pagina
+    assert len(caricamenti) == 2
@@ -62,3 +62,104 @@ def test_amministrazione_riceve_aggiornamenti_di_altre_stanze(cliente):
     # Chiude entrambe le connessioni.
     client_admin.disconnect()
     client_cucina.disconnect()
+
+def test_dashboard_riceve_delta_ordine(cliente):
+    from app import ottieni_db
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("admin_delta", "hash", True, True),
+        )
+        id_admin = cursore.fetchone()["id"]
+        cursore.execute(
+            "INSERT INTO prodotti"
+            " (id, nome, prezzo, categoria_menu, categoria_dashboard, quantita, venduti)"
+            " VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (1, "Carbonara", 12.0, "Primi", "Cucina", 50, 0),
+        )
+        connessione.commit()
+
+    with cliente.session_transaction() as sessione:
+        sessione["id_utente"] = id_admin
+        sessione["username"] = "admin_delta"
+        sessione["is_admin"] = True
+
+    client_cucina = socketio.test_client(app, flask_test_client=cliente)
+    client_cucina.emit("join", {"categoria": "Cucina"})
+    client_cucina.get_received()
+
+    risposta = cliente.post("/api/ordini/", json={
+        "asporto": True,
+        "nome_cliente": "Delta",
+        "metodo_pagamento": "Contanti",
+        "prodotti": [{"id": 1, "quantita": 2}],
+    })
+    assert risposta.status_code == 201
+
+    delta = [e["args"][0] for e in client_cucina.get_received() if e["name"] == "delta_dashboard"]
+    assert len(delta) == 1
+    assert delta[0]["tipo"] == "aggiunto"
+    assert delta[0]["categoria"] == "Cucina"
+    assert delta[0]["ordine"]["nome_cliente"] == "Delta"
+    assert delta[0]["ordine"]["prodotti"] == [{"nome": "Carbonara", "quantita": 2}]
+    id_ordine = delta[0]["ordine"]["id"]
+
+    assert cliente.patch(f"/api/ordini/{id_ordine}/stato/Cucina").status_code == 200
+    delta = [e["args"][0] for e in client_cucina.get_received() if e["name"] == "delta_dashboard"]
+    assert delta == [{"tipo": "stato", "id": id_ordine, "stato": "In Preparazione", "categoria": "Cucina"}]
+
+    risposta = cliente.put(f"/api/ordini/{id_ordine}", json={
+        "nome_cliente": "Delta bis", "numero_tavolo": 4, "numero_persone": 2, "metodo_pagamento": "Contanti",
+    })
+    assert risposta.status_code == 200
+    delta = [e["args"][0] for e in client_cucina.get_received() if e["name"] == "delta_dashboard"]
+    assert delta == [{
+        "tipo": "aggiornato", "id": id_ordine, "nome_cliente": "Delta bis",
+        "numero_tavolo": 4, "numero_persone": 2, "categoria": "Cucina",
+    }]
+
+    assert cliente.delete(f"/api/ordini/{id_ordine}").status_code == 200
+    delta = [e["args"][0] for e in client_cucina.get_received() if e["name"] == "delta_dashboard"]
+    assert delta == [{"tipo": "rimosso", "id": id_ordine, "categoria": "Cucina"}]
+
+    client_cucina.disconnect()
+
+def test_emissioni_accorpate_in_un_frame_per_stanza(cliente, monkeypatch):
+    import services
+    monkeypatch.setattr(services, "_FINESTRA_EMISSIONI_SEC", 0.03)
+    monkeypatch.setattr(services, "_contatori_emissioni", {"eventi": 0, "accorpati": 0, "frame": 0})
+
+    client_admin = socketio.test_client(app, flask_test_client=cliente)
+    client_admin.emit("join", {"categoria": "amministrazione"})
+    client_cucina = socketio.test_client(app, flask_test_client=cliente)
+    client_cucina.emit("join", {"categoria": "Cucina"})
+    client_admin.get_received()
+    client_cucina.get_received()
+
+    pronto = {"tipo": "stato", "id": 1, "stato": "Pronto"}
+    emissione_sicura("delta_dashboard", pronto, stanza="Cucina")
+    emissione_sicura("delta_dashboard", {"tipo": "stato", "id": 1, "stato": "In Preparazione"}, stanza="Cucina")
+    emissione_sicura("delta_dashboard", pronto, stanza="Cucina")
+    emissione_sicura("aggiorna_dashboard", {"categoria": "Cucina"}, stanza="Cucina")
+    emissione_sicura("aggiorna_dashboard", {"categoria": "Cucina"}, stanza="Cucina")
+
+    # Nulla parte prima della fine della finestra.
+    assert client_cucina.get_received() == []
+    services._svuota_emissioni()
+
+    ricevuti_cucina = client_cucina.get_received()
+    assert [e["name"] for e in ricevuti_cucina] == ["eventi"]
+    # I duplicati prendono il posto dell'ultimo invio: lo stato finale resta "Pronto".
+    assert ricevuti_cucina[0]["args"][0] == [
+        ["delta_dashboard", {"tipo": "stato", "id": 1, "stato": "In Preparazione"}],
+        ["delta_dashboard", pronto],
+        ["aggiorna_dashboard", {"categoria": "Cucina"}],
+    ]
+    ricevuti_admin = client_admin.get_received()
+    assert [(e["name"], e["args"][0]) for e in ricevuti_admin] == [("aggiorna_dashboard", {"categoria": "Cucina"})]
+    assert services.contatori_emissioni() == {"eventi": 7, "accorpati": 3, "frame": 2}
+
+    client_admin.disconnect()
+    client_cucina.disconnect()
@@ -0,0 +1,268 @@
+import json
+from datetime import datetime
+
+import pytest
+from greenlet import GreenletExit
+
+import services
+from app import ottieni_db
+
+# ==================== Statistiche incrementali ====================
+
+
+def _prepara_admin_e_prodotti(cliente):
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("admin_stat", "hash", True, True),
+        )
+        id_admin = cursore.fetchone()["id"]
+        cursore.executemany(
+            "INSERT INTO prodotti"
+            " (id, nome, prezzo, categoria_menu, categoria_dashboard, quantita, venduti)"
+            " VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            [
+                (1, "Birra", 4.5, "Bevande", "Bar", 100, 0),
+                (2, "Carbonara", 12.0, "Primi", "Cucina", 100, 0),
+            ],
+        )
+        connessione.commit()
+
+    with cliente.session_transaction() as sessione:
+        sessione["id_utente"] = id_admin
+        sessione["username"] = "admin_stat"
+        sessione["is_admin"] = True
+
+
+def _statistiche_da_db():
+    return services._congela(services._componi_statistiche(services._carica_stato_statistiche_da_db()))
+
+
+def _crea_ordine(cliente, metodo_pagamento, prodotti):
+    risposta = cliente.post("/api/ordini/", json={
+        "asporto": True,
+        "nome_cliente": "Statistiche",
+        "metodo_pagamento": metodo_pagamento,
+        "prodotti": prodotti,
+    })
+    assert risposta.status_code == 201
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute("SELECT MAX(id) AS id FROM ordini")
+        return cursore.fetchone()["id"]
+
+
+def test_delta_ordini_coincidono_con_ricalcolo(cliente, monkeypatch):
+    monkeypatch.setattr(services, "emissione_sicura", lambda *args, **kwargs: None)
+    _prepara_admin_e_prodotti(cliente)
+
+    # Idrata la cache: da qui in poi le route applicano solo delta.
+    services.costruisci_dati_statistiche()
+    carica_da_db = services._carica_stato_statistiche_da_db
+    ricalcoli = []
+    monkeypatch.setattr(services, "_carica_stato_statistiche_da_db", lambda: ricalcoli.append(1) or carica_da_db())
+
+    id_primo = _crea_ordine(cliente, "Contanti", [{"id": 1, "quantita": 2}, {"id": 2, "quantita": 1}])
+    id_secondo = _crea_ordine(cliente, "Carta", [{"id": 1, "quantita": 3}])
+
+    risposta = cliente.put(f"/api/ordini/{id_primo}", json={
+        "nome_cliente": "Statistiche", "numero_tavolo": "", "numero_persone": "", "metodo_pagamento": "Carta",
+    })
+    assert risposta.status_code == 200
+
+    # "Pronto" e poi completamento automatico (senza attendere il timeout).
+    assert cliente.patch(f"/api/ordini/{id_secondo}/stato/Bar").status_code == 200
+    assert cliente.patch(f"/api/ordini/{id_secondo}/stato/Bar").status_code == 200
+    monkeypatch.setattr(services, "_TIMEOUT_AUTO_COMPLETAMENTO_SEC", 0)
+    assert (id_secondo, "Bar") in services._scadenze_timer
+    services.completa_scaduti()
+
+    risposta = cliente.put("/api/prodotti/2", json={
+        "nome": "Amatriciana", "categoria_dashboard": "Griglia", "prezzo": 11, "quantita": 50, "disponibile": True,
+    })
+    assert risposta.status_code == 200
+
+    assert cliente.delete(f"/api/ordini/{id_primo}").status_code == 200
+    assert ricalcoli == []
+
+    attese = _statistiche_da_db()
+    assert services.costruisci_dati_statistiche() == attese
+    assert attese["totali"]["ordini_totali"] == 1
+    assert attese["totali"]["ordini_completati"] == 1
+    assert attese["totali"]["totale_carta"] == 13.5
+
+
+def test_delta_su_prodotto_sconosciuto_forza_ricalcolo(cliente):
+    _prepara_admin_e_prodotti(cliente)
+    services.costruisci_dati_statistiche()
+
+    services.statistiche_aggiungi_ordine(datetime.now(), "Contanti", [(999, 1, 5)])
+    assert services._statistiche_incoerenti
+
+    services.aggiorna_statistiche(notifica=False)
+    assert not services._statistiche_incoerenti
+    assert services.costruisci_dati_statistiche() == _statistiche_da_db()
+
+
+def test_delta_durante_la_pubblicazione_del_ricalcolo_non_si_perde(cliente, monkeypatch):
+    _prepara_admin_e_prodotti(cliente)
+    services.costruisci_dati_statistiche()
+
+    # Un delta arriva dopo la lettura dal DB ma prima che il nuovo stato sia pubblicato.
+    componi = services._componi_statistiche
+
+    def componi_con_delta(stato):
+        monkeypatch.setattr(services, "_componi_statistiche", componi)
+        services.statistiche_cambia_completati(1)
+        return componi(stato)
+
+    monkeypatch.setattr(services, "_componi_statistiche", componi_con_delta)
+    services.ricalcola_statistiche(notifica=False)
+
+    assert services._ricalcoli_in_corso == 0
+    assert services._statistiche_incoerenti
+
+
+def test_scansione_unica_coincide_con_query_per_totale(cliente):
+    _prepara_admin_e_prodotti(cliente)
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO ordini (asporto, nome_cliente, metodo_pagamento, completato) VALUES"
+            " (TRUE, 'A', 'Contanti', TRUE), (TRUE, 'B', 'Carta', FALSE), (TRUE, 'C', 'Carta', TRUE)"
+        )
+        cursore.execute(
+            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, prezzo_unitario) VALUES"
+            " (1, 1, 2, 4.5), (1, 2, 1, 12), (2, 1, 1, 4), (3, 2, 4, 12)"
+        )
+        cursore.execute(
+            "SELECT"
+            " SUM(op.prezzo_unitario * op.quantita) FILTER (WHERE o.metodo_pagamento = 'Contanti') AS contanti,"
+            " SUM(op.prezzo_unitario * op.quantita) FILTER (WHERE o.metodo_pagamento = 'Carta') AS carta"
+            " FROM ordini_prodotti op JOIN ordini o ON o.id = op.ordine_id"
+        )
+        attesi = cursore.fetchone()
+        connessione.commit()
+
+    totali = _statistiche_da_db()["totali"]
+    assert totali["ordini_totali"] == 3
+    assert totali["ordini_completati"] == 2
+    assert totali["totale_contanti"] == float(attesi["contanti"])
+    assert totali["totale_carta"] == float(attesi["carta"])
+    assert totali["totale_incasso"] == float(attesi["contanti"] + attesi["carta"])
+
+
+def test_incassi_ai_prezzi_salvati_negli_ordini(cliente, monkeypatch):
+    monkeypatch.setattr(services, "emissione_sicura", lambda *args, **kwargs: None)
+    _prepara_admin_e_prodotti(cliente)
+    services.costruisci_dati_statistiche()
+
+    id_ordine = _crea_ordine(cliente, "Contanti", [{"id": 1, "quantita": 2}, {"id": 2, "quantita": 1}])
+    # Il listino cambia dopo l'ordine: l'incasso resta quello battuto in cassa.
+    risposta = cliente.put("/api/prodotti/1", json={
+        "nome": "Birra", "categoria_dashboard": "Bar", "prezzo": 6, "quantita": 50, "disponibile": True,
+    })
+    assert risposta.status_code == 200
+    risposta = cliente.put(f"/api/ordini/{id_ordine}", json={
+        "nome_cliente": "Statistiche", "numero_tavolo": "", "numero_persone": "", "metodo_pagamento": "Carta",
+    })
+    assert risposta.status_code == 200
+    _crea_ordine(cliente, "Contanti", [{"id": 1, "quantita": 1}])
+
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "SELECT SUM(totale) FILTER (WHERE metodo_pagamento = 'Contanti') AS contanti,"
+            " SUM(totale) FILTER (WHERE metodo_pagamento = 'Carta') AS carta FROM ordini"
+        )
+        salvati = cursore.fetchone()
+
+    for totali in (services.costruisci_dati_statistiche()["totali"], _statistiche_da_db()["totali"]):
+        assert totali["totale_carta"] == float(salvati["carta"]) == 21.0
+        assert totali["totale_contanti"] == float(salvati["contanti"]) == 6.0
+        assert totali["totale_incasso"] == 27.0
+
+    pdf = cliente.get("/api/statistiche/report")
+    assert pdf.status_code == 200
+    assert rb"Incasso totale \(EUR\): 27.00" in pdf.data
+
+    assert cliente.delete(f"/api/ordini/{id_ordine}").status_code == 200
+    assert services.costruisci_dati_statistiche()["totali"]["totale_incasso"] == 6.0
+
+
+def test_scansione_unica_senza_ordini(cliente):
+    totali = _statistiche_da_db()["totali"]
+    assert totali["ordini_totali"] == 0
+    assert totali["totale_incasso"] == 0
+
+
+def test_pianificatore_accorpa_richieste(cliente, monkeypatch):
+    avviati = []
+    aggiornamenti = []
+    monkeypatch.setattr(services.socketio, "start_background_task", lambda funzione: avviati.append(funzione))
+    monkeypatch.setattr(services.socketio, "sleep", lambda secondi: None)
+    monkeypatch.setattr(services, "_contatori_pianificatore", {"richieste": 0, "accorpate": 0, "esecuzioni": 0})
+
+    def aggiorna_con_richieste_concorrenti():
+        # Richieste arrivate durante il ricalcolo: una sola esecuzione successiva.
+        if not aggiornamenti:
+            for _ in range(3):
+                services.pianifica_aggiornamento_statistiche()
+        aggiornamenti.append(1)
+
+    monkeypatch.setattr(services, "aggiorna_statistiche", aggiorna_con_richieste_concorrenti)
+
+    for _ in range(50):
+        services.pianifica_aggiornamento_statistiche()
+    assert len(avviati) == 1
+
+    avviati[0]()
+    assert len(aggiornamenti) == 2
+    assert not services._pianificatore_attivo
+    assert services.contatori_pianificatore_statistiche() == {"richieste": 53, "accorpate": 51, "esecuzioni": 2}
+
+    # A pianificatore fermo una nuova richiesta avvia un nuovo task.
+    services.pianifica_aggiornamento_statistiche()
+    assert len(avviati) == 2
+
+
+def test_snapshot_condiviso_e_di_sola_lettura(cliente):
+    _prepara_admin_e_prodotti(cliente)
+    primo = services.snapshot_statistiche()
+    assert services.snapshot_statistiche() is primo
+    with pytest.raises(TypeError):
+        primo.dati["totali"]["ordini_totali"] = 99
+
+    services.statistiche_cambia_completati(1)
+    secondo = services.snapshot_statistiche()
+    assert secondo.versione > primo.versione
+    assert primo.dati["totali"]["ordini_completati"] == 0
+    assert json.loads(secondo.json)["totali"]["ordini_completati"] == 1
+
+    risposta = cliente.get("/api/statistiche")
+    assert risposta.status_code == 200
+    assert risposta.data == secondo.json
+
+
+def test_riallineamento_fallito_libera_il_contatore(cliente, monkeypatch):
+    _prepara_admin_e_prodotti(cliente)
+    services.costruisci_dati_statistiche()
+
+    def applicazione_fallita(applica):
+        raise RuntimeError("applicazione fallita")
+
+    monkeypatch.setattr(services, "_applica_delta_statistiche", applicazione_fallita)
+    with pytest.raises(RuntimeError):
+        services.statistiche_riallinea({1})
+    assert services._ricalcoli_in_corso == 0
+
+    # Anche se il task viene interrotto durante la lettura (GreenletExit non è un'Exception).
+    def lettura_interrotta():
+        raise GreenletExit
+
+    monkeypatch.setattr(services, "_leggi_contatori_ordini", lettura_interrotta)
+    with pytest.raises(GreenletExit):
+        services.statistiche_riallinea({1})
+    assert services._ricalcoli_in_corso == 0
@@ -0,0 +1,120 @@
+import services
+from app import ottieni_db
+
+# ==================== Tabellone dashboard ====================
+
+
+def _prepara(cliente):
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("admin_tabellone", "hash", True, True),
+        )
+        id_admin = cursore.fetchone()["id"]
+        cursore.executemany(
+            "INSERT INTO prodotti"
+            " (id, nome, prezzo, categoria_menu, categoria_dashboard, quantita, venduti)"
+            " VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            [
+                (1, "Birra", 4.5, "Bevande", "Bar", 100, 0),
+                (2, "Carbonara", 12.0, "Primi", "Cucina", 100, 0),
+            ],
+        )
+        connessione.commit()
+
+    with cliente.session_transaction() as sessione:
+        sessione["id_utente"] = id_admin
+        sessione["username"] = "admin_tabellone"
+        sessione["is_admin"] = True
+
+
+def _nuovo_ordine(cliente, nome, prodotti):
+    risposta = cliente.post("/api/ordini/", json={
+        "asporto": True,
+        "nome_cliente": nome,
+        "metodo_pagamento": "Contanti",
+        "prodotti": prodotti,
+    })
+    assert risposta.status_code == 201
+
+
+def test_tabellone_aggiornato_senza_rileggere_il_db(cliente, monkeypatch):
+    _prepara(cliente)
+    # Carica il tabellone (vuoto), poi vieta ogni ulteriore lettura completa.
+    services.ottieni_ordini_per_categoria("Cucina")
+    def lettura_vietata():
+        raise AssertionError("il tabellone non deve essere riletto dal DB")
+
+    monkeypatch.setattr(services, "_carica_tabellone_da_db", lettura_vietata)
+
+    _nuovo_ordine(cliente, "Primo", [{"id": 1, "quantita": 1}, {"id": 2, "quantita": 2}])
+    _nuovo_ordine(cliente, "Secondo", [{"id": 2, "quantita": 1}])
+
+    dati = cliente.get("/api/dashboard/cucina").get_json()
+    assert [o["nome_cliente"] for o in dati["non_completati"]] == ["Primo", "Secondo"]
+    assert dati["non_completati"][0]["prodotti"] == [{"nome": "Carbonara", "quantita": 2}]
+    id_primo = dati["non_completati"][0]["id"]
+    id_secondo = dati["non_completati"][1]["id"]
+
+    assert cliente.patch(f"/api/ordini/{id_primo}/stato/Cucina").status_code == 200
+    risposta = cliente.put(f"/api/ordini/{id_primo}", json={
+        "nome_cliente": "Primo bis", "numero_tavolo": "", "numero_persone": "", "metodo_pagamento": "Contanti",
+    })
+    assert risposta.status_code == 200
+    assert cliente.delete(f"/api/ordini/{id_secondo}").status_code == 200
+
+    non_completati, completati = services.ottieni_ordini_per_categoria("cucina")
+    assert [(o["nome_cliente"], o["stato"]) for o in non_completati] == [("Primo bis", "In Preparazione")]
+    assert completati == []
+    bar, _ = services.ottieni_ordini_per_categoria("Bar")
+    assert [(o["nome_cliente"], o["stato"]) for o in bar] == [("Primo bis", "In Attesa")]
+
+
+def test_tabellone_tiene_solo_i_completati_recenti(cliente, monkeypatch):
+    _prepara(cliente)
+    monkeypatch.setattr(services, "_COMPLETATI_TABELLONE_MAX", 2)
+    for nome in ("A", "B", "C", "D"):
+        _nuovo_ordine(cliente, nome, [{"id": 1, "quantita": 1}])
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute("UPDATE ordini_prodotti SET stato = 'Completato' WHERE ordine_id IN (1, 2, 3)")
+        connessione.commit()
+
+    # Caricamento iniziale: la query limita già i completati.
+    services.invalida_tabellone()
+    non_completati, completati = services.ottieni_ordini_per_categoria("Bar")
+    assert [o["nome_cliente"] for o in non_completati] == ["D"]
+    assert [o["nome_cliente"] for o in completati] == ["C", "B"]
+
+    services.tabellone_cambia_stato(4, "Bar", "Completato")
+    _, completati = services.ottieni_ordini_per_categoria("Bar")
+    assert [o["nome_cliente"] for o in completati] == ["D", "C"]
+
+
+def test_completati_precedenti_con_paginazione_keyset(cliente, monkeypatch):
+    _prepara(cliente)
+    monkeypatch.setattr(services, "_COMPLETATI_TABELLONE_MAX", 2)
+    for nome in ("A", "B", "C", "D", "E"):
+        _nuovo_ordine(cliente, nome, [{"id": 1, "quantita": 1}])
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute("UPDATE ordini_prodotti SET stato = 'Completato'")
+        connessione.commit()
+    services.invalida_tabellone()
+
+    dati = cliente.get("/api/dashboard/bar").get_json()
+    assert [o["nome_cliente"] for o in dati["completati"]] == ["E", "D"]
+
+    nomi = []
+    cursore_pagina = dati["cursore_completati"]
+    while cursore_pagina:
+        risposta = cliente.get("/api/dashboard/bar/completati", query_string=dict(cursore_pagina, limite=2))
+        assert risposta.status_code == 200
+        pagina = risposta.get_json()
+        nomi += [o["nome_cliente"] for o in pagina["completati"]]
+        cursore_pagina = pagina["cursore_completati"]
+    assert nomi == ["C", "B", "A"]
+
+    assert cliente.get("/api/dashboard/bar/completati?id=1").status_code == 400
@@ -1,91 +1,114 @@
-from app import cambia_stato_automatico, ottieni_db, socketio, timer_attivi
+import services
+from app import completa_scaduti, ottieni_db
 
 # ==================== Timer ====================
 
 
-def test_timer_completa_ordine_pronto(cliente):
+def _inserisci_ordine_pronto(id_ordine, id_prodotto, categoria="Cucina", secondi_fa=60):
     with ottieni_db() as connessione:
         cursore = connessione.cursor()
         cursore.execute(
             "INSERT INTO prodotti"
             " (id, nome, prezzo, quantita, venduti, categoria_menu, categoria_dashboard)"
-            " VALUES (200, 'Test Timer', 10, 100, 0, 'Test', 'Cucina')"
+            " VALUES (%s, %s, 10, 100, 0, 'Test', %s)",
+            (id_prodotto, f"Test Timer {id_prodotto}", categoria),
         )
         cursore.execute(
             "INSERT INTO ordini"
             " (id, nome_cliente, numero_tavolo, data_ordine, completato, asporto, metodo_pagamento)"
-            " VALUES (200, 'Timer Client', 1, CURRENT_TIMESTAMP, FALSE, FALSE, 'Contanti')"
+            " VALUES (%s, 'Timer Client', 1, CURRENT_TIMESTAMP, FALSE, FALSE, 'Contanti')",
+            (id_ordine,),
         )
         cursore.execute(
-            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato)"
-            " VALUES (200, 200, 1, 'Pronto')"
+            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato, pronto_dal)"
+            " VALUES (%s, %s, 1, 'Pronto', CURRENT_TIMESTAMP - %s * INTERVAL '1 second')",
+            (id_ordine, id_prodotto, secondi_fa),
         )
         connessione.commit()
 
-    ordine_id = 200
-    categoria = "Cucina"
-    id_timer = "test-timer-id"
-    chiave_timer = (ordine_id, categoria)
-
-    timer_attivi[chiave_timer] = {"annulla": False, "id": id_timer}
-
-    original_sleep = socketio.sleep
-    socketio.sleep = lambda x: None
-    try:
-        cambia_stato_automatico(ordine_id, categoria, id_timer)
-    finally:
-        socketio.sleep = original_sleep
 
+def _stato_ordine(id_ordine):
     with ottieni_db() as connessione:
         cursore = connessione.cursor()
-        cursore.execute(
-            "SELECT stato FROM ordini_prodotti WHERE ordine_id = 200 AND prodotto_id = 200"
-        )
+        cursore.execute("SELECT stato FROM ordini_prodotti WHERE ordine_id = %s", (id_ordine,))
         stato = cursore.fetchone()["stato"]
-        cursore.execute("SELECT completato FROM ordini WHERE id = 200")
-        completato = cursore.fetchone()["completato"]
+        cursore.execute("SELECT completato FROM ordini WHERE id = %s", (id_ordine,))
+        return stato, cursore.fetchone()["completato"]
 
-    assert stato == "Completato"
-    assert completato == True
-    assert chiave_timer not in timer_attivi
 
+def test_timer_completa_ordine_pronto(cliente):
+    _inserisci_ordine_pronto(200, 200)
 
-def test_timer_non_modifica_se_annullato(cliente):
-    with ottieni_db() as connessione:
-        cursore = connessione.cursor()
-        cursore.execute(
-            "INSERT INTO prodotti"
-            " (id, nome, prezzo, quantita, venduti, categoria_menu, categoria_dashboard)"
-            " VALUES (201, 'Test Timer Cancel', 10, 100, 0, 'Test', 'Cucina')"
-        )
-        cursore.execute(
-            "INSERT INTO ordini"
-            " (id, nome_cliente, numero_tavolo, data_ordine, completato, asporto, metodo_pagamento)"
-            " VALUES (201, 'Timer Client 2', 1, CURRENT_TIMESTAMP, FALSE, FALSE, 'Contanti')"
-        )
-        cursore.execute(
-            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato)"
-            " VALUES (201, 201, 1, 'Pronto')"
-        )
-        connessione.commit()
+    _inserisci_ordine_pronto(206, 206, secondi_fa=0)
 
-    ordine_id = 201
-    categoria = "Cucina"
-    id_timer = "test-cancel-id"
-    chiave_timer = (ordine_id, categoria)
+    completa_scaduti()
 
-    timer_attivi[chiave_timer] = {"annulla": True, "id": id_timer}
+    assert _stato_ordine(200) == ("Completato", True)
+    # Passato a "Pronto" da poco: il timeout non è ancora trascorso.
+    assert _stato_ordine(206) == ("Pronto", False)
 
-    original_sleep = socketio.sleep
-    socketio.sleep = lambda x: None
-    try:
-        cambia_stato_automatico(ordine_id, categoria, id_timer)
-    finally:
-        socketio.sleep = original_sleep
 
-    with ottieni_db() as connessione:
-        cursore = connessione.cursor()
-        cursore.execute(
-            "SELECT stato FROM ordini_prodotti WHERE ordine_id = 201 AND prodotto_id = 201"
-        )
-        assert cursore.fetchone()["stato"] == "Pronto"
+def test_timer_non_modifica_se_annullato(cliente, monkeypatch):
+    _inserisci_ordine_pronto(201, 201)
+    monkeypatch.setattr(services, "_tick_attuale", lambda: 0)
+
+    services.pianifica_completamento(201, "Cucina")
+    assert services.annulla_completamento(201, "Cucina")
+
+    assert services._estrai_scaduti(1000) == []
+    assert _stato_ordine(201) == ("Pronto", False)
+
+
+def test_timer_riprogrammato_scade_una_volta(cliente, monkeypatch):
+    tick = [0]
+    monkeypatch.setattr(services, "_tick_attuale", lambda: tick[0])
+
+    services.pianifica_completamento(202, "Cucina")
+    tick[0] = 5
+    services.pianifica_completamento(202, "Cucina")
+
+    # La prima scadenza è stata sostituita dalla riprogrammazione; la nuova cade un
+    # tick dopo il timeout, mai prima di pronto_dal su DB.
+    assert services._estrai_scaduti(25) == []
+    assert services._estrai_scaduti(26) == [(202, "Cucina")]
+    assert services._estrai_scaduti(200) == []
+
+
+def test_timer_scaduti_insieme_un_emit_per_categoria(cliente, monkeypatch):
+    _inserisci_ordine_pronto(203, 203, "Cucina")
+    _inserisci_ordine_pronto(204, 204, "Cucina")
+    _inserisci_ordine_pronto(205, 205, "Bar")
+    emessi = []
+    monkeypatch.setattr(services, "emissione_delta_dashboard", lambda categoria, delta: emessi.append((categoria, delta)))
+
+    righe = completa_scaduti()
+
+    assert len(righe) == 3
+    delta_per_categoria = dict(emessi)
+    assert len(emessi) == 2
+    assert delta_per_categoria["Bar"] == {"tipo": "stati", "ids": [205], "stato": "Completato"}
+    assert sorted(delta_per_categoria["Cucina"]["ids"]) == [203, 204]
+    assert all(_stato_ordine(i) == ("Completato", True) for i in (203, 204, 205))
+
+
+def test_timer_annullato_su_db_non_completa(cliente):
+    _inserisci_ordine_pronto(207, 207)
+
+    # Il ritorno da "Pronto" (da qualunque worker) azzera la scadenza su DB.
+    assert services.applica_transizione_stato(207, "Cucina")["nuovo_stato"] == "In Preparazione"
+
+    assert completa_scaduti() == []
+    assert _stato_ordine(207) == ("In Preparazione", False)
+
+
+def test_recupero_timer_dopo_riavvio(cliente, monkeypatch):
+    _inserisci_ordine_pronto(208, 208, secondi_fa=60)
+    _inserisci_ordine_pronto(209, 209, "Bar", secondi_fa=4)
+    monkeypatch.setattr(services, "_tick_attuale", lambda: 0)
+
+    assert services.recupera_completamenti() == 1
+
+    # Scaduto durante il fermo: completato subito; l'altro torna sulla ruota col residuo.
+    assert _stato_ordine(208) == ("Completato", True)
+    assert _stato_ordine(209) == ("Pronto", False)
+    assert 12 <= services._scadenze_timer[(209, "Bar")] <= 14
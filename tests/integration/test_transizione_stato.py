@@ -0,0 +1,75 @@
+import threading
+
+import services
+from app import ottieni_db
+
+# ==================== Transizione di stato atomica ====================
+
+
+def _prepara_ordine_due_categorie():
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO prodotti"
+            " (id, nome, prezzo, quantita, venduti, categoria_menu, categoria_dashboard)"
+            " VALUES (700, 'Spritz', 5, 100, 0, 'Bevande', 'Bar'),"
+            " (701, 'Lasagna', 9, 100, 0, 'Primi', 'Cucina')"
+        )
+        cursore.execute(
+            "INSERT INTO ordini (id, nome_cliente, asporto, metodo_pagamento)"
+            " VALUES (700, 'Transizioni', TRUE, 'Contanti')"
+        )
+        cursore.execute(
+            "INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato)"
+            " VALUES (700, 700, 1, 'In Attesa'), (700, 701, 1, 'In Attesa')"
+        )
+        connessione.commit()
+
+
+def _completato():
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute("SELECT completato FROM ordini WHERE id = 700")
+        return cursore.fetchone()["completato"]
+
+
+def test_doppio_tocco_avanza_in_sequenza(cliente):
+    _prepara_ordine_due_categorie()
+    esiti = []
+    partenza = threading.Barrier(2)
+
+    def tocco():
+        partenza.wait()
+        esiti.append(services.applica_transizione_stato(700, "Bar"))
+
+    thread = [threading.Thread(target=tocco) for _ in range(2)]
+    for t in thread:
+        t.start()
+    for t in thread:
+        t.join()
+
+    # Le due transizioni si serializzano sulle righe: nessuna legge lo stesso stato.
+    assert sorted((e["stato_precedente"], e["nuovo_stato"]) for e in esiti) == [
+        ("In Attesa", "In Preparazione"),
+        ("In Preparazione", "Pronto"),
+    ]
+
+
+def test_completato_solo_con_tutte_le_categorie(cliente, monkeypatch):
+    _prepara_ordine_due_categorie()
+    monkeypatch.setattr(services, "_TIMEOUT_AUTO_COMPLETAMENTO_SEC", 0)
+    monkeypatch.setattr(services, "emissione_sicura", lambda *args, **kwargs: None)
+
+    assert services.applica_transizione_stato(700, "Sconosciuta") is None
+
+    # Il completamento arriva solo dal timeout di "Pronto", una categoria alla volta.
+    services.applica_transizione_stato(700, "Bar")
+    assert services.applica_transizione_stato(700, "Bar")["nuovo_stato"] == "Pronto"
+    assert services.completa_scaduti()[0]["ordine_chiuso"] is False
+    assert not _completato()
+    assert services.applica_transizione_stato(700, "Bar")["nuovo_stato"] is None
+
+    services.applica_transizione_stato(700, "Cucina")
+    services.applica_transizione_stato(700, "Cucina")
+    assert services.completa_scaduti()[0]["ordine_chiuso"] is True
+    assert _completato()
@@ -0,0 +1,196 @@
+"""Confronta il ricalcolo completo delle statistiche con le query storiche.
+
+Popola un database dedicato (DB_NAME, default "byte_bite_benchmark") con un
+dataset sintetico e misura il tempo medio delle due strategie:
+
+    python tests/load/benchmark_statistiche.py --ordini 100000 --ripetizioni 5
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+
+radice_progetto = Path(__file__).resolve().parents[2]
+if str(radice_progetto) not in sys.path:
+    sys.path.insert(0, str(radice_progetto))
+
+os.environ.setdefault("DB_NAME", "byte_bite_benchmark")
+
+import services  # noqa: E402
+from db import chiudi_pool, ottieni_db  # noqa: E402
+
+# ==================== Query storiche ====================
+
+# Una query per ciascun totale, come prima della scansione unica.
+QUERY_STORICHE = [
+    "SELECT COUNT(*) AS c FROM ordini",
+    "SELECT COUNT(*) AS c FROM ordini WHERE completato = TRUE",
+    """
+    SELECT SUM(p.prezzo * op.quantita) AS totale
+    FROM ordini_prodotti op
+    JOIN prodotti p ON p.id = op.prodotto_id
+    """,
+    """
+    SELECT SUM(p.prezzo * op.quantita) AS totale
+    FROM ordini_prodotti op
+    JOIN prodotti p ON p.id = op.prodotto_id
+    JOIN ordini o ON o.id = op.ordine_id
+    WHERE o.metodo_pagamento = 'Contanti'
+    """,
+    """
+    SELECT SUM(p.prezzo * op.quantita) AS totale
+    FROM ordini_prodotti op
+    JOIN prodotti p ON p.id = op.prodotto_id
+    JOIN ordini o ON o.id = op.ordine_id
+    WHERE o.metodo_pagamento = 'Carta'
+    """,
+    """
+    SELECT EXTRACT(HOUR FROM data_ordine)::INT AS ora, COUNT(*) AS totale
+    FROM ordini
+    GROUP BY EXTRACT(HOUR FROM data_ordine)
+    ORDER BY ora ASC
+    """,
+    """
+    SELECT p.categoria_dashboard, SUM(op.quantita) AS totale
+    FROM ordini_prodotti op
+    JOIN prodotti p ON p.id = op.prodotto_id
+    GROUP BY p.categoria_dashboard
+    """,
+    "SELECT nome, venduti FROM prodotti ORDER BY venduti DESC LIMIT 10",
+]
+
+
+def _crea_database():
+    """Crea il database di benchmark se manca e applica lo schema."""
+    parametri = {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+        "user": os.getenv("DB_USER", "byte_bite_user"),
+        "password": os.getenv("DB_PASSWORD", "secure_password_change_me"),
+    }
+    connessione = psycopg2.connect(database="postgres", **parametri)
+    connessione.autocommit = True
+    with connessione.cursor() as cursore:
+        cursore.execute("SELECT 1 FROM pg_database WHERE datname = %s", (os.environ["DB_NAME"],))
+        if not cursore.fetchone():
+            cursore.execute(f'CREATE DATABASE "{os.environ["DB_NAME"]}"')
+    connessione.close()
+
+    with ottieni_db() as connessione:
+        with connessione.cursor() as cursore:
+            for file_schema in ("db.sql", "db_postgres.sql"):
+                cursore.execute((radice_progetto / file_schema).read_text())
+        connessione.commit()
+
+
+def _popola(numero_ordini, numero_prodotti):
+    """Genera ordini con 1-4 righe ciascuno, distribuiti su 12 ore di servizio."""
+    with ottieni_db() as connessione:
+        with connessione.cursor() as cursore:
+            cursore.execute(
+                "TRUNCATE ordini_prodotti, ordini, prodotti RESTART IDENTITY CASCADE"
+            )
+            cursore.execute(
+                """
+                INSERT INTO prodotti (nome, prezzo, categoria_menu, categoria_dashboard, disponibile, quantita, venduti)
+                SELECT
+                    'Prodotto ' || g,
+                    (1 + g %% 15)::NUMERIC(10, 2),
+                    'Menu',
+                    (ARRAY['Bar', 'Cucina', 'Gnoccheria', 'Griglia', 'Coperto'])[1 + g %% 5],
+                    TRUE,
+                    1000000,
+                    0
+                FROM generate_series(1, %s) AS g
+                """,
+                (numero_prodotti,),
+            )
+            cursore.execute(
+                """
+                INSERT INTO ordini (asporto, data_ordine, nome_cliente, numero_tavolo, numero_persone,
+                                    metodo_pagamento, completato)
+                SELECT
+                    g %% 7 = 0,
+                    date_trunc('day', now()) + interval '11 hours' + (g %% 720) * interval '1 minute',
+                    'Cliente ' || g,
+                    1 + g %% 40,
+                    1 + g %% 6,
+                    CASE WHEN g %% 3 = 0 THEN 'Carta' ELSE 'Contanti' END,
+                    g %% 4 <> 0
+                FROM generate_series(1, %s) AS g
+                """,
+                (numero_ordini,),
+            )
+            cursore.execute(
+                """
+                INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato, prezzo_unitario)
+                SELECT o.id, p.id, 1 + (o.id + r) %% 3, 'Completato', p.prezzo
+                FROM ordini o
+                CROSS JOIN generate_series(0, 3) AS r
+                JOIN prodotti p ON p.id = 1 + (o.id * 7 + r * 13) %% %s
+                WHERE r < 1 + o.id %% 4
+                """,
+                (numero_prodotti,),
+            )
+            cursore.execute(
+                """
+                UPDATE prodotti p SET venduti = s.totale
+                FROM (SELECT prodotto_id, SUM(quantita) AS totale FROM ordini_prodotti GROUP BY prodotto_id) s
+                WHERE s.prodotto_id = p.id
+                """
+            )
+            cursore.execute("ANALYZE")
+        connessione.commit()
+
+
+def _esegui_storico():
+    with ottieni_db() as connessione:
+        with connessione.cursor() as cursore:
+            for query in QUERY_STORICHE:
+                cursore.execute(query)
+                cursore.fetchall()
+        connessione.commit()
+
+
+def _esegui_scansione_unica():
+    services._componi_statistiche(services._carica_stato_statistiche_da_db())
+
+
+def _misura(funzione, ripetizioni):
+    funzione()  # riscaldamento cache PostgreSQL
+    durate = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        funzione()
+        durate.append(time.perf_counter() - inizio)
+    return min(durate), sum(durate) / len(durate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ordini", type=int, default=100_000)
+    parser.add_argument("--prodotti", type=int, default=60)
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    parser.add_argument("--senza-popolamento", action="store_true",
+                        help="riusa il dataset già presente nel database")
+    argomenti = parser.parse_args()
+
+    _crea_database()
+    if not argomenti.senza_popolamento:
+        print(f"Popolamento di {argomenti.ordini} ordini...")
+        _popola(argomenti.ordini, argomenti.prodotti)
+
+    minimo_storico, medio_storico = _misura(_esegui_storico, argomenti.ripetizioni)
+    minimo_nuovo, medio_nuovo = _misura(_esegui_scansione_unica, argomenti.ripetizioni)
+    chiudi_pool()
+
+    print(f"Query storiche   : min {minimo_storico * 1000:8.1f} ms, media {medio_storico * 1000:8.1f} ms")
+    print(f"Scansione unica  : min {minimo_nuovo * 1000:8.1f} ms, media {medio_nuovo * 1000:8.1f} ms")
+    print(f"Speedup (media)  : {medio_storico / medio_nuovo:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
 import bcrypt
-from app import ottieni_db
+from flask import g
+
+import auth
+import routes
+from app import app, ottieni_db
 
 # ==================== Accesso ====================
 
@@ -44,3 +48,100 @@ def test_pagina_protetta_richiede_accesso(cliente):
     assert risposta.status_code == 200
     assert b"Login" in risposta.data
     assert "login" in risposta.request.path
+
+
+def test_permessi_in_cache_e_invalidati_dalla_modifica_utente(cliente, monkeypatch):
+    monkeypatch.setattr(auth, "_contatori_permessi", {"trovati": 0, "mancati": 0})
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("admin_permessi", "hash", True, True),
+        )
+        id_admin = cursore.fetchone()["id"]
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("cassa_permessi", "hash", False, True),
+        )
+        id_cassa = cursore.fetchone()["id"]
+        cursore.execute(
+            "INSERT INTO permessi_pagine (utente_id, pagina) VALUES (%s, %s)",
+            (id_cassa, "CASSA"),
+        )
+        connessione.commit()
+
+    with cliente.session_transaction() as sessione:
+        sessione["id_utente"] = id_cassa
+        sessione["username"] = "cassa_permessi"
+
+    assert cliente.get("/cassa/").status_code == 200
+    assert cliente.get("/cassa/").status_code == 200
+    assert cliente.get("/amministrazione/").status_code == 403
+    assert auth.contatori_permessi() == {"trovati": 2, "mancati": 1}
+
+    # La revoca dal pannello ha effetto alla richiesta successiva, senza attendere il TTL.
+    with app.test_client() as amministratore:
+        with amministratore.session_transaction() as sessione:
+            sessione["id_utente"] = id_admin
+            sessione["username"] = "admin_permessi"
+        risposta = amministratore.put(f"/api/utenti/{id_cassa}", json={
+            "username": "cassa_permessi",
+            "attivo": True,
+            "permessi": ["DASHBOARD"],
+        })
+        assert risposta.status_code == 200
+
+    assert cliente.get("/cassa/").status_code == 403
+    assert auth.contatori_permessi() == {"trovati": 2, "mancati": 2}
+
+
+def test_password_fuori_loop_con_coda_limitata(cliente, monkeypatch):
+    monkeypatch.setattr(auth, "_COSTO_BCRYPT", 4)
+    monkeypatch.setattr(auth, "_contatori_password",
+                        {"richieste": 0, "rifiutate": 0, "attesa_totale_ms": 0.0, "attesa_max_ms": 0.0})
+    password_hash = auth.genera_hash_password("segreta")
+    assert password_hash.startswith("$2b$04$")
+    assert auth.verifica_password("segreta", password_hash)
+    assert not auth.verifica_password("sbagliata", password_hash)
+
+    with ottieni_db() as connessione:
+        connessione.cursor().execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo) VALUES (%s, %s, %s, %s)",
+            ("utente_coda", password_hash, False, True),
+        )
+        connessione.commit()
+
+    # Coda piena: il login viene rimandato senza toccare bcrypt.
+    monkeypatch.setattr(auth, "_PASSWORD_CODA_MAX", 0)
+    risposta = cliente.post("/login/", data={"username": "utente_coda", "password": "segreta"})
+    assert risposta.status_code == 503
+
+    contatori = auth.contatori_password()
+    assert contatori["richieste"] == 3
+    assert contatori["rifiutate"] == 1
+    assert 0 <= contatori["attesa_media_ms"] <= contatori["attesa_max_ms"]
+
+
+def test_verifica_password_senza_connessione_della_richiesta(cliente, monkeypatch):
+    password_hash = bcrypt.hashpw(b"segreta", bcrypt.gensalt(4)).decode()
+    with ottieni_db() as connessione:
+        connessione.cursor().execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo) VALUES (%s, %s, %s, %s)",
+            ("utente_pool", password_hash, False, True),
+        )
+        connessione.commit()
+
+    # Durante la verifica la connessione letta per l'hash è già tornata al pool.
+    connessioni_in_verifica = []
+
+    def verifica(password, hash_salvato):
+        connessioni_in_verifica.append(g.get("_db_connessione"))
+        return auth.verifica_password(password, hash_salvato)
+
+    monkeypatch.setattr(routes, "verifica_password", verifica)
+    risposta = cliente.post("/login/", data={"username": "utente_pool", "password": "segreta"})
+
+    assert risposta.status_code == 302
+    assert connessioni_in_verifica == [None]
@@ -0,0 +1,78 @@
+import select
+import time
+
+import pytest
+
+import coda_socketio
+from app import socketio
+from coda_socketio import GestoreCodaPostgres, opzioni_coda_socketio
+from db import apri_connessione_dedicata
+
+# ==================== Coda Socket.IO ====================
+
+
+def test_opzioni_coda_secondo_configurazione(monkeypatch):
+    monkeypatch.setattr(coda_socketio, "_CODA", "")
+    assert opzioni_coda_socketio() == {}
+
+    monkeypatch.setattr(coda_socketio, "_CODA", "redis://localhost:6379/0")
+    assert opzioni_coda_socketio() == {"message_queue": "redis://localhost:6379/0", "channel": "byte_bite_socketio"}
+
+    monkeypatch.setattr(coda_socketio, "_CODA", "postgres")
+    assert isinstance(opzioni_coda_socketio()["client_manager"], GestoreCodaPostgres)
+
+
+def _ricevi(connessione):
+    assert select.select([connessione], [], [], 5)[0]
+    connessione.poll()
+    return connessione.notifies.pop(0).payload
+
+
+@pytest.mark.parametrize("dimensione", [10, 20000])
+def test_pubblicazione_raggiunge_chi_ascolta(cliente, dimensione):
+    gestore = GestoreCodaPostgres(channel="test_coda_socketio")
+    dati = {"method": "emit", "event": "delta_dashboard", "data": {"note": "x" * dimensione}, "room": "Bar"}
+
+    connessione = apri_connessione_dedicata()
+    try:
+        with connessione.cursor() as cursore:
+            cursore.execute('LISTEN "test_coda_socketio"')
+        gestore._publish(dati)
+        payload = _ricevi(connessione)
+
+        # I messaggi oltre il limite di NOTIFY viaggiano come riferimento alla tabella.
+        assert payload.startswith("#") == (dimensione > coda_socketio._PAYLOAD_NOTIFY_MAX)
+        assert gestore._leggi_payload(payload) == dati
+    finally:
+        connessione.close()
+
+
+def test_ascolto_della_coda_non_blocca_il_loop(cliente):
+    gestore = GestoreCodaPostgres(channel="test_coda_loop")
+    ascolto = gestore._listen()
+    dati = {"method": "emit", "event": "aggiorna_dashboard", "data": {"categoria": "Bar"}, "room": "Bar"}
+    ricevuti = []
+    battiti = []
+
+    def battito():
+        while not ricevuti:
+            battiti.append(time.monotonic())
+            socketio.sleep(0.01)
+
+    # Task veri (il fixture li disattiva), come il thread del PubSubManager.
+    avvia = type(socketio).start_background_task
+    avvia(socketio, lambda: ricevuti.append(next(ascolto)))
+    avvia(socketio, battito)
+    try:
+        socketio.sleep(1.5)
+        gestore._publish(dati)
+        scadenza = time.monotonic() + 5
+        while not ricevuti and time.monotonic() < scadenza:
+            socketio.sleep(0.05)
+    finally:
+        ascolto.close()
+
+    assert ricevuti == [dati]
+    pause = [dopo - prima for prima, dopo in zip(battiti, battiti[1:])]
+    assert len(battiti) > 20
+    assert max(pause) < 0.5
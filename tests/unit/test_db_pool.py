@@ -0,0 +1,135 @@
+import time
+
+import pytest
+from flask import g
+
+import db as pool_db
+from app import app, socketio
+from db import PoolConnessioni, PoolEsaurito, esegui_query, ottieni_db, transazione
+
+# ==================== Pool connessioni ====================
+
+
+def avvia_task(funzione):
+    # Il fixture cliente disattiva start_background_task: qui serve quello vero.
+    return type(socketio).start_background_task(socketio, funzione)
+
+
+def test_pool_riusa_la_stessa_connessione_fisica(cliente):
+    with ottieni_db() as connessione:
+        pid_primo = connessione.get_backend_pid()
+    with ottieni_db() as connessione:
+        pid_secondo = connessione.get_backend_pid()
+
+    assert pid_primo == pid_secondo
+
+
+def test_pool_imposta_fuso_orario_una_volta(cliente):
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute("SHOW TIME ZONE")
+        assert cursore.fetchone()["TimeZone"] == "Europe/Rome"
+
+
+def test_pool_annulla_transazioni_non_confermate(cliente):
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO prodotti"
+            " (nome, prezzo, categoria_menu, categoria_dashboard, quantita, venduti)"
+            " VALUES ('Non confermato', 1, 'Test', 'Bar', 1, 0)"
+        )
+
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute("SELECT COUNT(*) AS c FROM prodotti WHERE nome = 'Non confermato'")
+        assert cursore.fetchone()["c"] == 0
+
+
+def test_pool_limitato_solleva_errore_se_esaurito(cliente):
+    pool = PoolConnessioni(minimo=0, massimo=1, timeout=0.05, intervallo_verifica=30)
+    connessione = pool.acquisisci()
+    try:
+        with pytest.raises(PoolEsaurito):
+            pool.acquisisci()
+    finally:
+        pool.rilascia(connessione)
+    pool.chiudi()
+
+
+def test_pool_scarta_connessioni_chiuse(cliente):
+    pool = PoolConnessioni(minimo=1, massimo=1, timeout=0.05, intervallo_verifica=30)
+    connessione = pool.acquisisci()
+    # Simula una connessione caduta mentre era in uso.
+    connessione.close()
+    pool.rilascia(connessione)
+
+    nuova = pool.acquisisci()
+    assert nuova is not connessione
+    assert not nuova.closed
+    pool.rilascia(nuova)
+    pool.chiudi()
+
+
+# ==================== Connessione per richiesta ====================
+
+
+def test_richiesta_condivide_una_sola_connessione(cliente):
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        primo = esegui_query("SELECT pg_backend_pid() AS pid", uno=True)["pid"]
+        secondo = esegui_query("SELECT pg_backend_pid() AS pid", uno=True)["pid"]
+        assert primo == secondo
+        assert g.get("_db_connessione") is not None
+
+    # A fine richiesta la connessione torna al pool.
+    assert pool_db._pool._liberi
+
+
+def test_transazione_annulla_tutte_le_scritture_in_caso_di_errore(cliente):
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        with pytest.raises(RuntimeError):
+            with transazione():
+                esegui_query(
+                    "INSERT INTO prodotti"
+                    " (nome, prezzo, categoria_menu, categoria_dashboard, quantita, venduti)"
+                    " VALUES ('In transazione', 1, 'Test', 'Bar', 1, 0)",
+                    commit=True,
+                )
+                raise RuntimeError("errore simulato")
+
+    riga = esegui_query("SELECT COUNT(*) AS c FROM prodotti WHERE nome = 'In transazione'", uno=True)
+    assert riga["c"] == 0
+
+
+def test_pool_esaurito_non_blocca_le_altre_greenlet(cliente):
+    # Più task concorrenti che connessioni: chi attende deve lasciare girare chi
+    # tiene una connessione, altrimenti nessuno la restituisce prima del timeout.
+    pool = PoolConnessioni(minimo=0, massimo=2, timeout=5, intervallo_verifica=30)
+    completati = []
+    errori = []
+
+    def usa_connessione():
+        try:
+            connessione = pool.acquisisci()
+            try:
+                socketio.sleep(0.1)
+                with connessione.cursor() as cursore:
+                    cursore.execute("SELECT 1")
+            finally:
+                pool.rilascia(connessione)
+            completati.append(1)
+        except Exception as e:
+            errori.append(e)
+
+    inizio = time.monotonic()
+    for _ in range(6):
+        avvia_task(usa_connessione)
+    while len(completati) + len(errori) < 6 and time.monotonic() - inizio < 10:
+        socketio.sleep(0.02)
+    pool.chiudi()
+
+    assert errori == []
+    assert len(completati) == 6
+    assert time.monotonic() - inizio < 3
@@ -113,6 +113,41 @@ def test_aggiungi_ordine_fallisce_se_prodotto_esaurito(cliente):
             assert len(cursore.fetchall()) == 0
 
 
+
+def test_ordine_con_piu_prodotti_annullato_per_intero(cliente):
+    _imposta_cassa(cliente)
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.executemany(
+            "INSERT INTO prodotti"
+            " (id, nome, prezzo, categoria_menu, categoria_dashboard, quantita, venduti)"
+            " VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            [
+                (3, "Birra", 4.0, "Bevande", "Bar", 10, 0),
+                (4, "Tiramisu", 5.0, "Dolci", "Cucina", 1, 0),
+            ],
+        )
+        connessione.commit()
+
+    risposta = cliente.post("/api/ordini/", json={
+        "asporto": True,
+        "nome_cliente": "Famiglia",
+        "metodo_pagamento": "Contanti",
+        "prodotti": [
+            {"id": 3, "quantita": 4, "nome": "Birra"},
+            {"id": 4, "quantita": 3, "nome": "Tiramisu"},
+        ],
+    })
+    assert risposta.status_code == 500
+    assert risposta.get_json()["errore"] == "Prodotto Tiramisu esaurito o insufficiente."
+
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute("SELECT id, quantita, venduti FROM prodotti ORDER BY id")
+        assert [(r["id"], r["quantita"], r["venduti"]) for r in cursore.fetchall()] == [(3, 10, 0), (4, 1, 0)]
+        cursore.execute("SELECT COUNT(*) AS n FROM ordini")
+        assert cursore.fetchone()["n"] == 0
+
 def test_ordine_asporto_ignora_tavolo(cliente, monkeypatch):
     _imposta_cassa(cliente)
     monkeypatch.setattr("app.emissione_sicura", lambda *args, **kwargs: None)
@@ -0,0 +1,100 @@
+import bcrypt
+
+import sessioni
+from app import app, ottieni_db
+from sessioni import ArchivioMemoria, ArchivioPostgres, InterfacciaSessioniServer
+
+# ==================== Sessioni lato server ====================
+
+
+def test_sessioni_in_memoria_con_disattivazione_immediata(cliente, monkeypatch):
+    archivio = ArchivioMemoria()
+    monkeypatch.setattr(app, "session_interface", InterfacciaSessioniServer(archivio))
+    monkeypatch.setattr(sessioni, "_archivio", archivio)
+
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("admin_sessioni", "hash", True, True),
+        )
+        id_admin = cursore.fetchone()["id"]
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("cassa_sessioni", bcrypt.hashpw(b"cassa", bcrypt.gensalt(rounds=4)).decode(), False, True),
+        )
+        id_cassa = cursore.fetchone()["id"]
+        cursore.execute(
+            "INSERT INTO permessi_pagine (utente_id, pagina) VALUES (%s, %s)",
+            (id_cassa, "CASSA"),
+        )
+        connessione.commit()
+
+    risposta = cliente.post("/login/", data={"username": "cassa_sessioni", "password": "cassa"})
+    assert risposta.status_code == 302
+    # Il cookie porta solo l'id opaco; snapshot e dati restano sul server.
+    cookie = risposta.headers["Set-Cookie"].split(";", 1)[0]
+    sid = cookie.split("=", 1)[1]
+    assert len(sid) == 43
+    assert archivio.leggi(sid)["utente"] == {
+        "id": id_cassa, "username": "cassa_sessioni", "is_admin": False, "attivo": True,
+    }
+    assert cliente.get("/cassa/").status_code == 200
+
+    # La disattivazione dal pannello chiude subito la sessione aperta.
+    with app.test_client() as amministratore:
+        with amministratore.session_transaction() as sessione:
+            sessione["id_utente"] = id_admin
+            sessione["username"] = "admin_sessioni"
+        risposta = amministratore.put(f"/api/utenti/{id_cassa}", json={
+            "username": "cassa_sessioni",
+            "attivo": False,
+            "permessi": ["CASSA"],
+        })
+        assert risposta.status_code == 200
+
+    assert archivio.leggi(sid) is None
+    risposta = cliente.get("/cassa/")
+    assert risposta.status_code == 302
+    assert "/login/" in risposta.headers["Location"]
+
+
+def test_sessioni_postgres_lette_una_volta_e_mai_per_i_file_statici(cliente, monkeypatch):
+    archivio = ArchivioPostgres(durata_cache=60)
+    monkeypatch.setattr(app, "session_interface", InterfacciaSessioniServer(archivio))
+    monkeypatch.setattr(sessioni, "_archivio", archivio)
+    letture = []
+    esegui_query = sessioni.esegui_query
+
+    def conta_letture(query, *argomenti, **opzioni):
+        if query.lstrip().startswith("SELECT"):
+            letture.append(query)
+        return esegui_query(query, *argomenti, **opzioni)
+
+    monkeypatch.setattr(sessioni, "esegui_query", conta_letture)
+
+    with ottieni_db() as connessione:
+        cursore = connessione.cursor()
+        cursore.execute(
+            "INSERT INTO utenti (username, password_hash, is_admin, attivo)"
+            " VALUES (%s, %s, %s, %s) RETURNING id",
+            ("cassa_cache", bcrypt.hashpw(b"cassa", bcrypt.gensalt(rounds=4)).decode(), False, True),
+        )
+        id_cassa = cursore.fetchone()["id"]
+        cursore.execute("INSERT INTO permessi_pagine (utente_id, pagina) VALUES (%s, %s)", (id_cassa, "CASSA"))
+        connessione.commit()
+
+    risposta = cliente.post("/login/", data={"username": "cassa_cache", "password": "cassa"})
+    assert risposta.status_code == 302
+    sid = risposta.headers["Set-Cookie"].split(";", 1)[0].split("=", 1)[1]
+    assert cliente.get("/cassa/").status_code == 200
+    assert cliente.get("/cassa/").status_code == 200
+    assert cliente.get("/static/css/style.css").status_code in (200, 304)
+    # Una sola SELECT: le richieste successive usano la cache, i file statici nulla.
+    assert len(letture) == 1
+
+    # Il logout invalida la copia in cache: la sessione non torna in vita.
+    assert cliente.post("/logout/").status_code == 302
+    assert archivio.leggi(sid) is None